@@ -1,7 +1,10 @@
 #!/usr/bin/python
 
+from multiprocessing import Pool, shared_memory
+
 import numpy as np
 import numpy.matlib
+from tests import singletest
 
 # "Traduction" des fonctions de l'énoncé en Python (Python 3.5)
 # Une différence importante par rapport à Matlab est que les indices de tableau commencent ici à 0 et non à 1
@@ -35,23 +38,19 @@ def poly_mult (a, b, mod_pol):
 
 
 def find_inverse(n, modulo):
+	# Inverse multiplicatif dans GF(2^8): le groupe multiplicatif est d'ordre 255, donc n^-1 = n^254
+	# (l'algorithme d'Euclide étendu sur les entiers ne donne pas l'inverse polynomial)
 	if n == 0:
 		return 0
-	n = n % modulo
-	# extended Euclidean algorithm
-	# u * n + v * modulo = r
-	u = [0, 1]
-	v = [1, 0]
-	r = [modulo, n]
-	q = [0]
-	i = 1
-	while r[i] > 0:
-		q.append(r[i-1] // r[i]) # integral quotient
-		r.append(r[i - 1] - q[i] * r[i])
-		if r[i+1] > 0:
-			u.append(u[i - 1] - q[i] * u[i])
-		i += 1
-	return u[-1]
+	result = 1
+	power = n
+	exponent = 254
+	while exponent > 0:
+		if exponent & 1:
+			result = poly_mult(result, power, modulo)
+		power = poly_mult(power, power, modulo)
+		exponent >>= 1
+	return result
 
 
 def aff_trans(b_in):
@@ -81,16 +80,16 @@ def s_box_inversion(s_box):
 	return inv_s_box
 
 
-def rcon_gen():
+def rcon_gen(nb_constantes=10):
 	# Création des constantes de rondes:
-	# 10 rounds et 14 constantes
+	# une constante tous les Nk mots de la clé étendue, soit 10 pour AES-128, 8 pour AES-192 et 7 pour AES-256
 	mod_pol = 0b100011011
-	rcon = np.zeros((10,), np.int)
+	rcon = np.zeros((nb_constantes,), np.int64)
 	rcon[0] = 1
-	for i in range(1, 10):
+	for i in range(1, nb_constantes):
 		rcon[i] = poly_mult(rcon[i-1], 2, mod_pol)
 	# The other (LSB) three bytes of all round constants are zeros
-	rcon = np.concatenate((np.matrix(rcon).T, np.zeros((10, 3), np.int)), axis=1)
+	rcon = np.concatenate((rcon[:, None], np.zeros((nb_constantes, 3), np.int64)), axis=1)
 	return rcon
 
 
@@ -120,25 +119,35 @@ def inv_poly_mat_gen():
 	return inv_poly_mat
 
 
+def nb_rounds(w):
+	# Nombre de rounds d'après la taille de la clé étendue: 10, 12 ou 14 (44, 52 ou 60 mots)
+	return np.shape(w)[0] // 4 - 1
+
+
 def key_expansion(key, s_box, rcon):
-	# creates the 44x4-byte expanded key W
+	# creates the 44x4, 52x4 or 60x4-byte expanded key W (AES-128, AES-192, AES-256)
 	key = np.array(key)
-	if ( not isinstance(key,np.ndarray)) | key.size != 16 :
-		raise Exception('Key has to be a vector (not a cell array) with 16 elements.')
+	if ( not isinstance(key,np.ndarray)) | (key.size not in (16, 24, 32)):
+		raise Exception('Key has to be a vector (not a cell array) with 16, 24 or 32 elements.')
 	if np.any(key < 0) | np.any(key > 255):
 		raise Exception('Elements of key vector have to be bytes (0 <= key(i) <= 255).')
-	w = np.reshape(key, (4, 4))
-	# Loop over the rest of the 44 rows of the expanded key
-	for i in range(4, 44):
+	nk = key.size // 4
+	nb_words = 4 * (nk + 7)
+	w = np.reshape(key, (nk, 4))
+	# Loop over the rest of the rows of the expanded key
+	for i in range(nk, nb_words):
 		temp = np.array(w[i - 1])
-		if i % 4 == 0:
+		if i % nk == 0:
 			# Rotation cyclique de 1 vers la gauche
 			temp = np.roll(temp, -1)
 			# Substitutions des octets par la S-box
 			temp = sub_bytes (temp, s_box)
-			r = rcon[i/4 - 1]
+			r = rcon[i//nk - 1]
 			temp = temp ^ r
-		to_add = np.matrix(w[i - 4] ^ temp)
+		elif nk > 6 and i % nk == 4:
+			# AES-256: substitution supplémentaire au milieu de chaque groupe de 8 mots
+			temp = sub_bytes (temp, s_box)
+		to_add = np.reshape(w[i - nk] ^ temp, (1, 4))
 		w = np.concatenate((w, to_add))
 	return w
 
@@ -157,7 +166,7 @@ def inv_shift_rows(state_in):
 
 def mix_columns(state_in, poly_mat):
 	mod_pol = 0b100011011
-	state_out = np.zeros((4,4), np.int)
+	state_out = np.zeros((4,4), np.int64)
 	for i_col_state in range(4):
 		for i_row_state in range(4):
 			temp_state = 0
@@ -168,7 +177,7 @@ def mix_columns(state_in, poly_mat):
 	return state_out
 
 
-def cipher(plaintext, w, s_box, poly_mat, nb_ronde_max=9, **dict):
+def cipher(plaintext, w, s_box, poly_mat, nb_ronde_max=None, **dict):
 	if 'verbose' in dict and dict['verbose'] == True:
 		verbose = True
 	else:
@@ -177,8 +186,10 @@ def cipher(plaintext, w, s_box, poly_mat, nb_ronde_max=9, **dict):
 		raise Exception('Plaintext has to be a vector (not a cell array) with 16 elements.')
 	if np.any(plaintext < 0) | np.any(plaintext > 255):
 		raise Exception('Elements of plaintext vector have to be bytes (0 <= plaintext(i) <= 255).')
-	if ( not isinstance(w, np.ndarray)) | (w.shape != (44, 4)):
+	if ( not isinstance(w, np.ndarray)) | (w.shape not in ((44, 4), (52, 4), (60, 4))):
 		raise Exception('w is of shape: ' + str(w.shape))
+	if nb_ronde_max is None:
+		nb_ronde_max = nb_rounds(w) - 1
 	if np.any(w < 0) | np.any(w > 255):
 		raise Exception('Elements of key array w have to be bytes (0 <= w(i,j) <= 255).')
 	state = np.reshape(plaintext, (4, 4)).T # On transpose pour avoir les memes resultats que dans Matlab
@@ -211,7 +222,7 @@ def cipher(plaintext, w, s_box, poly_mat, nb_ronde_max=9, **dict):
 	state = shift_rows(state)
 	if verbose:
 		print('Round ' + str(nb_ronde_max + 1) + ' après shift_rows: ' + str(state))
-	round_key = w[40:44].T
+	round_key = w[-4:].T
 	state = add_round_key(state, round_key)
 	if verbose:
 		print('État final: ' + str(state))
@@ -223,14 +234,14 @@ def inv_cipher(ciphertext, w, inv_s_box, inv_poly_mat):
 		raise Exception('Plaintext has to be a vector (not a cell array) with 16 elements.')
 	if np.any(ciphertext < 0) | np.any(ciphertext > 255):
 		raise Exception('Elements of ciphertext vector have to be bytes (0 <= ciphertext(i) <= 255).')
-	if (not isinstance(w, np.ndarray)) | (w.shape != (44, 4)):
+	if (not isinstance(w, np.ndarray)) | (w.shape not in ((44, 4), (52, 4), (60, 4))):
 		raise Exception('w is of shape: ' + str(w.shape))
 	if np.any(w < 0) | np.any(w > 255):
 		raise Exception('Elements of key array w have to be bytes (0 <= w(i,j) <= 255).')
 	state = np.reshape(ciphertext, (4, 4)).T  # On transpose pour avoir les memes resultats que dans Matlab
-	round_key = w[40:44].T
+	round_key = w[-4:].T
 	state = add_round_key(state, round_key)
-	for i_round in range(9, 0, -1):
+	for i_round in range(nb_rounds(w) - 1, 0, -1):
 		state = inv_shift_rows (state)
 		state = sub_bytes(state, inv_s_box)
 		round_key = w[np.arange(4) + 4*i_round].T
@@ -244,7 +255,31 @@ def inv_cipher(ciphertext, w, inv_s_box, inv_poly_mat):
 	return np.reshape(np.array(state.T), (16,))  # On reprend la transposée pour contrebalancer le debut
 
 
-def chiffrement(plaintext, key, r=9):
+def inv_key_expansion(w, inv_poly_mat):
+	# Clé étendue du chiffrement inverse équivalent (FIPS-197, 5.3.5): InvMixColumns appliqué une fois pour toutes
+	# aux clés des rounds intermédiaires, ce qui permet d'échanger InvMixColumns et AddRoundKey au déchiffrement
+	dw = np.array(w)
+	for i_round in range(1, nb_rounds(w)):
+		dw[4*i_round:4*i_round + 4] = mix_columns(dw[4*i_round:4*i_round + 4].T, inv_poly_mat).T
+	return dw
+
+
+def eq_inv_cipher(ciphertext, dw, inv_s_box, inv_poly_mat):
+	# Même structure de rounds que cipher(): sub_bytes, shift_rows, mix_columns puis add_round_key
+	state = np.reshape(ciphertext, (4, 4)).T
+	state = add_round_key(state, dw[-4:].T)
+	for i_round in range(nb_rounds(dw) - 1, 0, -1):
+		state = sub_bytes(state, inv_s_box)
+		state = inv_shift_rows(state)
+		state = mix_columns(state, inv_poly_mat)
+		state = add_round_key(state, dw[np.arange(4) + 4*i_round].T)
+	state = sub_bytes(state, inv_s_box)
+	state = inv_shift_rows(state)
+	state = add_round_key(state, dw[0:4].T)
+	return np.reshape(np.array(state.T), (16,))
+
+
+def chiffrement(plaintext, key, r=None):
 	s_box = s_box_gen()
 	rcon = rcon_gen()
 	poly_mat = poly_mat_gen()
@@ -259,3 +294,671 @@ def dechiffrement(ciphertext, key):
 	inv_poly_mat = inv_poly_mat_gen()
 	k = key_expansion (key, s_box, rcon)
 	return inv_cipher(ciphertext, k, inv_s_box, inv_poly_mat)
+
+
+# Moteurs rapides
+# Les tables sont calculées une seule fois à l'import du module, puis partagées par tous les contextes AES.
+# Chaque moteur travaille sur un tableau de blocs de forme (N, 16) en uint8 (ordre des octets de FIPS-197).
+
+S_BOX = s_box_gen()
+INV_S_BOX = s_box_inversion(S_BOX)
+RCON = rcon_gen()
+POLY_MAT = poly_mat_gen()
+INV_POLY_MAT = inv_poly_mat_gen()
+
+
+def gf_mult_table(factor):
+	mod_pol = 0b100011011
+	return np.array([poly_mult(i, factor, mod_pol) for i in range(256)], np.uint32)
+
+
+MUL2 = gf_mult_table(2)
+MUL3 = gf_mult_table(3)
+MUL9 = gf_mult_table(9)
+MUL11 = gf_mult_table(11)
+MUL13 = gf_mult_table(13)
+MUL14 = gf_mult_table(14)
+
+# T-tables: Te0[x] = (2.S[x], S[x], S[x], 3.S[x]), les trois autres sont des rotations d'un octet vers la droite
+TE0 = (MUL2[S_BOX] << 24) | (S_BOX.astype(np.uint32) << 16) | (S_BOX.astype(np.uint32) << 8) | MUL3[S_BOX]
+TE1 = (TE0 >> 8) | (TE0 << 24)
+TE2 = (TE0 >> 16) | (TE0 << 16)
+TE3 = (TE0 >> 24) | (TE0 << 8)
+# Td0[x] = (14.Si[x], 9.Si[x], 13.Si[x], 11.Si[x]) pour le chiffrement inverse équivalent
+TD0 = (MUL14[INV_S_BOX] << 24) | (MUL9[INV_S_BOX] << 16) | (MUL13[INV_S_BOX] << 8) | MUL11[INV_S_BOX]
+TD1 = (TD0 >> 8) | (TD0 << 24)
+TD2 = (TD0 >> 16) | (TD0 << 16)
+TD3 = (TD0 >> 24) | (TD0 << 8)
+# Permutation des octets d'un bloc pour inv_shift_rows (l'octet (ligne r, colonne c) est à l'indice r + 4c)
+INV_SHIFT_ROWS = np.array([r + 4 * ((c - r) % 4) for c in range(4) for r in range(4)])
+
+
+def expanded_key(key):
+	if isinstance(key, (bytes, bytearray)):
+		key = list(key)
+	return np.array(key_expansion(key, S_BOX, RCON), np.uint8)
+
+
+def round_words(w):
+	# Mots de 32 bits (big endian) de la clé étendue
+	w = np.array(w, np.uint32)
+	return (w[:, 0] << 24) | (w[:, 1] << 16) | (w[:, 2] << 8) | w[:, 3]
+
+
+def as_blocks(data):
+	blocks = np.frombuffer(bytes(data), np.uint8)
+	if blocks.size % 16 != 0:
+		raise Exception('Data length has to be a multiple of 16 bytes.')
+	return blocks.reshape((-1, 16))
+
+
+class ReferenceEngine:
+	# Moteur de référence: les fonctions de l'énoncé, bloc par bloc
+	def __init__(self, w, dw):
+		self.w = np.array(w, np.int64)
+
+	def encrypt(self, blocks):
+		return np.array([cipher(np.array(block, np.int64), self.w, S_BOX, POLY_MAT) for block in blocks],
+						np.uint8).reshape((-1, 16))
+
+	def decrypt(self, blocks):
+		return np.array([inv_cipher(np.array(block, np.int64), self.w, INV_S_BOX, INV_POLY_MAT) for block in blocks],
+						np.uint8).reshape((-1, 16))
+
+
+class TTableEngine:
+	# T-tables sur des entiers Python, bloc par bloc: pas de surcoût numpy, adapté aux messages courts
+	def __init__(self, w, dw):
+		self.rk = [int(word) for word in round_words(w)]
+		self.dk = [int(word) for word in round_words(dw)]
+		self.nr = nb_rounds(w)
+		self.te = [TE0.tolist(), TE1.tolist(), TE2.tolist(), TE3.tolist()]
+		self.td = [TD0.tolist(), TD1.tolist(), TD2.tolist(), TD3.tolist()]
+		self.sbox = S_BOX.tolist()
+		self.inv_sbox = INV_S_BOX.tolist()
+
+	def encrypt_block(self, block):
+		te0, te1, te2, te3 = self.te
+		sbox = self.sbox
+		rk = self.rk
+		s0 = int.from_bytes(block[0:4], 'big') ^ rk[0]
+		s1 = int.from_bytes(block[4:8], 'big') ^ rk[1]
+		s2 = int.from_bytes(block[8:12], 'big') ^ rk[2]
+		s3 = int.from_bytes(block[12:16], 'big') ^ rk[3]
+		for r in range(1, self.nr):
+			k = 4 * r
+			t0 = te0[s0 >> 24] ^ te1[(s1 >> 16) & 0xff] ^ te2[(s2 >> 8) & 0xff] ^ te3[s3 & 0xff] ^ rk[k]
+			t1 = te0[s1 >> 24] ^ te1[(s2 >> 16) & 0xff] ^ te2[(s3 >> 8) & 0xff] ^ te3[s0 & 0xff] ^ rk[k + 1]
+			t2 = te0[s2 >> 24] ^ te1[(s3 >> 16) & 0xff] ^ te2[(s0 >> 8) & 0xff] ^ te3[s1 & 0xff] ^ rk[k + 2]
+			t3 = te0[s3 >> 24] ^ te1[(s0 >> 16) & 0xff] ^ te2[(s1 >> 8) & 0xff] ^ te3[s2 & 0xff] ^ rk[k + 3]
+			s0, s1, s2, s3 = t0, t1, t2, t3
+		# Dernier round: pas de mix_columns
+		k = 4 * self.nr
+		out = b''
+		for c, s in enumerate(((s0, s1, s2, s3), (s1, s2, s3, s0), (s2, s3, s0, s1), (s3, s0, s1, s2))):
+			word = (sbox[s[0] >> 24] << 24) | (sbox[(s[1] >> 16) & 0xff] << 16) | (sbox[(s[2] >> 8) & 0xff] << 8) \
+				| sbox[s[3] & 0xff]
+			out += (word ^ rk[k + c]).to_bytes(4, 'big')
+		return out
+
+	def decrypt_block(self, block):
+		# Chiffrement inverse équivalent: même structure que encrypt_block, avec les Td-tables et la clé dk
+		td0, td1, td2, td3 = self.td
+		inv_sbox = self.inv_sbox
+		dk = self.dk
+		k = 4 * self.nr
+		s0 = int.from_bytes(block[0:4], 'big') ^ dk[k]
+		s1 = int.from_bytes(block[4:8], 'big') ^ dk[k + 1]
+		s2 = int.from_bytes(block[8:12], 'big') ^ dk[k + 2]
+		s3 = int.from_bytes(block[12:16], 'big') ^ dk[k + 3]
+		for r in range(self.nr - 1, 0, -1):
+			k = 4 * r
+			t0 = td0[s0 >> 24] ^ td1[(s3 >> 16) & 0xff] ^ td2[(s2 >> 8) & 0xff] ^ td3[s1 & 0xff] ^ dk[k]
+			t1 = td0[s1 >> 24] ^ td1[(s0 >> 16) & 0xff] ^ td2[(s3 >> 8) & 0xff] ^ td3[s2 & 0xff] ^ dk[k + 1]
+			t2 = td0[s2 >> 24] ^ td1[(s1 >> 16) & 0xff] ^ td2[(s0 >> 8) & 0xff] ^ td3[s3 & 0xff] ^ dk[k + 2]
+			t3 = td0[s3 >> 24] ^ td1[(s2 >> 16) & 0xff] ^ td2[(s1 >> 8) & 0xff] ^ td3[s0 & 0xff] ^ dk[k + 3]
+			s0, s1, s2, s3 = t0, t1, t2, t3
+		out = b''
+		for c, s in enumerate(((s0, s3, s2, s1), (s1, s0, s3, s2), (s2, s1, s0, s3), (s3, s2, s1, s0))):
+			word = (inv_sbox[s[0] >> 24] << 24) | (inv_sbox[(s[1] >> 16) & 0xff] << 16) \
+				| (inv_sbox[(s[2] >> 8) & 0xff] << 8) | inv_sbox[s[3] & 0xff]
+			out += (word ^ dk[c]).to_bytes(4, 'big')
+		return out
+
+	def encrypt(self, blocks):
+		blocks = np.asarray(blocks, np.uint8)
+		out = b''.join(self.encrypt_block(block.tobytes()) for block in blocks)
+		return np.frombuffer(out, np.uint8).reshape((-1, 16))
+
+	def decrypt(self, blocks):
+		blocks = np.asarray(blocks, np.uint8)
+		out = b''.join(self.decrypt_block(block.tobytes()) for block in blocks)
+		return np.frombuffer(out, np.uint8).reshape((-1, 16))
+
+
+class VectorisedEngine:
+	# T-tables avec numpy sur tous les blocs à la fois: chaque tour est une série de lectures indexées (gather)
+	def __init__(self, w, dw):
+		self.rk = round_words(w)
+		self.dk = round_words(dw)
+		self.nr = nb_rounds(w)
+
+	def encrypt(self, blocks):
+		blocks = np.ascontiguousarray(blocks, np.uint8)
+		words = blocks.view('>u4').astype(np.uint32)
+		rk = self.rk
+		s0 = words[:, 0] ^ rk[0]
+		s1 = words[:, 1] ^ rk[1]
+		s2 = words[:, 2] ^ rk[2]
+		s3 = words[:, 3] ^ rk[3]
+		for r in range(1, self.nr):
+			k = 4 * r
+			t0 = TE0[s0 >> 24] ^ TE1[(s1 >> 16) & 0xff] ^ TE2[(s2 >> 8) & 0xff] ^ TE3[s3 & 0xff] ^ rk[k]
+			t1 = TE0[s1 >> 24] ^ TE1[(s2 >> 16) & 0xff] ^ TE2[(s3 >> 8) & 0xff] ^ TE3[s0 & 0xff] ^ rk[k + 1]
+			t2 = TE0[s2 >> 24] ^ TE1[(s3 >> 16) & 0xff] ^ TE2[(s0 >> 8) & 0xff] ^ TE3[s1 & 0xff] ^ rk[k + 2]
+			t3 = TE0[s3 >> 24] ^ TE1[(s0 >> 16) & 0xff] ^ TE2[(s1 >> 8) & 0xff] ^ TE3[s2 & 0xff] ^ rk[k + 3]
+			s0, s1, s2, s3 = t0, t1, t2, t3
+		k = 4 * self.nr
+		sbox = S_BOX.astype(np.uint32)
+		out = np.empty((blocks.shape[0], 4), np.uint32)
+		for c, s in enumerate(((s0, s1, s2, s3), (s1, s2, s3, s0), (s2, s3, s0, s1), (s3, s0, s1, s2))):
+			out[:, c] = ((sbox[s[0] >> 24] << 24) | (sbox[(s[1] >> 16) & 0xff] << 16) | (sbox[(s[2] >> 8) & 0xff] << 8)
+						| sbox[s[3] & 0xff]) ^ rk[k + c]
+		return out.astype('>u4').view(np.uint8).reshape((-1, 16))
+
+	def decrypt(self, blocks):
+		blocks = np.ascontiguousarray(blocks, np.uint8)
+		words = blocks.view('>u4').astype(np.uint32)
+		dk = self.dk
+		k = 4 * self.nr
+		s0 = words[:, 0] ^ dk[k]
+		s1 = words[:, 1] ^ dk[k + 1]
+		s2 = words[:, 2] ^ dk[k + 2]
+		s3 = words[:, 3] ^ dk[k + 3]
+		for r in range(self.nr - 1, 0, -1):
+			k = 4 * r
+			t0 = TD0[s0 >> 24] ^ TD1[(s3 >> 16) & 0xff] ^ TD2[(s2 >> 8) & 0xff] ^ TD3[s1 & 0xff] ^ dk[k]
+			t1 = TD0[s1 >> 24] ^ TD1[(s0 >> 16) & 0xff] ^ TD2[(s3 >> 8) & 0xff] ^ TD3[s2 & 0xff] ^ dk[k + 1]
+			t2 = TD0[s2 >> 24] ^ TD1[(s1 >> 16) & 0xff] ^ TD2[(s0 >> 8) & 0xff] ^ TD3[s3 & 0xff] ^ dk[k + 2]
+			t3 = TD0[s3 >> 24] ^ TD1[(s2 >> 16) & 0xff] ^ TD2[(s1 >> 8) & 0xff] ^ TD3[s0 & 0xff] ^ dk[k + 3]
+			s0, s1, s2, s3 = t0, t1, t2, t3
+		inv_sbox = INV_S_BOX.astype(np.uint32)
+		out = np.empty((blocks.shape[0], 4), np.uint32)
+		for c, s in enumerate(((s0, s3, s2, s1), (s1, s0, s3, s2), (s2, s1, s0, s3), (s3, s2, s1, s0))):
+			out[:, c] = ((inv_sbox[s[0] >> 24] << 24) | (inv_sbox[(s[1] >> 16) & 0xff] << 16)
+						| (inv_sbox[(s[2] >> 8) & 0xff] << 8) | inv_sbox[s[3] & 0xff]) ^ dk[c]
+		return out.astype('>u4').view(np.uint8).reshape((-1, 16))
+
+
+# Moteur bitslice
+# Le bit j (0 = bit de poids fort) de l'octet i de chaque bloc est rangé dans le plan (j, i).
+# Un plan est un uint64 par groupe de 64 blocs: le bit b du mot correspond au bloc b du groupe.
+# La S-box est évaluée comme un circuit booléen (Boyar et Peralta, 113 portes): aucun accès mémoire ne dépend
+# des données, et chaque opération numpy traite 64 blocs par mot.
+
+LANES = 64
+SHIFT_ROWS = np.array([r + 4 * ((c + r) % 4) for c in range(4) for r in range(4)])
+
+BS_SBOX_CIRCUIT = '''
+t1 = u0 ^ u3
+t2 = u0 ^ u5
+t3 = u0 ^ u6
+t4 = u3 ^ u5
+t5 = u4 ^ u6
+t6 = t1 ^ t5
+t7 = u1 ^ u2
+t8 = u7 ^ t6
+t9 = u7 ^ t7
+t10 = t6 ^ t7
+t11 = u1 ^ u5
+t12 = u2 ^ u5
+t13 = t3 ^ t4
+t14 = t6 ^ t11
+t15 = t5 ^ t11
+t16 = t5 ^ t12
+t17 = t9 ^ t16
+t18 = u3 ^ u7
+t19 = t7 ^ t18
+t20 = t1 ^ t19
+t21 = u6 ^ u7
+t22 = t7 ^ t21
+t23 = t2 ^ t22
+t24 = t2 ^ t10
+t25 = t20 ^ t17
+t26 = t3 ^ t16
+t27 = t1 ^ t12
+m1 = t13 & t6
+m2 = t23 & t8
+m3 = t14 ^ m1
+m4 = t19 & u7
+m5 = m4 ^ m1
+m6 = t3 & t16
+m7 = t22 & t9
+m8 = t26 ^ m6
+m9 = t20 & t17
+m10 = m9 ^ m6
+m11 = t1 & t15
+m12 = t4 & t27
+m13 = m12 ^ m11
+m14 = t2 & t10
+m15 = m14 ^ m11
+m16 = m3 ^ m2
+m17 = m5 ^ t24
+m18 = m8 ^ m7
+m19 = m10 ^ m15
+m20 = m16 ^ m13
+m21 = m17 ^ m15
+m22 = m18 ^ m13
+m23 = m19 ^ t25
+m24 = m22 ^ m23
+m25 = m22 & m20
+m26 = m21 ^ m25
+m27 = m20 ^ m21
+m28 = m23 ^ m25
+m29 = m28 & m27
+m30 = m26 & m24
+m31 = m20 & m23
+m32 = m27 & m31
+m33 = m27 ^ m25
+m34 = m21 & m22
+m35 = m24 & m34
+m36 = m24 ^ m25
+m37 = m21 ^ m29
+m38 = m32 ^ m33
+m39 = m23 ^ m30
+m40 = m35 ^ m36
+m41 = m38 ^ m40
+m42 = m37 ^ m39
+m43 = m37 ^ m38
+m44 = m39 ^ m40
+m45 = m42 ^ m41
+m46 = m44 & t6
+m47 = m40 & t8
+m48 = m39 & u7
+m49 = m43 & t16
+m50 = m38 & t9
+m51 = m37 & t17
+m52 = m42 & t15
+m53 = m45 & t27
+m54 = m41 & t10
+m55 = m44 & t13
+m56 = m40 & t23
+m57 = m39 & t19
+m58 = m43 & t3
+m59 = m38 & t22
+m60 = m37 & t20
+m61 = m42 & t1
+m62 = m45 & t4
+m63 = m41 & t2
+l0 = m61 ^ m62
+l1 = m50 ^ m56
+l2 = m46 ^ m48
+l3 = m47 ^ m55
+l4 = m54 ^ m58
+l5 = m49 ^ m61
+l6 = m62 ^ l5
+l7 = m46 ^ l3
+l8 = m51 ^ m59
+l9 = m52 ^ m53
+l10 = m53 ^ l4
+l11 = m60 ^ l2
+l12 = m48 ^ m51
+l13 = m50 ^ l0
+l14 = m52 ^ m61
+l15 = m55 ^ l1
+l16 = m56 ^ l0
+l17 = m57 ^ l1
+l18 = m58 ^ l8
+l19 = m63 ^ l4
+l20 = l0 ^ l1
+l21 = l1 ^ l7
+l22 = l3 ^ l12
+l23 = l18 ^ l2
+l24 = l15 ^ l9
+l25 = l6 ^ l10
+l26 = l7 ^ l9
+l27 = l8 ^ l10
+l28 = l11 ^ l14
+l29 = l11 ^ l17
+s0 = l6 ^ l24
+s1 = ~(l16 ^ l26)
+s2 = ~(l19 ^ l28)
+s3 = l6 ^ l21
+s4 = l20 ^ l22
+s5 = l25 ^ l29
+s6 = ~(l13 ^ l27)
+s7 = ~(l6 ^ l23)
+'''
+
+
+def compile_circuit(text, inputs, outputs):
+	# Traduit le circuit en une suite de portes (op, a, b, sortie, négation) sur des emplacements de travail.
+	# Un emplacement est réutilisé dès que sa variable n'est plus lue: le circuit tient dans une quarantaine de
+	# plans au lieu de 150, ce qui le garde dans le cache.
+	ops = {'^': np.bitwise_xor, '&': np.bitwise_and}
+	gates = []
+	for line in text.strip().splitlines():
+		name, expr = [s.strip() for s in line.split('=')]
+		negate = expr.startswith('~')
+		a, op, b = expr.strip('~()').split()
+		gates.append((name, ops[op], a, b, negate))
+	last_use = {}
+	for i, (name, op, a, b, negate) in enumerate(gates):
+		last_use[a] = i
+		last_use[b] = i
+	slots = {name: i for i, name in enumerate(inputs)}
+	free = []
+	nslots = len(inputs)
+	program = []
+	for i, (name, op, a, b, negate) in enumerate(gates):
+		for var in (a, b):
+			if last_use[var] == i and var not in outputs and slots[var] not in free:
+				free.append(slots[var])
+		if free:
+			slots[name] = free.pop()
+		else:
+			slots[name] = nslots
+			nslots += 1
+		program.append((op, slots[a], slots[b], slots[name], negate))
+	return program, nslots, [slots[name] for name in outputs]
+
+
+BS_SBOX = compile_circuit(BS_SBOX_CIRCUIT, ['u%d' % i for i in range(8)], ['s%d' % i for i in range(8)])
+
+
+class BitsliceWorkspace:
+	# Plans de travail préalloués pour un nombre de groupes donné
+	def __init__(self, groups):
+		program, nslots, outputs = BS_SBOX
+		self.planes = np.empty((nslots, 16, groups), np.uint64)
+		self.slots = list(self.planes)
+		self.outputs = outputs
+
+	def sub_bytes(self, planes):
+		slots = self.slots
+		self.planes[:8] = planes
+		for op, a, b, out, negate in BS_SBOX[0]:
+			op(slots[a], slots[b], slots[out])
+			if negate:
+				np.invert(slots[out], slots[out])
+		return self.planes[self.outputs]
+
+
+def bs_pack(blocks):
+	# (N, 16) uint8 → (8, 16, G) uint64, N étant complété par des zéros jusqu'à un multiple de 64
+	n = blocks.shape[0]
+	groups = -(-n // LANES)
+	padded = np.zeros((groups * LANES, 16), np.uint8)
+	padded[:n] = blocks
+	# (octet, groupe, bloc dans le groupe): les 64 blocs d'un groupe sont contigus pour packbits
+	lanes = np.ascontiguousarray(padded.reshape((groups, LANES, 16)).transpose((2, 0, 1)))
+	planes = np.empty((8, 16, groups), np.uint64)
+	for j in range(8):
+		planes[j] = np.packbits((lanes >> (7 - j)) & 1, axis=2).view(np.uint64)[:, :, 0]
+	return planes
+
+
+def bs_unpack(planes, n):
+	groups = planes.shape[2]
+	lanes = np.zeros((16, groups, LANES), np.uint8)
+	for j in range(8):
+		lanes |= np.unpackbits(np.ascontiguousarray(planes[j]).reshape((16, groups, 1)).view(np.uint8),
+								axis=2) << (7 - j)
+	return lanes.transpose((1, 2, 0)).reshape((groups * LANES, 16))[:n]
+
+
+def bs_inv_affine(planes):
+	# Inverse de la transformation affine de la S-box: b'_i = b_(i+2) ^ b_(i+5) ^ b_(i+7) ^ 0x05
+	# (indices de bits de poids faible, donc plan 7 - i)
+	b = planes[::-1]
+	out = [b[(i + 2) % 8] ^ b[(i + 5) % 8] ^ b[(i + 7) % 8] for i in range(8)]
+	out[0] = ~out[0]
+	out[2] = ~out[2]
+	return np.stack(out[::-1])
+
+
+def bs_xtime(planes):
+	# Multiplication par x dans GF(2^8), plan par plan (axe 0 = bits, poids fort en premier)
+	out = np.empty_like(planes)
+	out[:7] = planes[1:]
+	out[7] = planes[0]
+	out[3] ^= planes[0]
+	out[4] ^= planes[0]
+	out[6] ^= planes[0]
+	return out
+
+
+ROTATE_ROWS_1 = [1, 2, 3, 0]
+ROTATE_ROWS_2 = [2, 3, 0, 1]
+
+
+def bs_mix_columns(planes):
+	# b_r = 2.a_r ^ 3.a_(r+1) ^ a_(r+2) ^ a_(r+3) = a_r ^ (a_0 ^ a_1 ^ a_2 ^ a_3) ^ x.(a_r ^ a_(r+1))
+	a = planes.reshape((8, 4, 4, -1))  # (bit, colonne, ligne, groupe)
+	out = bs_xtime(a ^ a[:, :, ROTATE_ROWS_1])
+	out ^= a
+	out ^= np.bitwise_xor.reduce(a, axis=2)[:, :, np.newaxis]
+	return out.reshape(planes.shape)
+
+
+def bs_inv_mix_columns(planes):
+	# InvMixColumns(a) = MixColumns(a ^ x^2.(a ^ a_(r+2)))
+	a = planes.reshape((8, 4, 4, -1))
+	t = bs_xtime(bs_xtime(a ^ a[:, :, ROTATE_ROWS_2]))
+	return bs_mix_columns(planes ^ t.reshape(planes.shape))
+
+
+class BitslicedEngine:
+	# Nombre de groupes de 64 blocs traités ensemble: assez pour amortir le coût des appels numpy,
+	# assez peu pour que les plans de travail restent dans le cache
+	chunk_groups = 256
+
+	def __init__(self, w, dw):
+		# Pas de tables: le déchiffrement réutilise le circuit de la S-box, dw ne sert pas
+		w = np.array(w, np.uint8)
+		nr = nb_rounds(w)
+		self.nr = nr
+		# Chaque bit de clé devient un masque de 64 bits (tout à 0 ou tout à 1)
+		bits = np.unpackbits(w.reshape((nr + 1, 16)), axis=1).astype(np.uint64)
+		self.rk = (np.uint64(0) - bits).reshape((nr + 1, 16, 8)).transpose((0, 2, 1))[:, :, :, np.newaxis].copy()
+		self.workspaces = {}
+
+	def workspace(self, groups):
+		if groups not in self.workspaces:
+			self.workspaces[groups] = BitsliceWorkspace(groups)
+		return self.workspaces[groups]
+
+	def encrypt_planes(self, planes):
+		ws = self.workspace(planes.shape[2])
+		planes = planes ^ self.rk[0]
+		for r in range(1, self.nr):
+			planes = bs_mix_columns(ws.sub_bytes(planes)[:, SHIFT_ROWS]) ^ self.rk[r]
+		return ws.sub_bytes(planes)[:, SHIFT_ROWS] ^ self.rk[self.nr]
+
+	def decrypt_planes(self, planes):
+		# S^-1 = A^-1 ∘ S ∘ A^-1, où A est la transformation affine: on réutilise le circuit de la S-box
+		ws = self.workspace(planes.shape[2])
+		planes = planes ^ self.rk[self.nr]
+		for r in range(self.nr - 1, -1, -1):
+			planes = bs_inv_affine(ws.sub_bytes(bs_inv_affine(planes[:, INV_SHIFT_ROWS]))) ^ self.rk[r]
+			if r > 0:
+				planes = bs_inv_mix_columns(planes)
+		return planes
+
+	def run(self, blocks, function):
+		blocks = np.asarray(blocks, np.uint8)
+		planes = bs_pack(blocks)
+		for g in range(0, planes.shape[2], self.chunk_groups):
+			planes[:, :, g:g + self.chunk_groups] = function(planes[:, :, g:g + self.chunk_groups])
+		return bs_unpack(planes, blocks.shape[0])
+
+	def encrypt(self, blocks):
+		return self.run(blocks, self.encrypt_planes)
+
+	def decrypt(self, blocks):
+		return self.run(blocks, self.decrypt_planes)
+
+
+ENGINES = {'reference': ReferenceEngine, 'ttable': TTableEngine, 'vectorised': VectorisedEngine,
+		'bitsliced': BitslicedEngine}
+
+
+def ctr_blocks(counter_block, n):
+	# Blocs de compteur successifs (incrément big endian sur 128 bits)
+	counter = int.from_bytes(bytes(counter_block), 'big')
+	high = np.full(n, counter >> 64, np.uint64)
+	low0 = np.uint64(counter & 0xffffffffffffffff)
+	low = low0 + np.arange(n, dtype=np.uint64)
+	high += (low < low0).astype(np.uint64)
+	return np.stack((high, low), axis=1).astype('>u8').view(np.uint8).reshape((n, 16))
+
+
+class AESContext:
+	def __init__(self, key, engine='vectorised'):
+		if engine not in ENGINES:
+			raise Exception('Unknown AES engine: ' + str(engine))
+		self.engine_name = engine
+		self.w = expanded_key(key)
+		# Clé de déchiffrement calculée une seule fois par contexte
+		self.dw = np.array(inv_key_expansion(self.w, INV_POLY_MAT), np.uint8)
+		self.engine = ENGINES[engine](self.w, self.dw)
+
+	def encrypt_blocks(self, blocks):
+		return self.engine.encrypt(as_blocks(blocks)).tobytes()
+
+	def decrypt_blocks(self, blocks):
+		return self.engine.decrypt(as_blocks(blocks)).tobytes()
+
+	def ctr(self, data, counter_block):
+		# Chiffrement et déchiffrement en mode CTR (la même opération)
+		data = np.frombuffer(bytes(data), np.uint8)
+		nblocks = -(-data.size // 16)
+		keystream = self.engine.encrypt(ctr_blocks(counter_block, nblocks)).reshape(-1)
+		return (data ^ keystream[:data.size]).tobytes()
+
+
+def chiffrement_ctr(data, key, counter_block, engine='vectorised'):
+	return AESContext(key, engine).ctr(data, counter_block)
+
+
+
+# CTR parallèle: les blocs CTR sont indépendants, on découpe donc le message en plages de compteurs.
+# Les processus lisent l'entrée et écrivent la sortie dans des segments de mémoire partagée: seuls les noms des
+# segments, les positions et les compteurs transitent entre processus, jamais les données.
+
+worker_context = None
+
+
+def ctr_worker_init(key, engine):
+	global worker_context
+	worker_context = AESContext(key, engine)
+
+
+def ctr_worker(task):
+	in_name, out_name, offset, length, counter = task
+	shm_in = shared_memory.SharedMemory(in_name)
+	shm_out = shared_memory.SharedMemory(out_name)
+	try:
+		data = np.frombuffer(shm_in.buf, np.uint8, length, offset)
+		out = np.frombuffer(shm_out.buf, np.uint8, length, offset)
+		nblocks = -(-length // 16)
+		keystream = worker_context.engine.encrypt(ctr_blocks(counter.to_bytes(16, 'big'), nblocks)).reshape(-1)
+		np.bitwise_xor(data, keystream[:length], out=out)
+		del data, out
+	finally:
+		shm_in.close()
+		shm_out.close()
+	return length
+
+
+class ParallelCTR:
+	def __init__(self, key, engine='bitsliced', processes=None, chunk_size=1 << 20):
+		if chunk_size < 16:
+			raise Exception('Chunk size has to be at least one block (16 bytes).')
+		self.chunk_size = chunk_size - chunk_size % 16  # chaque plage commence sur une frontière de bloc
+		self.pool = Pool(processes, ctr_worker_init, (bytes(key), engine))
+
+	def ctr_shared(self, shm_in, shm_out, length, counter_block):
+		# Chiffre les length premiers octets de shm_in dans shm_out
+		counter = int.from_bytes(bytes(counter_block), 'big')
+		tasks = [(shm_in.name, shm_out.name, offset, min(self.chunk_size, length - offset),
+				(counter + offset // 16) % (1 << 128)) for offset in range(0, length, self.chunk_size)]
+		return sum(self.pool.imap_unordered(ctr_worker, tasks))
+
+	def ctr(self, data, counter_block):
+		data = memoryview(data).cast('B')
+		length = len(data)
+		if length == 0:
+			return b''
+		shm_in = shared_memory.SharedMemory(create=True, size=length)
+		shm_out = shared_memory.SharedMemory(create=True, size=length)
+		try:
+			shm_in.buf[:length] = data
+			self.ctr_shared(shm_in, shm_out, length, counter_block)
+			return bytes(shm_out.buf[:length])
+		finally:
+			for shm in (shm_in, shm_out):
+				shm.close()
+				shm.unlink()
+
+	def close(self):
+		self.pool.close()
+		self.pool.join()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.close()
+
+
+def chiffrement_ctr_parallele(data, key, counter_block, engine='bitsliced', processes=None, chunk_size=1 << 20):
+	with ParallelCTR(key, engine, processes, chunk_size) as pctr:
+		return pctr.ctr(data, counter_block)
+
+
+def aestests():
+	# Vecteurs de FIPS-197 (annexe C.1) et de SP 800-38A (F.5.1)
+	key = list(range(16))
+	plaintext = bytes.fromhex('00112233445566778899aabbccddeeff')
+	ciphertext = bytes.fromhex('69c4e0d86a7b0430d8cdb78070b4c55a')
+	for engine in ENGINES:
+		ctx = AESContext(key, engine)
+		singletest('ctx.encrypt_blocks(p) == c', ctx=ctx, p=plaintext, c=ciphertext)
+		singletest('ctx.decrypt_blocks(c) == p', ctx=ctx, p=plaintext, c=ciphertext)
+	# AES-192 et AES-256 (annexes C.2 et C.3)
+	for key, ciphertext in ((list(range(24)), bytes.fromhex('dda97ca4864cdfe06eaf70a0ec0d7191')),
+							(list(range(32)), bytes.fromhex('8ea2b7ca516745bfeafc49904b496089'))):
+		for engine in ENGINES:
+			ctx = AESContext(key, engine)
+			singletest('ctx.encrypt_blocks(p) == c', ctx=ctx, p=plaintext, c=ciphertext)
+			singletest('ctx.decrypt_blocks(c) == p', ctx=ctx, p=plaintext, c=ciphertext)
+	key = bytes.fromhex('2b7e151628aed2a6abf7158809cf4f3c')
+	counter = bytes.fromhex('f0f1f2f3f4f5f6f7f8f9fafbfcfdfeff')
+	plaintext = bytes.fromhex('6bc1bee22e409f96e93d7e117393172aae2d8a571e03ac9c9eb76fac45af8e51')
+	ciphertext = bytes.fromhex('874d6191b620e3261bef6864990db6ce9806f66b7970fdff8617187bb9fffdff')
+	for engine in ENGINES:
+		singletest('chiffrement_ctr(p, k, ctr, e) == c', chiffrement_ctr=chiffrement_ctr, p=plaintext, k=key,
+					ctr=counter, e=engine, c=ciphertext)
+	key = bytes.fromhex('603deb1015ca71be2b73aef0857d77811f352c073b6108d72d9810a30914dff4')
+	ciphertext = bytes.fromhex('601ec313775789a5b7a7f504bbf3d228f443e3ca4d62b59aca84e990cacaf5c5')
+	for engine in ENGINES:
+		singletest('chiffrement_ctr(p, k, ctr, e) == c', chiffrement_ctr=chiffrement_ctr, p=plaintext, k=key,
+					ctr=counter, e=engine, c=ciphertext)
+	# Plusieurs groupes de 64 blocs, un groupe incomplet et une retenue sur les 64 bits de poids faible du compteur
+	data = bytes(range(256)) * 37 + b'fin'
+	counter = b'\x00' * 8 + b'\xff' * 8
+	ctx = AESContext(key, 'bitsliced')
+	singletest('ctx.ctr(d, ctr) == chiffrement_ctr(d, k, ctr, "ttable")', ctx=ctx, d=data, ctr=counter, k=key,
+				chiffrement_ctr=chiffrement_ctr)
+	blocks = data[:16 * 150]
+	singletest('ctx.decrypt_blocks(ctx.encrypt_blocks(b)) == b', ctx=ctx, b=blocks)
+	# Chiffrement inverse équivalent de référence
+	ct = np.frombuffer(ctx.encrypt_blocks(blocks[:16]), np.uint8).astype(np.int64)
+	singletest('bytes(eq_inv_cipher(c, ctx.dw.astype(np.int64), INV_S_BOX, INV_POLY_MAT).astype(np.uint8)) == b',
+				eq_inv_cipher=eq_inv_cipher, c=ct, ctx=ctx, np=np, INV_S_BOX=INV_S_BOX, INV_POLY_MAT=INV_POLY_MAT,
+				b=blocks[:16])
+	# Découpage en plages plus petites que le message, dont une incomplète
+	singletest('chiffrement_ctr_parallele(d, k, ctr, "vectorised", 2, 1000) == ctx.ctr(d, ctr)', ctx=ctx, d=data,
+				ctr=counter, k=key, chiffrement_ctr_parallele=chiffrement_ctr_parallele)
+	return True
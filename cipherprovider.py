@@ -0,0 +1,263 @@
+#!/usr/bin/python3
+
+# Registre des implémentations d'AES
+# Les moteurs de aes.py et PyCryptodome sont exposés derrière la même interface que Crypto.Cipher.AES:
+# provider.new(key, mode, iv) renvoie un objet avec encrypt() et decrypt(), qui garde son état entre deux appels.
+# provider.encrypt_cbc_batch(key, ivs, messages) chiffre en CBC plusieurs messages indépendants (un IV chacun).
+
+import os
+import time
+
+import numpy as np
+from Crypto.Cipher import AES
+
+import aes
+from tests import singletest
+
+MODE_ECB = 'ecb'
+MODE_CBC = 'cbc'
+MODE_CTR = 'ctr'
+MODE_CFB = 'cfb'  # CFB-128 (segments de la taille d'un bloc)
+MODES = (MODE_ECB, MODE_CBC, MODE_CTR, MODE_CFB)
+
+BLOCK_SIZE = 16
+
+
+def xorbytes(a, b):
+	return (np.frombuffer(a, np.uint8) ^ np.frombuffer(b, np.uint8)).tobytes()
+
+
+class ModeCipher:
+	# Modes opératoires au-dessus d'un aes.AESContext
+	def __init__(self, context, mode, iv=None):
+		if mode not in MODES:
+			raise Exception('Unknown cipher mode: ' + str(mode))
+		if mode != MODE_ECB and (iv is None or len(iv) != BLOCK_SIZE):
+			raise Exception('IV has to be ' + str(BLOCK_SIZE) + ' bytes long.')
+		self.context = context
+		self.mode = mode
+		self.register = bytes(iv) if iv is not None else None
+		self.counter = int.from_bytes(iv, 'big') if mode == MODE_CTR else 0
+		self.keystream = b''  # reste du dernier bloc de flux (CTR, CFB)
+		self.segment = b''  # octets chiffrés du segment CFB en cours
+
+	def encrypt(self, data):
+		data = bytes(data)
+		if self.mode == MODE_ECB:
+			return self.context.encrypt_blocks(data)
+		elif self.mode == MODE_CBC:
+			out = b''
+			for i in range(0, len(aes.as_blocks(data)) * BLOCK_SIZE, BLOCK_SIZE):
+				self.register = self.context.encrypt_blocks(xorbytes(data[i:i + BLOCK_SIZE], self.register))
+				out += self.register
+			return out
+		elif self.mode == MODE_CTR:
+			return self.ctr(data)
+		return self.cfb(data, False)
+
+	def decrypt(self, data):
+		data = bytes(data)
+		if self.mode == MODE_ECB:
+			return self.context.decrypt_blocks(data)
+		elif self.mode == MODE_CBC:
+			# Tous les blocs chiffrés sont connus: un seul appel au moteur pour tout le message
+			previous = self.register + data[:-BLOCK_SIZE] if data else b''
+			out = xorbytes(self.context.decrypt_blocks(data), previous)
+			if data:
+				self.register = data[-BLOCK_SIZE:]
+			return out
+		elif self.mode == MODE_CTR:
+			return self.ctr(data)
+		return self.cfb(data, True)
+
+	def ctr(self, data):
+		used = min(len(self.keystream), len(data))
+		out = xorbytes(data[:used], self.keystream[:used])
+		self.keystream = self.keystream[used:]
+		rest = data[used:]
+		if rest:
+			nblocks = -(-len(rest) // BLOCK_SIZE)
+			keystream = self.context.encrypt_blocks(aes.ctr_blocks(self.counter.to_bytes(16, 'big'), nblocks))
+			self.counter = (self.counter + nblocks) % (1 << 128)
+			out += xorbytes(rest, keystream[:len(rest)])
+			self.keystream = keystream[len(rest):]
+		return out
+
+	def cfb(self, data, decrypting):
+		# Fin du segment en cours
+		used = min(len(self.keystream), len(data))
+		out = xorbytes(data[:used], self.keystream[:used])
+		self.keystream = self.keystream[used:]
+		self.segment += data[:used] if decrypting else out
+		if self.segment and not self.keystream:
+			self.register = self.segment
+			self.segment = b''
+		rest = data[used:]
+		full = len(rest) - len(rest) % BLOCK_SIZE
+		if decrypting and full:
+			# Au déchiffrement, les entrées du chiffrement sont connues d'avance: un seul appel au moteur
+			inputs = self.register + rest[:full - BLOCK_SIZE]
+			out += xorbytes(rest[:full], self.context.encrypt_blocks(inputs))
+			self.register = rest[full - BLOCK_SIZE:full]
+		else:
+			for i in range(0, full, BLOCK_SIZE):
+				self.register = xorbytes(rest[i:i + BLOCK_SIZE], self.context.encrypt_blocks(self.register))
+				out += self.register
+		if full < len(rest):
+			keystream = self.context.encrypt_blocks(self.register)
+			tail = rest[full:]
+			c = xorbytes(tail, keystream[:len(tail)])
+			self.keystream = keystream[len(tail):]
+			self.segment = tail if decrypting else c
+			out += c
+		return out
+
+
+class NativeProvider:
+	def __init__(self, engine, autoselect=True):
+		self.name = engine
+		self.engine = engine
+		self.autoselect = autoselect
+
+	def new(self, key, mode, iv=None):
+		return ModeCipher(aes.AESContext(bytes(key), self.engine), mode, iv)
+
+	def encrypt_cbc_batch(self, key, ivs, messages):
+		# Les chaînes CBC des messages sont entrelacées: le bloc j de tous les messages encore en cours passe
+		# dans un seul appel au moteur (autant d'appels que de blocs dans le plus long message)
+		engine = aes.AESContext(bytes(key), self.engine).engine
+		lengths = [len(m) // BLOCK_SIZE for m in messages]
+		order = sorted(range(len(messages)), key=lambda i: -lengths[i])  # messages en cours: un préfixe de order
+		longest = lengths[order[0]] if messages else 0
+		plain = np.zeros((len(messages), longest, BLOCK_SIZE), np.uint8)
+		for row, i in enumerate(order):
+			plain[row, :lengths[i]] = aes.as_blocks(messages[i])
+		register = np.frombuffer(bytes(ivs), np.uint8).reshape((-1, BLOCK_SIZE))[order].copy()
+		running = len(messages)
+		for j in range(longest):
+			while lengths[order[running - 1]] <= j:
+				running -= 1
+			register[:running] = engine.encrypt(plain[:running, j] ^ register[:running])
+			plain[:running, j] = register[:running]
+		out = [None] * len(messages)
+		for row, i in enumerate(order):
+			out[i] = plain[row, :lengths[i]].tobytes()
+		return out
+
+
+class PyCryptodomeProvider:
+	name = 'pycryptodome'
+	autoselect = True
+
+	def new(self, key, mode, iv=None):
+		key = bytes(key)
+		if mode == MODE_ECB:
+			return AES.new(key, AES.MODE_ECB)
+		elif mode == MODE_CBC:
+			return AES.new(key, AES.MODE_CBC, bytes(iv))
+		elif mode == MODE_CTR:
+			return AES.new(key, AES.MODE_CTR, nonce=b'', initial_value=bytes(iv))
+		elif mode == MODE_CFB:
+			return AES.new(key, AES.MODE_CFB, bytes(iv), segment_size=128)
+		raise Exception('Unknown cipher mode: ' + str(mode))
+
+	def encrypt_cbc_batch(self, key, ivs, messages):
+		key = bytes(key)
+		return [AES.new(key, AES.MODE_CBC, bytes(ivs[i * BLOCK_SIZE:(i + 1) * BLOCK_SIZE])).encrypt(m)
+				for i, m in enumerate(messages)]
+
+
+PROVIDERS = {}
+
+
+def register(provider):
+	PROVIDERS[provider.name] = provider
+	return provider
+
+
+# Le moteur de référence (un bloc à la fois, multiplications polynomiales en Python) sert à la vérification,
+# il ne participe pas à la sélection automatique
+register(NativeProvider('reference', autoselect=False))
+register(NativeProvider('ttable'))
+register(NativeProvider('vectorised'))
+register(NativeProvider('bitsliced'))
+register(PyCryptodomeProvider())
+
+
+def measure(provider, mode, size, repeat=3, key=b'\x00' * 16):
+	# Débit en Mo/s du chiffrement de size octets (meilleur de repeat essais)
+	data = os.urandom(size - size % BLOCK_SIZE if mode in (MODE_ECB, MODE_CBC) else size)
+	best = None
+	for i in range(repeat):
+		cipher = provider.new(key, mode, None if mode == MODE_ECB else b'\x00' * BLOCK_SIZE)
+		start = time.perf_counter()
+		cipher.encrypt(data)
+		elapsed = time.perf_counter() - start
+		if best is None or elapsed < best:
+			best = elapsed
+	return len(data) / max(best, 1e-9) / 1e6
+
+
+selected = {}
+
+
+def select_provider(name=None, mode=MODE_CTR, size=4096):
+	# name: nom d'un fournisseur, 'auto' ou None; la variable d'environnement AES_PROVIDER sert de configuration.
+	# En mode automatique, le plus rapide sur des messages de size octets est mesuré une fois puis gardé.
+	if name is None:
+		name = os.environ.get('AES_PROVIDER', 'auto')
+	if name != 'auto':
+		if name not in PROVIDERS:
+			raise Exception('Unknown AES provider: ' + str(name))
+		return PROVIDERS[name]
+	if (mode, size) not in selected:
+		candidates = [p for p in PROVIDERS.values() if p.autoselect]
+		selected[(mode, size)] = max(candidates, key=lambda p: measure(p, mode, size, repeat=1))
+	return selected[(mode, size)]
+
+
+def cipherbench(sizes=(16, 256, 4096, 65536, 1 << 20), modes=MODES, providers=None, budget=2.0):
+	# Débit de chaque fournisseur pour chaque mode et taille de message.
+	# Les tailles suivantes sont sautées dès qu'une mesure dépasse budget secondes (moteur de référence...).
+	if providers is None:
+		providers = list(PROVIDERS)
+	results = []
+	print('%-14s %-5s %10s %12s' % ('provider', 'mode', 'size', 'MB/s'))
+	for name in providers:
+		provider = PROVIDERS[name]
+		for mode in modes:
+			for size in sizes:
+				start = time.perf_counter()
+				rate = measure(provider, mode, size)
+				results.append((name, mode, size, rate))
+				print('%-14s %-5s %10d %12.3f' % (name, mode, size, rate))
+				if time.perf_counter() - start > budget:
+					break
+	return results
+
+
+def cipherprovidertests():
+	key = bytes(range(32))
+	iv = bytes(range(100, 116))
+	data = bytes(range(256)) * 3 + b'abc'
+	for name, provider in PROVIDERS.items():
+		if name == 'reference':
+			continue  # trop lent pour ces tailles, déjà vérifié par aes.aestests()
+		for mode in MODES:
+			message = data[:768] if mode in (MODE_ECB, MODE_CBC) else data
+			expected = PROVIDERS['pycryptodome'].new(key, mode, None if mode == MODE_ECB else iv).encrypt(message)
+			# Chiffrement en morceaux irréguliers (état conservé entre les appels), déchiffrement en un seul appel
+			cipher = provider.new(key, mode, None if mode == MODE_ECB else iv)
+			cut = [0, 16, 48, 480, len(message)] if mode in (MODE_ECB, MODE_CBC) else [0, 5, 21, 300, len(message)]
+			encrypted = b''.join(cipher.encrypt(message[cut[i]:cut[i + 1]]) for i in range(len(cut) - 1))
+			singletest('c == e', c=encrypted, e=expected)
+			decrypted = provider.new(key, mode, None if mode == MODE_ECB else iv).decrypt(encrypted)
+			singletest('d == m', d=decrypted, m=message)
+		# Messages CBC en lot (longueurs différentes, dont un vide): mêmes chiffrés qu'un par un
+		messages = [data[:768], data[:16], b'', data[32:304]]
+		ivs = bytes(range(64))
+		expected = [PROVIDERS['pycryptodome'].new(key, MODE_CBC, ivs[16 * i:16 * i + 16]).encrypt(m) for i, m in enumerate(messages)]
+		singletest('p.encrypt_cbc_batch(k, i, m) == e', p=provider, k=key, i=ivs, m=messages, e=expected)
+	singletest('select_provider("bitsliced").name == "bitsliced"', select_provider=select_provider)
+	singletest('select_provider("auto", size=64).autoselect', select_provider=select_provider)
+	return True
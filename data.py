@@ -1,12 +1,31 @@
 #!/usr/bin/python3
 
 import math
+import struct
+import time
+from array import array
 from tests import singletest
 
+# Les champs plus courts sont copiés à la lecture: une vue sur le tampon reçu occupe plus de mémoire que quelques octets
+VIEW_THRESHOLD = 64
+
+
+def asbuffer(newvalue):
+	# Vue sans copie sur les données à lire (bytes, bytearray, memoryview ou DataElem)
+	# Les valeurs lues référencent ce tampon: il ne doit pas être modifié tant qu'elles sont utilisées
+	if isinstance(newvalue, DataElem):
+		newvalue = newvalue.to_bytes()
+	return memoryview(newvalue).cast('B')
+
 
 class DataElem:
+	__slots__ = ('length', '_value')
 	defaultvalue = 0
 	order = 'big'
+	# Tailles en cache: seuls les éléments de taille variable (structures, vecteurs, tableaux) ont un parent,
+	# fixé quand le parent calcule sa taille; seuls les structures et DataVector gardent leur taille
+	_parent = None
+	_size = None
 
 	def __init__(self, arg, value=defaultvalue):
 		if isinstance(arg, int):
@@ -17,23 +36,72 @@ class DataElem:
 			self.length = len(arg)
 			self.value = arg
 
+	# La valeur lue reste une vue sur le tampon d'origine: elle n'est copiée en bytes qu'au premier accès.
+	# Un bytearray (cf mutable) est rendu tel quel: le lire entre deux écritures ne recopie pas les octets
+	@property
+	def value(self):
+		value = self._value
+		if isinstance(value, memoryview):
+			value = self._value = bytes(value)
+		return value
+
+	@value.setter
+	def value(self, newvalue):
+		self._value = newvalue
+		self.changed()
+
+	def changed(self):
+		# La taille de l'élément a pu changer: invalide les tailles en cache des éléments qui le contiennent.
+		# Un élément sans taille en cache n'a pas de parent qui en garde une: on s'arrête au premier.
+		parent = self._parent
+		while parent is not None and parent._size is not None:
+			object.__setattr__(parent, '_size', None)
+			parent = parent._parent
+
 	def read(self, newvalue):
-		if isinstance(newvalue, DataElem):
-			self.value = newvalue.value[:self.length]
-		else:
-			self.value = bytes(newvalue)[:self.length]
 		# return the number of bytes read
-		return self.length
+		return self.read_from(asbuffer(newvalue), 0)
+
+	def read_from(self, buf, offset):
+		# Lecture à partir de buf[offset:], renvoie le nombre d'octets lus
+		length = self.length
+		value = buf[offset:offset + length]
+		self._value = value.tobytes() if length < VIEW_THRESHOLD else value
+		return length
+
+	def write_into(self, buf, offset):
+		# Écrit l'élément dans buf (bytearray ou memoryview) à partir de offset, renvoie la position suivante
+		# Ne écrire que le nombre d'octets donné
+		end = offset + self.length
+		value = self._value
+		if isinstance(value, int):
+			buf[offset:end] = value.to_bytes(self.length, byteorder=DataElem.order)
+		elif len(value) < self.length:
+			buf[offset:offset + len(value)] = value
+			buf[offset + len(value):end] = bytes(self.length - len(value))  # padding (en big endian)
+		else:
+			buf[offset:end] = memoryview(value)[:self.length]
+		return end
+
+	def mutable(self):
+		# Octets de l'élément modifiables sur place: copiés une seule fois dans un bytearray
+		# (.value renvoie ce bytearray, frozen une vue en lecture seule)
+		value = self._value
+		if not isinstance(value, bytearray):
+			value = self._value = bytearray(self.to_bytes() if isinstance(value, int) else value)
+		return value
+
+	def frozen(self):
+		# Vue en lecture seule sur les octets de l'élément, sans copie
+		# Le bytearray sous-jacent ne peut pas être agrandi tant que la vue existe
+		value = self._value
+		return memoryview(self.to_bytes() if isinstance(value, int) else value).toreadonly()
 
 	def to_bytes(self):
-		# Ne retourner que le nombre d'octets donné
-		if isinstance(self.value, bytes):
-			if len(self.value) < self.length:
-				return self.value + b'\x00' * (self.length - len(self.value))  # padding (en big endian)
-			# sinon, on retourne le bon nombre
-			return self.value[:self.length]
-		elif isinstance(self.value, int):
-			return self.value.to_bytes(self.length, byteorder=DataElem.order)
+		# Sérialisation dans un seul tampon préalloué de la taille de l'élément
+		buf = bytearray(self.size())
+		self.write_into(buf, 0)
+		return bytes(buf)
 
 	def __bytes__(self):
 		return self.to_bytes()
@@ -51,84 +119,384 @@ class DataElem:
 		return self.length
 
 
+def itembytes(value, length):
+	# Octets d'un élément de tableau, complétés par des zéros ou tronqués à length (None si l'entier ne tient pas)
+	if isinstance(value, int):
+		if value.bit_length() > 8 * length:
+			return None
+		return value.to_bytes(length, byteorder=DataElem.order)
+	value = bytes(value)[:length]
+	return value + bytes(length - len(value))
+
+
+def packitems(values, length):
+	# Octets d'une suite d'éléments: données brutes (dernier élément complété) ou itérable d'éléments
+	if isinstance(values, (bytes, bytearray, memoryview)):
+		data = bytes(values)
+		if len(data) % length:
+			data += bytes(length - len(data) % length)
+		return data
+	items = []
+	for value in values:
+		item = itembytes(value, length)
+		if item is None:
+			raise Exception('Value too large for a ' + str(length) + '-byte element')
+		items.append(item)
+	return b''.join(items)
+
+
 class DataArray(DataElem):
+	# Les écritures d'éléments se font sur place dans un bytearray (copie unique au premier changement)
+	__slots__ = ('arraysize', 'elemlength', '_parent')
+
 	def __init__(self, size, elemlength):
+		self._parent = None
 		self.arraysize = size
 		self.elemlength = elemlength
 		self.value = b'\x00' * elemlength * size
 
-	def read(self, newvalue):
-		i = 0
+	def read_from(self, buf, offset):
 		size = self.elemlength * self.arraysize
-		self.value = newvalue[:size] + self.value[len(newvalue):]
-		i += len(newvalue[:size])
-		return i
+		chunk = buf[offset:offset + size]
+		if len(chunk) == size:
+			self.value = chunk.tobytes() if size < VIEW_THRESHOLD else chunk
+		else:
+			self.value = chunk.tobytes() + self.value[len(chunk):]
+		return len(chunk)
 
-	def to_bytes(self):
-		return self.value
+	def write_into(self, buf, offset):
+		end = offset + self.size()
+		buf[offset:end] = self._value
+		return end
 
 	def size(self):
 		return self.elemlength * self.arraysize
 
 	def __getitem__(self, item):
 		if isinstance(item, int) and 0 <= item < self.arraysize:
-			s = DataElem(self.value[self.elemlength * item: self.elemlength * (item + 1)])
+			s = DataElem(bytes(self._value[self.elemlength * item: self.elemlength * (item + 1)]))
 			return s
 
-	def valuewithoutitem(self, key):
-		valuebefore = self.value[:self.elemlength * key]
-		valueafter = self.value[self.elemlength * (key+1):]
-		return valuebefore, valueafter
-
 	def __setitem__(self, key, value):
-		if isinstance(key, int) and 0 <= key < self.arraysize:
-			if (isinstance(value, DataElem) and value.size() == self.elemlength) or isinstance(value, bytes):
-				valuebefore, valueafter = self.valuewithoutitem(key)
-				self.value = valuebefore + bytes(value) + valueafter
-			elif isinstance(value, int):
-				valuebefore, valueafter = self.valuewithoutitem(key)
-				if value.bit_length() > self.elemlength:
-					return  # Cas invalide
-				b = value.to_bytes(self.elemlength, byteorder=DataElem.order)
-				self.value = valuebefore + b + valueafter
+		length = self.elemlength
+		if isinstance(key, slice):
+			start, stop, step = key.indices(self.arraysize)
+			data = packitems(value, length)
+			if step != 1 or len(data) != max(stop - start, 0) * length:
+				raise Exception('Invalid slice assignment')
+			self.mutable()[start * length:stop * length] = data
+		elif isinstance(key, int) and 0 <= key < self.arraysize:
+			if isinstance(value, DataElem) and value.size() != length:
+				return  # Cas invalide
+			item = itembytes(value, length)
+			if item is None:
+				return  # Cas invalide
+			self.mutable()[key * length:(key + 1) * length] = item
+
+	def fill(self, value, start=0, stop=None):
+		# Même valeur pour les éléments de start à stop
+		start, stop, step = slice(start, stop).indices(self.arraysize)
+		item = itembytes(value, self.elemlength)
+		if item is None:
+			raise Exception('Value too large for a ' + str(self.elemlength) + '-byte element')
+		if stop > start:
+			self.mutable()[start * self.elemlength:stop * self.elemlength] = item * (stop - start)
+
+	def extend(self, values):
+		# Ajout en bloc d'éléments à la fin du tableau
+		data = packitems(values, self.elemlength)
+		self.mutable().extend(data)
+		self.arraysize += len(data) // self.elemlength
+		self.changed()
+
+
+def tobytes(value, length):
+	if isinstance(value, int):
+		return value.to_bytes(length, byteorder=DataElem.order)
+	return bytes(value)  # struct complète avec des zéros ou tronque à la longueur du champ
+
+
+def prefixread(width, i):
+	# Expression de lecture d'un préfixe de longueur de width octets à la position i
+	if width == 1:
+		return 'buf[%s]' % i
+	return 'int.from_bytes(buf[%s:%s + %d], "big")' % (i, i, width)
+
+
+COMPILED = True  # False: chemin générique partout (tests différentiels)
+
+
+class StructCodec:
+	# Schéma compilé d'une classe de DataStruct, construit sur la première instance de la classe.
+	# Le préfixe de taille fixe (entiers, tableaux, structures imbriquées entièrement fixes) est lu et écrit
+	# par un seul struct.Struct, en champs d'octets: les feuilles lues ont la même valeur (bytes) que par
+	# DataElem.read_from, les entiers affectés sont convertis à l'écriture; les vecteurs d'octets (DataElemVector) sont lus en ligne avec la largeur de leur
+	# préfixe de longueur résolue en constante; les autres éléments (DataVector, structures, champs de varfields)
+	# gardent leur propre read_from/write_into. read, write et size sont générés en code Python sans boucle.
+	# Chaque instance vérifie une fois qu'elle suit le schéma de sa classe, sinon elle reste sur le chemin générique.
+	def __init__(self, elem):
+		formats = []
+		self.fields = []  # par élément du préfixe: (type, longueur, format) ou (type, None, codec imbriqué)
+		self.lengths = []  # longueur de chaque feuille du préfixe
+		values = elem._value
+		for i, child in enumerate(values):
+			if i < len(elem.elemnames) and elem.elemnames[i] in elem.varfields:
+				break
+			if isinstance(child, DataStruct):
+				sub = structcodec(child)
+				if sub is None or sub.count < len(child._value) or child.fixedleaves() is None:
+					break
+				self.fields.append((type(child), None, sub))
+				self.lengths.extend(sub.lengths)
+				formats.append(sub.format)
+			elif isinstance(child, (DataVector, DataElemVector)):
+				break
+			else:
+				length = child.size()
+				fmt = str(length) + 's'
+				self.fields.append((type(child), length, fmt))
+				self.lengths.append(length)
+				formats.append(fmt)
+		self.count = len(self.fields)
+		self.format = ''.join(formats)
+		self.struct = struct.Struct('>' + self.format)
+		self.size = self.struct.size
+		# Éléments suivants: vecteurs d'octets en ligne, les autres par appel
+		self.vectors = []  # (position, type, ceiling, elemsize)
+		self.nfields = len(values)
+		for i in range(self.count, len(values)):
+			child = values[i]
+			named = i < len(elem.elemnames) and elem.elemnames[i] in elem.varfields
+			if isinstance(child, DataElemVector) and not named:
+				self.vectors.append((i, type(child), child.ceiling, child.elemsize))
+		self.source = self.generate()
+		namespace = {'S': self.struct, 'tobytes': tobytes, 'VIEW_THRESHOLD': VIEW_THRESHOLD}
+		for n, (kind, length, fmt) in enumerate(self.fields):
+			namespace['K%d' % n] = kind
+		for position, kind, ceiling, elemsize in self.vectors:
+			namespace['K%d' % position] = kind
+		exec(compile(self.source, '<schema %s>' % type(elem).__name__, 'exec'), namespace)
+		self.read = namespace['read']
+		self.write = namespace['write']
+		self.sizeof = namespace['size']
+		self.match = namespace['match']
+
+	def generate(self):
+		nleaves = len(self.lengths)
+		leaves = ''.join('l%d, ' % n for n in range(nleaves))
+		vectors = {position: (ceiling, elemsize) for position, kind, ceiling, elemsize in self.vectors}
+		read = ['def read(values, leaves, buf, offset):', '\tend = len(buf)']
+		write = ['def write(values, leaves, buf, o):']
+		size = ['def size(values):']
+		constant = self.size
+		variable = []
+		if nleaves:
+			read += ['\tif offset + %d > end:' % self.size, '\t\treturn None',
+					'\t%s= leaves' % leaves, '\t%s= S.unpack_from(buf, offset)' % ''.join('l%d._value, ' % n for n in range(nleaves))]
+			write += ['\t%s= leaves' % leaves]
+			for n, length in enumerate(self.lengths):
+				write += ['\tv%d = l%d._value' % (n, n),
+						'\tif v%d.__class__ is not bytes:' % n, '\t\tv%d = tobytes(v%d, %d)' % (n, n, length)]
+			write += ['\tS.pack_into(buf, o, %s)' % ', '.join('v%d' % n for n in range(nleaves))]
+		read += ['\ti = offset + %d' % self.size]
+		write += ['\to += %d' % self.size]
+		for position in range(self.count, self.nfields):
+			if position in vectors:
+				ceiling, elemsize = vectors[position]
+				width = nbytes(ceiling)
+				constant += width
+				length = 'n' if elemsize == 1 else 'n * %d' % elemsize
+				read += ['\te = values[%d]' % position,
+						'\tif i + %d > end:' % width, '\t\treturn None',
+						'\tn = e.vectsize = %s' % prefixread(width, 'i'),
+						'\ti += %d' % width, '\tlength = %s' % length,
+						'\tif i + length > end:', '\t\treturn None',
+						'\tv = buf[i:i + length]',
+						'\te._value = v.tobytes() if length < VIEW_THRESHOLD else v',
+						'\ti += length']
+				write += ['\te = values[%d]' % position, '\tv = e._value',
+						'\tbuf[o:o + %d] = e.vectsize.to_bytes(%d, "big")' % (width, width),
+						'\tn = len(v)', '\tbuf[o + %d:o + %d + n] = v' % (width, width), '\to += %d + n' % width]
+				variable.append('len(values[%d]._value)' % position)
+			else:
+				read += ['\ti += values[%d].read_from(buf, i)' % position]
+				write += ['\to = values[%d].write_into(buf, o)' % position]
+				variable.append('values[%d].size()' % position)
+		read += ['\treturn i - offset']
+		write += ['\treturn o']
+		size += ['\treturn %s' % ' + '.join([str(constant)] + variable)]
+		return '\n'.join(read + [''] + write + [''] + size + [''] + self.generatematch()) + '\n'
+
+	def generatematch(self):
+		# Vérification qu'une instance suit le schéma: renvoie (feuilles du préfixe, structures imbriquées) ou None
+		match = ['def match(values):', '\tif len(values) != %d:' % self.nfields, '\t\treturn None',
+				'\tleaves = []', '\tnested = []']
+		for n, (kind, length, fmt) in enumerate(self.fields):
+			match += ['\tx = values[%d]' % n]
+			if length is None:
+				match += ['\tif x.__class__ is not K%d:' % n, '\t\treturn None',
+						'\tsub = x.fixedleaves()', '\tif sub is None:', '\t\treturn None',
+						'\tleaves += sub', '\tnested.append((x, x._layout))']
+				continue
+			if issubclass(kind, DataArray):
+				check = 'x.arraysize * x.elemlength != %d' % length
+			else:
+				check = 'x.length != %d' % length
+			match += ['\tif x.__class__ is not K%d or %s:' % (n, check), '\t\treturn None', '\tleaves.append(x)']
+		for position, kind, ceiling, elemsize in self.vectors:
+			match += ['\tx = values[%d]' % position,
+					'\tif x.__class__ is not K%d or x.ceiling != %d or x.elemsize != %d:' % (position, ceiling, elemsize),
+					'\t\treturn None']
+		match += ['\treturn leaves, nested']
+		return match
+
+
+CODECS = {}
+
+
+def structcodec(elem):
+	# Schéma compilé de la classe de elem (None pour DataStruct elle-même, dont les instances n'ont pas de schéma commun)
+	cls = type(elem)
+	if cls not in CODECS:
+		CODECS[cls] = None  # structures imbriquées de la même classe
+		if cls is not DataStruct and elem._value:
+			CODECS[cls] = StructCodec(elem)
+	return CODECS[cls]
+
+
+class Field:
+	# Accès à un champ de DataStruct par sa position, installé sur la classe
+	__slots__ = ('index',)
+
+	def __init__(self, index):
+		self.index = index
+
+	def __get__(self, obj, cls=None):
+		if obj is None:
+			return self
+		return obj._value[self.index]
+
+
+INDEXES = {}  # (classe, noms des champs) -> {nom: position}
+
+
+def fieldindex(cls, elemnames):
+	# Positions des champs, calculées une fois par classe; les sous-classes reçoivent un descripteur par champ
+	# (sauf si le nom est déjà pris par un attribut de la classe, le champ passe alors par __getattr__)
+	key = (cls, elemnames)
+	index = INDEXES.get(key)
+	if index is None:
+		index = INDEXES[key] = {name: i for i, name in enumerate(elemnames)}
+		if cls is not DataStruct:
+			if '_fields' in cls.__dict__:
+				raise Exception(cls.__name__ + ': field names must be the same for every instance')
+			cls._fields = elemnames
+			for name, i in index.items():
+				if not hasattr(cls, name):
+					setattr(cls, name, Field(i))
+	return index
+
+
+def adopt(parent, children):
+	# Liens vers le parent des éléments de taille variable (cf DataElem.changed)
+	for child in children:
+		if isinstance(child, VARIABLE):
+			child._parent = parent
 
 
 class DataStruct(DataElem):
+	# Les éléments sont gardés dans une liste, modifiée en place par l'affectation d'un champ
+	# La taille est gardée en cache jusqu'à la modification d'un élément
+	__slots__ = ('elemnames', '_index', '_layout', '_parent', '_size')
+	varfields = ()  # champs dont la taille dépend de l'instance: jamais compilés dans le codec de la classe
+
 	def __init__(self, elements, elemnames=()):
-		object.__setattr__(self, 'elemnames', tuple(elemnames))
-		object.__setattr__(self, 'value', tuple(elements))
+		elemnames = tuple(elemnames)
+		object.__setattr__(self, 'elemnames', elemnames)
+		object.__setattr__(self, '_index', fieldindex(type(self), elemnames))
+		object.__setattr__(self, '_value', list(elements))
+		object.__setattr__(self, '_layout', None)
+		object.__setattr__(self, '_parent', None)
+		object.__setattr__(self, '_size', None)
 
-	def read(self, newvalue):
-		i = 0
-		for elem in self.value:
-			i += elem.read(newvalue[i:])
-		return i
+	def fixedleaves(self):
+		# Feuilles du préfixe compilé (vérifiées une fois par instance), None pour le chemin générique
+		layout = self._layout
+		if layout is not None:
+			if layout is False:
+				return None
+			for child, childlayout in layout[1]:
+				if child._layout is not childlayout:  # structure imbriquée modifiée depuis la vérification
+					layout = None
+					break
+		if layout is None:
+			codec = CODECS[type(self)] if type(self) in CODECS else structcodec(self)
+			layout = (codec.match(self._value) if codec else None) or False
+			object.__setattr__(self, '_layout', layout)
+			if layout is False:
+				return None
+		return layout[0]
 
-	def to_bytes(self):
-		s = b''
-		for elem in self.value:
-			s += elem.to_bytes()
-		return s
+	def resize(self):
+		# Taille à recalculer (éléments modifiés)
+		if self._size is not None:
+			object.__setattr__(self, '_size', None)
+			self.changed()
+
+	def read_from(self, buf, offset):
+		self.resize()
+		if COMPILED:
+			leaves = self.fixedleaves()
+			if leaves is not None:
+				n = CODECS[type(self)].read(self._value, leaves, buf, offset)
+				if n is not None:
+					return n
+				# lecture tronquée: le chemin générique relit tous les éléments
+		i = offset
+		for elem in self._value:
+			i += elem.read_from(buf, i)
+		return i - offset
+
+	def write_into(self, buf, offset):
+		if COMPILED:
+			leaves = self.fixedleaves()
+			if leaves is not None:
+				return CODECS[type(self)].write(self._value, leaves, buf, offset)
+		for elem in self._value:
+			offset = elem.write_into(buf, offset)
+		return offset
 
 	def size(self):
-		s = 0
-		for elem in self.value:
-			s += elem.size()
+		s = self._size
+		if s is None:
+			if COMPILED and self.fixedleaves() is not None:
+				s = CODECS[type(self)].sizeof(self._value)
+			else:
+				s = 0
+				for elem in self._value:
+					s += elem.size()
+			adopt(self, self._value)
+			object.__setattr__(self, '_size', s)
 		return s
 
 	def __getattr__(self, item):
-		if item in self.elemnames:
-			index = self.elemnames.index(item)
-			return self.value[index]
-		else:
-			return object.__getattr__(self, item)
+		if item[0] != '_':
+			index = self._index.get(item)
+			if index is not None:
+				return self._value[index]
+		raise AttributeError(item)
 
 	def __setattr__(self, key, value):
-		if key in self.elemnames:
-			index = self.elemnames.index(key)
-			self.value = self.value[:index] + (value, ) + self.value[index+1:]
+		index = self._index.get(key)
+		if index is not None:
+			self._value[index] = value
+		elif key == 'value':
+			object.__setattr__(self, '_value', list(value))
 		else:
 			object.__setattr__(self, key, value)
+			return
+		object.__setattr__(self, '_layout', None)  # disposition à revérifier
+		self.resize()
 
 	def __dir__(self):
 		return object.__dir__(self) + list(self.elemnames)
@@ -140,7 +508,29 @@ def nbytes(e):
 	return int(math.ceil(e.bit_length() / 8))
 
 
+STRIDES = {}  # type d'élément -> taille fixe (None si elle dépend du contenu)
+
+
+def stride(dtype):
+	if dtype not in STRIDES:
+		proto = dtype()
+		if isinstance(proto, (DataVector, DataElemVector)):
+			STRIDES[dtype] = None
+		elif isinstance(proto, DataStruct):
+			codec = structcodec(proto)
+			STRIDES[dtype] = codec.size if codec is not None and codec.count == len(proto._value) else None
+		else:
+			STRIDES[dtype] = proto.size()
+	return STRIDES[dtype]
+
+
 class DataVector(DataElem):
+	# Lecture paresseuse: seuls le nombre d'éléments et leur position sont relevés, chaque élément est décodé
+	# à l'accès (indexation, itération). Pour un type de taille fixe la position se calcule avec le pas,
+	# sinon elle est gardée dans un array('I'). value décode tous les éléments et les garde dans une liste.
+	# La taille est gardée en cache (cf DataStruct)
+	__slots__ = ('dtype', 'ceiling', 'floor', '_vectsize', '_buf', '_offsets', '_parent', '_size')
+
 	def __init__(self, dtype, ceiling, floor=0):
 		self.ceiling = ceiling
 		self.floor = floor
@@ -148,66 +538,156 @@ class DataVector(DataElem):
 			self.dtype = dtype
 		else:
 			self.dtype = DataElem(int(dtype))  # on considère dtype comme la taille de l'élément
-		self.vectsize = floor
-		self.value = [self.dtype()] * self.vectsize
+		self._parent = self._size = None
+		self._vectsize = floor
+		self.value = [self.dtype() for i in range(floor)]
 
-	def read(self, newvalue):
-		i = 0
+	@property
+	def value(self):
+		if self._value is None:
+			self._value = list(self)
+			self._buf = self._offsets = None
+		return self._value
+
+	@value.setter
+	def value(self, newvalue):
+		self._value = newvalue
+		self._buf = self._offsets = None
+		self.resize()
+
+	@property
+	def vectsize(self):
+		return self._vectsize
+
+	@vectsize.setter
+	def vectsize(self, newsize):
+		# Vecteur pas encore décodé: décodé d'abord, _buf ne correspondrait plus au nombre d'éléments
+		if self._value is None:
+			self.value
+		self._vectsize = newsize
+		self.resize()
+
+	def resize(self):
+		if self._size is not None:
+			self._size = None
+			self.changed()
+
+	def read_from(self, buf, offset):
+		i = offset
 		# first read the size
 		i += nbytes(self.ceiling)
-		self.vectsize = int.from_bytes(newvalue[:i], byteorder=DataElem.order)
-		# then read the elements
-		self.value = []
-		for elem in range(self.vectsize):
-			elem = self.dtype()
-			i += elem.read(newvalue[i:])
-			self.value.append(elem)
-		return i
+		self._vectsize = int.from_bytes(buf[offset:i], byteorder=DataElem.order)  # ancien _buf remplacé plus bas
+		self.resize()
+		# then locate the elements
+		start = i
+		step = stride(self.dtype)
+		offsets = None
+		if step is not None:
+			i += self.vectsize * step
+		else:
+			offsets = array('I')
+			scratch = self.dtype()
+			for elem in range(self.vectsize):
+				if i > len(buf):
+					break  # message tronqué
+				offsets.append(i - start)
+				i += scratch.read_from(buf, i)
+		region = buf[start:i]
+		if len(region) < i - start:
+			# Message tronqué: le dernier élément entamé garde son remplissage, les suivants ne sont pas créés
+			# (un nombre d'éléments falsifié ne fait rien allouer au-delà des données reçues)
+			self.value = []
+			i = start
+			for elem in range(self.vectsize):
+				if i > len(buf):
+					break
+				elem = self.dtype()
+				i += elem.read_from(buf, i)
+				self._value.append(elem)
+			self.vectsize = len(self._value)
+			return i - offset
+		self._value = None
+		self._buf = region.tobytes() if len(region) < VIEW_THRESHOLD else region
+		self._offsets = offsets
+		return i - offset
 
-	def to_bytes(self):
-		s = b''
+	def elemoffset(self, item):
+		if self._offsets is not None:
+			return self._offsets[item]
+		return item * STRIDES[self.dtype]
+
+	def write_into(self, buf, offset):
 		# first write the size
-		s += self.vectsize.to_bytes(nbytes(self.ceiling), byteorder=DataElem.order)
-		# then write the elements
+		end = offset + nbytes(self.ceiling)
+		buf[offset:end] = self.vectsize.to_bytes(end - offset, byteorder=DataElem.order)
+		# then write the elements (recopiés tels quels s'ils n'ont pas été décodés)
+		if self._value is None:
+			buf[end:end + len(self._buf)] = self._buf
+			return end + len(self._buf)
 		for elem in range(self.vectsize):
-			s += self.value[elem].to_bytes()
-		return s
+			end = self._value[elem].write_into(buf, end)
+		return end
 
 	def size(self):
-		s = nbytes(self.ceiling)
-		for elem in self.value:
-			s += elem.size()
+		s = self._size
+		if s is None:
+			s = nbytes(self.ceiling)
+			if self._value is None:
+				s += len(self._buf)
+			else:
+				elems = self._value[:self._vectsize]
+				for elem in elems:
+					s += elem.size()
+				adopt(self, elems)
+			self._size = s
 		return s
 
+	def __len__(self):
+		return self.vectsize
+
+	def __iter__(self):
+		if self._value is not None:
+			yield from self._value[:self.vectsize]
+			return
+		buf = asbuffer(self._buf)
+		i = 0
+		for item in range(self.vectsize):
+			elem = self.dtype()
+			i += elem.read_from(buf, i)
+			yield elem
+
 	def __getitem__(self, item):
 		if isinstance(item, int) and 0 <= item < self.vectsize:
-			s = DataElem(self.value[item])
-			return s
-
-	def valuewithoutitem(self, key):
-		valuebefore = self.value[:key]
-		valueafter = self.value[(key+1):]
-		return valuebefore, valueafter
+			if self._value is not None:
+				return self._value[item]
+			elem = self.dtype()
+			elem.read_from(asbuffer(self._buf), self.elemoffset(item))
+			return elem
 
 	def __setitem__(self, key, value):
-		if isinstance(key, int) and 0 <= key < self.arraysize:
-			if (isinstance(value, DataElem) and value.size() == self.elemlength) or isinstance(value, bytes):
-				valuebefore, valueafter = self.valuewithoutitem(key)
-				newitem = self.dtype()
-				newitem.read(value)
-				self.value = valuebefore + newitem + valueafter
-			elif isinstance(value, int):
-				valuebefore, valueafter = self.valuewithoutitem(key)
-				if value.bit_length() > self.elemlength:
-					return  # Cas invalide
-				b = value.to_bytes(self.elemlength, byteorder=DataElem.order)
+		if isinstance(key, int) and 0 <= key < self.vectsize:
+			if isinstance(value, self.dtype):
+				newitem = value
+			else:
 				newitem = self.dtype()
-				newitem.read(b)
-				self.value = valuebefore + newitem + valueafter
+				if isinstance(value, int):
+					item = itembytes(value, newitem.size())
+					if item is None:
+						return  # Cas invalide
+					newitem.read(item)
+				elif isinstance(value, (DataElem, bytes)):
+					newitem.read(value)
+				else:
+					return
+			self.value[key] = newitem
+			self.resize()
 
 
 class DataElemVector(DataElem):
+	__slots__ = ('elemsize', 'ceiling', 'floor', 'vectsize', '_parent')
+
 	def __init__(self, elemsize, ceiling, floor=0, value=None):
+		self._parent = None
 		self.elemsize = elemsize
 		self.ceiling = ceiling
 		self.floor = floor
@@ -221,17 +701,25 @@ class DataElemVector(DataElem):
 			self.vectsize = floor
 			self.value = b'\x00' * self.elemsize * self.vectsize
 
-	def read(self, newvalue):
-		i = 0
+	def read_from(self, buf, offset):
+		i = offset
 		# first read the size
 		i += nbytes(self.ceiling)
-		self.vectsize = int.from_bytes(bytes(newvalue)[:i], byteorder=DataElem.order)
+		self.vectsize = int.from_bytes(buf[offset:i], byteorder=DataElem.order)
 		# then read the elements
-		self.value = bytes(newvalue)[i:i+(self.vectsize * self.elemsize)]
-		if len(self.value) < self.vectsize * self.elemsize:
-			self.value += b'\x00' * (self.vectsize * self.elemsize - len(self.value))
-		i += self.vectsize * self.elemsize
-		return i
+		length = self.vectsize * self.elemsize
+		value = buf[i:i + length]
+		if len(value) < length:
+			# Message tronqué: seuls les éléments reçus (le dernier complété par des zéros) sont gardés,
+			# une longueur falsifiée ne fait rien allouer au-delà des données reçues
+			self.vectsize = -(-len(value) // self.elemsize)
+			length = self.vectsize * self.elemsize
+			value = value.tobytes() + b'\x00' * (length - len(value))
+		elif length < VIEW_THRESHOLD:
+			value = value.tobytes()
+		self.value = value
+		i += length
+		return i - offset
 
 	def setvalue(self, newvalue):
 		if isinstance(newvalue, DataVector) or isinstance(newvalue, DataElemVector):
@@ -245,42 +733,62 @@ class DataElemVector(DataElem):
 			self.value += b'\x00' * (self.vectsize * self.elemsize - len(self.value))
 		return i
 
-	def to_bytes(self):
-		s = b''
+	def write_into(self, buf, offset):
 		# first write the size
-		s += self.vectsize.to_bytes(nbytes(self.ceiling), byteorder=DataElem.order)
+		end = offset + nbytes(self.ceiling)
+		buf[offset:end] = self.vectsize.to_bytes(end - offset, byteorder=DataElem.order)
 		# then write the elements
-		s += self.value
-		return s
+		value = self._value
+		buf[end:end + len(value)] = value
+		return end + len(value)
 
 	def size(self):
-		return nbytes(self.ceiling) + len(self.value)
+		return nbytes(self.ceiling) + len(self._value)
 
 	def __getitem__(self, item):
 		if isinstance(item, int) and 0 <= item < self.vectsize:
-			s = DataElem(self.value[self.elemsize * item:self.elemsize * (item + 1)])
+			s = DataElem(bytes(self._value[self.elemsize * item:self.elemsize * (item + 1)]))
 			return s
 
-	def valuewithoutitem(self, key):
-		valuebefore = self.value[:self.elemsize * key]
-		valueafter = self.value[self.elemsize * (key+1):]
-		return valuebefore, valueafter
-
 	def __setitem__(self, key, value):
-		if isinstance(key, int) and 0 <= key < self.vectsize:
-			if (isinstance(value, DataElem) and value.size() == self.elemsize) or isinstance(value, bytes):
-				valuebefore, valueafter = self.valuewithoutitem(key)
-				newitem = bytes(value)[:self.elemsize]
-				self.value = valuebefore + newitem + valueafter
-			elif isinstance(value, int):
-				valuebefore, valueafter = self.valuewithoutitem(key)
-				if value.bit_length() > self.elemsize:
-					return  # Cas invalide
-				newitem = value.to_bytes(self.elemsize, byteorder=DataElem.order)
-				self.value = valuebefore + newitem + valueafter
+		# Écriture sur place (cf DataArray)
+		length = self.elemsize
+		if isinstance(key, slice):
+			start, stop, step = key.indices(self.vectsize)
+			data = packitems(value, length)
+			if step != 1 or len(data) != max(stop - start, 0) * length:
+				raise Exception('Invalid slice assignment')
+			self.mutable()[start * length:stop * length] = data
+		elif isinstance(key, int) and 0 <= key < self.vectsize:
+			if isinstance(value, DataElem) and value.size() != length:
+				return  # Cas invalide
+			item = itembytes(value, length)
+			if item is None:
+				return  # Cas invalide
+			self.mutable()[key * length:(key + 1) * length] = item
+
+	def fill(self, value, start=0, stop=None):
+		start, stop, step = slice(start, stop).indices(self.vectsize)
+		item = itembytes(value, self.elemsize)
+		if item is None:
+			raise Exception('Value too large for a ' + str(self.elemsize) + '-byte element')
+		if stop > start:
+			self.mutable()[start * self.elemsize:stop * self.elemsize] = item * (stop - start)
+
+	def extend(self, values):
+		# Ajout en bloc d'éléments, dans la limite de ceiling
+		data = packitems(values, self.elemsize)[:(self.ceiling - self.vectsize) * self.elemsize]
+		self.mutable().extend(data)
+		self.vectsize += len(data) // self.elemsize
+		self.changed()
+
+
+VARIABLE = (DataStruct, DataVector, DataElemVector, DataArray)
 
 
 class Uint(DataElem):
+	__slots__ = ()
+
 	def __init__(self, size, value=0):
 		super().__init__(size, value)
 
@@ -291,31 +799,43 @@ class Uint(DataElem):
 
 
 class Uint8(Uint):
+	__slots__ = ()
+
 	def __init__(self, value=0):
 		super().__init__(1, value)
 
 
 class Uint16(Uint):
+	__slots__ = ()
+
 	def __init__(self, value=0):
 		super().__init__(2, value)
 
 
 class Uint24(Uint):
+	__slots__ = ()
+
 	def __init__(self, value=0):
 		super().__init__(3, value)
 
 
 class Uint32(Uint):
+	__slots__ = ()
+
 	def __init__(self, value=0):
 		super().__init__(4, value)
 
 
 class Uint64(Uint):
+	__slots__ = ()
+
 	def __init__(self, value=0):
 		super().__init__(8, value)
 
 
 class Opaque(DataArray):
+	__slots__ = ()
+
 	def __init__(self, arg=1):
 		if isinstance(arg, int):  # arg represents the size of the byte array to initiate
 			super().__init__(1, arg)
@@ -325,12 +845,205 @@ class Opaque(DataArray):
 			self.read(arg)
 
 
+class SendBuffer:
+	# Tampon d'envoi réutilisé d'un message à l'autre: les éléments y sont sérialisés directement,
+	# puis envoyés en un seul appel à sendall
+	def __init__(self, capacity=4096):
+		self.buf = bytearray(capacity)
+		self.length = 0
+
+	def append(self, elem):
+		end = self.length + elem.size()
+		if end > len(self.buf):
+			self.buf.extend(bytes(max(end, 2 * len(self.buf)) - len(self.buf)))
+		self.length = elem.write_into(self.buf, self.length)
+		return self.length
+
+	def getvalue(self):
+		return bytes(self.buf[:self.length])
+
+	def flush(self, sock):
+		with memoryview(self.buf) as view, view[:self.length] as pending:
+			sock.sendall(pending)
+		self.length = 0
+
+	def send(self, sock, *elems):
+		for elem in elems:
+			self.append(elem)
+		self.flush(sock)
+
+
+class RingBuffer:
+	# Tampon circulaire de réception: les octets reçus y sont copiés une fois, la capacité ne change que si
+	# un message ne tient pas
+	def __init__(self, capacity=16384):
+		self.buf = bytearray(capacity)
+		self.start = 0
+		self.length = 0
+
+	def __len__(self):
+		return self.length
+
+	def write(self, data):
+		data = memoryview(data).cast('B')
+		if self.length + len(data) > len(self.buf):
+			pending = self.peek(self.length)
+			self.buf = bytearray(max(2 * len(self.buf), self.length + len(data)))
+			self.buf[:len(pending)] = pending
+			self.start = 0
+		capacity = len(self.buf)
+		end = (self.start + self.length) % capacity
+		first = min(len(data), capacity - end)
+		self.buf[end:end + first] = data[:first]
+		self.buf[:len(data) - first] = data[first:]
+		self.length += len(data)
+
+	def peek(self, n):
+		# Copie des n premiers octets (moins s'ils ne sont pas encore reçus)
+		n = min(n, self.length)
+		end = self.start + n
+		if end <= len(self.buf):
+			return bytes(self.buf[self.start:end])
+		return bytes(self.buf[self.start:]) + bytes(self.buf[:end - len(self.buf)])
+
+	def consume(self, n):
+		n = min(n, self.length)
+		self.start = (self.start + n) % len(self.buf)
+		self.length -= n
+		if not self.length:
+			self.start = 0
+
+
+class MessageParser:
+	# Décodage incrémental de messages préfixés par leur longueur: feed() accepte des morceaux quelconques
+	# (message partiel, plusieurs messages coalescés) et renvoie les messages complets au fur et à mesure.
+	# Les sous-classes donnent frame(peek), la taille du prochain message d'après les octets déjà reçus
+	# (la taille de l'en-tête tant que la longueur n'est pas connue), et build(message) qui décode un message complet.
+	# Les messages sont décodés à partir d'une copie: ils ne référencent pas le tampon circulaire.
+	def __init__(self, buffer=None):
+		self.buffer = buffer if buffer is not None else RingBuffer()
+
+	def needed(self):
+		# Nombre d'octets encore attendus pour le prochain message (0 s'il est complet)
+		return max(self.frame(self.buffer.peek) - len(self.buffer), 0)
+
+	def next(self):
+		# Prochain message complet, None s'il manque des octets
+		total = self.frame(self.buffer.peek)
+		if total > len(self.buffer):
+			return None
+		message = self.build(self.buffer.peek(total))
+		self.buffer.consume(total)
+		return message
+
+	def messages(self):
+		message = self.next()
+		while message is not None:
+			yield message
+			message = self.next()
+
+	def feed(self, data):
+		self.buffer.write(data)
+		return self.messages()
+
+
+def leafvalues(elem, limit, offset=0):
+	# Valeurs des feuilles qui commencent avant limit, dans l'ordre de sérialisation: (type de .value, contenu)
+	# et nombre d'éléments des vecteurs. Au-delà de limit (lecture tronquée), les octets sont ceux de la fabrique
+	if offset >= limit:
+		return []
+	if isinstance(elem, DataStruct):
+		leaves, children = [], elem._value
+	elif isinstance(elem, DataVector):
+		leaves, children = [len(elem)], list(elem)
+		offset += nbytes(elem.ceiling)
+	else:
+		value = elem.value
+		leaves = []
+		if isinstance(elem, DataElemVector):
+			leaves.append(elem.vectsize)
+			offset += nbytes(elem.ceiling)
+		return leaves + [(type(value), value if isinstance(value, int) else bytes(value)[:max(limit - offset, 0)])]
+	for child in children:
+		leaves += leafvalues(child, limit, offset)
+		offset += child.size()
+	return leaves
+
+
+def crosscheck(factory, encoded, cuts=None):
+	# Test différentiel: schémas compilés et chemin générique lisent encoded (et ses versions tronquées)
+	# avec le même nombre d'octets lus, la même taille, les mêmes valeurs des feuilles et la même réécriture
+	# des octets reçus
+	global COMPILED
+	if cuts is None:
+		cuts = range(0, len(encoded), max(1, len(encoded) // 64))
+	results = []
+	for compiled in (True, False):
+		COMPILED = compiled
+		try:
+			result = []
+			for n in [len(encoded)] + list(cuts):
+				elem = factory()
+				read = elem.read(encoded[:n])
+				result.append((read, elem.size(), leafvalues(elem, n), bytes(elem)[:n]))  # au-delà de n: valeurs initiales de factory
+			results.append(result)
+		finally:
+			COMPILED = True
+	return results[0] == results[1]
+
+
+def timeper(run, minimum=0.05, repeat=3):
+	# Durée d'un appel à run (meilleur de repeat séries d'au moins minimum secondes)
+	best = None
+	for i in range(repeat):
+		count = 0
+		start = time.perf_counter()
+		while True:
+			run()
+			count += 1
+			elapsed = time.perf_counter() - start
+			if elapsed >= minimum:
+				break
+		if best is None or elapsed / count < best:
+			best = elapsed / count
+	return best
+
+
+def databench(cases, minimum=0.05):
+	# cases: [(nom, paramètre, fabrique, octets encodés)], un même nom à des tailles croissantes.
+	# Débit de lecture et d'écriture en Mo/s et en objets/s; le temps par octet doit rester à peu près constant
+	# quand la taille augmente (sinon comportement quadratique).
+	results = []
+	print('%-18s %8s %10s %10s %12s %10s %12s %8s' % ('structure', 'param', 'bytes', 'read MB/s', 'read obj/s', 'write MB/s', 'write obj/s', 'ns/byte'))
+	for name, param, factory, encoded in cases:
+		def parse():
+			factory().read(encoded)
+		parsed = factory()
+		parsed.read(encoded)
+		tread = timeper(parse, minimum)
+		twrite = timeper(parsed.to_bytes, minimum)
+		size = len(encoded)
+		results.append((name, param, size, size / tread / 1e6, 1 / tread, size / twrite / 1e6, 1 / twrite))
+		print('%-18s %8d %10d %10.2f %12.0f %10.2f %12.0f %8.1f' % (name, param, size, size / tread / 1e6, 1 / tread,
+			size / twrite / 1e6, 1 / twrite, tread * 1e9 / max(size, 1)))
+	return results
+
+
+class Certificate(DataElemVector):
+	__slots__ = ()
+
+	def __init__(self):
+		super().__init__(1, 2**16-1)
+
+
 def datatests():
 	test = DataStruct((DataElem(1, 3), Opaque(b'\x08BASEDGOD'), Uint32(100000)), ('kon', 'ban', 'wa'))
-	singletest('t.size() == 14 and isinstance(t.value, tuple) and len(t.value) == 3', t=test)
+	singletest('t.size() == 14 and isinstance(t.value, list) and len(t.value) == 3', t=test)
 	singletest('bytes(t) == right_value', t=test, right_value=b'\x03\x08BASEDGOD\x00\x01\x86\xa0')
+	elements = test.value
 	test.ban = Uint8(5)
 	singletest('bytes(t) == right_value', t=test, right_value=b'\x03\x05\x00\x01\x86\xa0')
+	singletest('t.value is e and t.value[1] is t.ban and not hasattr(t.ban, "__dict__")', t=test, e=elements)
 	singletest('int(t.wa.value) == right_value', t=test, right_value=100000)
 	fixedvect = DataElemVector(2, 46, 3, b'\x00ABCDEFGH\x04\x06')
 	singletest('bytes(v) == right_value', v=fixedvect, right_value=b'\x06\x00ABCDEFGH\x04\x06\x00')
@@ -339,5 +1052,70 @@ def datatests():
 	fixedvect[4] = b'HI'
 	fixedvect[5] = b'JK'
 	singletest('bytes(v) == right_value', v=fixedvect, right_value=b'\x06\x00ABCDEFGHIJK')
+	# Écritures sur place dans un bytearray: remplissage élément par élément linéaire, puis écritures en bloc
+	suites = DataElemVector(2, 2**15-1)
+	suites.extend(bytes(2 * 1000))
+	backing = suites.mutable()
+	for i in range(1000):
+		suites[i] = 0xc000 + i
+		suites.value  # lecture entre deux écritures: sans copie
+	singletest('s._value is m and s.value is m and s.vectsize == 1000 and s[999].value == b"\\xc3\\xe7"', s=suites, m=backing)
+	suites[2:4] = (b'AB', 0x4344)
+	suites.fill(b'zz', 998)
+	suites.extend([1, b'\x00\x02'])
+	singletest('bytes(s)[:12] == b"\\x03\\xea\\xc0\\x00\\xc0\\x01ABCD\\xc0\\x04"', s=suites)
+	singletest('bytes(s)[-10:] == b"\\xc3\\xe5zzzz\\x00\\x01\\x00\\x02"', s=suites)
+	view = suites.frozen()
+	singletest('v.readonly and v.obj is s._value and bytes(v) == bytes(s)[2:]', v=view, s=suites)
+	view.release()
+	mac = DataArray(4, 1)
+	mac.fill(0x5c)
+	mac[0] = 1
+	mac.extend(b'\x36')
+	singletest('bytes(m) == b"\\x01\\x5c\\x5c\\x5c\\x36" and m.size() == 5', m=mac)
+	# Lecture sans copie: les champs restent des vues sur le tampon reçu jusqu'à leur premier accès
+	record = DataStruct((Uint8(), DataElemVector(1, 2**16-1), DataElemVector(1, 2**16-1)), ('type', 'a', 'b'))
+	received = b'\x01' + b'\x40\x00' + b'x' * 16384 + b'\x00\x02' + b'yz'
+	singletest('r.read(b) == len(b)', r=record, b=received)
+	singletest('isinstance(r.a._value, memoryview) and r.a._value.obj is b', r=record, b=received)
+	singletest('r.b.value == b"yz" and r.a.size() == 16386 and bytes(r) == b', r=record, b=received)
+	# Vecteurs lus paresseusement: pas fixe (calcul de la position) ou index des positions
+	suites = DataVector(Uint16, 2**16-2)
+	singletest('v.read(b"\\x00\\x03\\xc0\\x09\\xc0\\x0a\\xc0\\x23") == 8 and v._value is None', v=suites)
+	singletest('len(v) == 3 and int(v[2]) == 0xc023 and v._offsets is None and v._value is None', v=suites)
+	singletest('[int(e) for e in v] == [0xc009, 0xc00a, 0xc023] and bytes(v) == b"\\x00\\x03\\xc0\\x09\\xc0\\x0a\\xc0\\x23"', v=suites)
+	suites[0] = 0x1301
+	singletest('isinstance(v._value, list) and bytes(v) == b"\\x00\\x03\\x13\\x01\\xc0\\x0a\\xc0\\x23"', v=suites)
+	# Nombre d'éléments changé avant tout décodage: le vecteur est décodé, _buf n'est plus recopié
+	suites.read(b'\x00\x03\xc0\x09\xc0\x0a\xc0\x23')
+	suites.vectsize = 2
+	singletest('v._buf is None and bytes(v) == b"\\x00\\x02\\xc0\\x09\\xc0\\x0a" and v.size() == 6', v=suites)
+	certificates = DataVector(Certificate, 2**24-1)
+	certificates.read(b'\x00\x00\x03' + b'\x00\x01A' + b'\x00\x03BCD' + b'\x00\x00')
+	singletest('list(v._offsets) == [0, 3, 8] and v[1].value == b"BCD" and v[2].vectsize == 0', v=certificates)
+	# Vecteur tronqué: seuls les éléments entamés sont créés, même avec un nombre d'éléments falsifié
+	singletest('v.read(b"\\x02\\x00") and isinstance(v._value, list) and len(v.value) == 1 and v.vectsize == 1', v=DataVector(Uint16, 255))
+	singletest('v.read(b"\\xff\\xff\\xff\\x00\\x01A\\x00") == 8 and v.vectsize == 2', v=DataVector(Certificate, 2**24-1))
+	singletest('v.read(b"\\xff\\xff\\xffAB") == 5 and v.value == b"AB"', v=DataElemVector(1, 2**24-1))
+	# Test différentiel: feuilles entières de 1, 2 et 4 octets lues avec la même valeur par les deux chemins
+	class Header(DataStruct):
+		__slots__ = ()
+
+		def __init__(self):
+			super().__init__((Uint8(), Uint16(), Uint32(), DataElemVector(1, 255)), ('type', 'length', 'sequence', 'payload'))
+
+	singletest('crosscheck(H, b"\\x16\\x01\\x00\\x00\\x00\\x00\\x07\\x03abc")', crosscheck=crosscheck, H=Header)
+	# Tampon circulaire: écriture à cheval sur la fin du tampon, puis agrandissement
+	ring = RingBuffer(8)
+	ring.write(b'abcdef')
+	ring.consume(4)
+	ring.write(b'ghijk')
+	singletest('r.peek(7) == b"efghijk" and r.start == 4 and len(r.buf) == 8', r=ring)
+	ring.write(b'lmnop')
+	singletest('r.peek(20) == b"efghijklmnop" and len(r.buf) == 16', r=ring)
+	# Sérialisation de plusieurs messages dans un tampon d'envoi réutilisé (plus petit qu'un message au départ)
+	sendbuffer = SendBuffer(16)
+	singletest('s.append(r) == len(b) and s.append(t) == len(b) + t.size()', s=sendbuffer, r=record, t=fixedvect, b=received)
+	singletest('s.getvalue() == b + bytes(t)', s=sendbuffer, t=fixedvect, b=received)
 	return True
 
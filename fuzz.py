@@ -0,0 +1,193 @@
+#!/usr/bin/python3
+
+# Fuzzing de la couche de données guidé par la couverture
+# Chaque cible est une fabrique d'élément (MsgRecord, ClientHello...) et son corpus d'entrées.
+# Une entrée mutée est lue, réécrite puis relue; elle rejoint le corpus si elle couvre de nouveaux arcs
+# (ligne précédente, ligne) dans data.py, tls.py ou les schémas compilés.
+# Les exceptions (crash) et les entrées dont la lecture dépasse slowlimit secondes (lent) sont enregistrées à part.
+
+import hashlib
+import os
+import random
+import sys
+import time
+import traceback
+
+TRACED = ('data.py', 'tls.py')
+INTERESTING = (0, 1, 0x7f, 0x80, 0xff)
+INTERESTING16 = (0, 1, 0x7fff, 0x8000, 0xfffe, 0xffff)
+
+
+def execute(factory, data):
+	# Lecture, réécriture et relecture d'une entrée
+	elem = factory()
+	elem.read(data)
+	encoded = bytes(elem)
+	factory().read(encoded)
+	return elem
+
+
+class Coverage:
+	def __init__(self, files=TRACED):
+		self.files = files
+		self.arcs = set()
+		self.current = None
+
+	def traced(self, code):
+		name = code.co_filename
+		return name.startswith('<schema') or os.path.basename(name) in self.files
+
+	def globaltrace(self, frame, event, arg):
+		if event == 'call' and self.traced(frame.f_code):
+			self.previous = None
+			return self.localtrace
+		return None
+
+	def localtrace(self, frame, event, arg):
+		if event == 'line':
+			line = (frame.f_code.co_filename, frame.f_lineno)
+			self.current.add((self.previous, line))
+			self.previous = line
+		return self.localtrace
+
+	def run(self, factory, data):
+		# Arcs couverts par l'entrée et exception éventuelle
+		self.current = set()
+		self.previous = None
+		error = None
+		sys.settrace(self.globaltrace)
+		try:
+			execute(factory, data)
+		except Exception as e:
+			error = e
+		finally:
+			sys.settrace(None)
+		new = self.current - self.arcs
+		self.arcs |= self.current
+		return new, error
+
+
+def mutate(data, corpus, rng):
+	data = bytearray(data)
+	for i in range(rng.randint(1, 4)):
+		choice = rng.randrange(8)
+		position = rng.randrange(len(data) + 1)
+		if choice == 0 and data:
+			data[min(position, len(data) - 1)] ^= 1 << rng.randrange(8)
+		elif choice == 1 and data:
+			data[min(position, len(data) - 1)] = rng.choice(INTERESTING)
+		elif choice == 2 and len(data) >= 2:
+			position = min(position, len(data) - 2)
+			data[position:position + 2] = rng.choice(INTERESTING16).to_bytes(2, 'big')
+		elif choice == 3:
+			data[position:position] = bytes(rng.randrange(256) for _ in range(rng.randint(1, 16)))
+		elif choice == 4 and data:
+			del data[position:position + rng.randint(1, 16)]
+		elif choice == 5 and data:
+			chunk = data[position:position + rng.randint(1, 64)]
+			data[position:position] = chunk
+		elif choice == 6 and corpus:
+			other = rng.choice(corpus)
+			cut = rng.randrange(len(other) + 1)
+			data = data[:position] + other[cut:]
+		else:
+			del data[position:]
+	return bytes(data)
+
+
+def loadcorpus(directory):
+	corpus = []
+	if os.path.isdir(directory):
+		for name in sorted(os.listdir(directory)):
+			with open(os.path.join(directory, name), 'rb') as f:
+				corpus.append(f.read())
+	return corpus
+
+
+def save(directory, prefix, data):
+	os.makedirs(directory, exist_ok=True)
+	path = os.path.join(directory, prefix + '-' + hashlib.sha1(data).hexdigest()[:12] + '.bin')
+	with open(path, 'wb') as f:
+		f.write(data)
+	return path
+
+
+def fuzz(targets, corpusdir='corpus', findingsdir=None, iterations=1000, budget=None, slowlimit=0.05, seed=None,
+		verbose=True):
+	# targets: {nom: fabrique}; le corpus de départ est lu dans corpusdir/<nom>/.
+	# Renvoie {'crashes': [(cible, entrée, exception)], 'slow': [(cible, entrée, durée)], 'corpus': {nom: [entrées]},
+	# 'arcs': nombre d'arcs couverts}. Avec findingsdir, les nouvelles entrées et les trouvailles y sont écrites.
+	rng = random.Random(seed)
+	coverage = Coverage()
+	corpora = {}
+	for name, factory in targets.items():
+		corpora[name] = loadcorpus(os.path.join(corpusdir, name)) or [b'']
+		for data in corpora[name]:
+			coverage.run(factory, data)
+	crashes = []
+	slow = []
+	signatures = set()
+	start = time.perf_counter()
+	names = sorted(targets)
+	for i in range(iterations):
+		if budget is not None and time.perf_counter() - start > budget:
+			break
+		name = rng.choice(names)
+		factory = targets[name]
+		data = mutate(rng.choice(corpora[name]), corpora[name], rng)
+		new, error = coverage.run(factory, data)
+		if error is not None:
+			frame = traceback.extract_tb(error.__traceback__)[-1]
+			signature = (name, type(error).__name__, frame.filename, frame.lineno)
+			if signature not in signatures:
+				signatures.add(signature)
+				crashes.append((name, data, error))
+				if verbose:
+					print('crash', name, len(data), 'bytes:', type(error).__name__, error, frame.filename, frame.lineno)
+				if findingsdir:
+					save(os.path.join(findingsdir, name), 'crash', data)
+			continue
+		if new:
+			corpora[name].append(data)
+			if findingsdir:
+				save(os.path.join(findingsdir, name), 'cov', data)
+		# Durée sans le traçage
+		begin = time.perf_counter()
+		execute(factory, data)
+		elapsed = time.perf_counter() - begin
+		if elapsed > slowlimit:
+			slow.append((name, data, elapsed))
+			if verbose:
+				print('slow', name, len(data), 'bytes: %.3f s' % elapsed)
+			if findingsdir:
+				save(os.path.join(findingsdir, name), 'slow', data)
+	if verbose:
+		print('%d arcs, corpus: %s' % (len(coverage.arcs), ', '.join('%s %d' % (n, len(c)) for n, c in corpora.items())))
+	return {'crashes': crashes, 'slow': slow, 'corpus': corpora, 'arcs': len(coverage.arcs)}
+
+
+def fuzztests():
+	from data import DataElemVector, DataVector, Uint16
+	from tests import singletest
+
+	class Fragile(DataElemVector):
+		__slots__ = ()
+
+		def __init__(self):
+			super().__init__(1, 255)
+
+		def read_from(self, buf, offset):
+			i = super().read_from(buf, offset)
+			if 0xff in self.value:
+				raise ValueError('0xff')
+			return i
+
+	# Mutations reproductibles à graine égale; chaque mutation ajoute au plus 16 octets ou double la taille
+	first = [mutate(b"abcdef", [], random.Random(i)) for i in range(200)]
+	again = [mutate(b"abcdef", [], random.Random(i)) for i in range(200)]
+	singletest('a == b and max(map(len, a)) <= 176', a=first, b=again)
+	results = fuzz({'fragile': Fragile, 'suites': lambda: DataVector(Uint16, 2**16 - 2)}, corpusdir='',
+				iterations=300, seed=1, verbose=False)
+	singletest('[c[0] for c in r["crashes"]] == ["fragile"] and type(r["crashes"][0][2]) is ValueError', r=results)
+	singletest('r["arcs"] > 0 and len(r["corpus"]["suites"]) > 1', r=results)
+	return True
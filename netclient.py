@@ -4,10 +4,12 @@ import socket               	# Import socket module
 
 import elliptic_curves as ec
 import eccalgo as ecc
+import tls
 from Crypto.Cipher import AES
 
-curve = ec.nistCurves[0]
-ecdh = ecc.ECDHInstance(curve)
+# Ce protocole n'échange pas de courbes: celle que préfère la politique configurée (CURVE_POLICY, cf tls.curvepolicy)
+curve = tls.NAMED_CURVES[tls.curvepolicy().choose()]
+ecdh = ecc.ECEntity(curve)
 
 s = socket.socket()         	# Create a socket object
 host = socket.gethostname() 	# Get local machine name
@@ -3,10 +3,12 @@
 import socket
 import elliptic_curves as ec
 import eccalgo as ecc
+import tls
 from Crypto.Cipher import AES
 
-curve = ec.nistCurves[0]
-ecdh = ecc.ECDHInstance(curve)
+# Ce protocole n'échange pas de courbes: celle que préfère la politique configurée (CURVE_POLICY, cf tls.curvepolicy)
+curve = tls.NAMED_CURVES[tls.curvepolicy().choose()]
+ecdh = ecc.ECEntity(curve)
 
 s = socket.socket()
 host = socket.gethostname()		# Get local machine name
@@ -3,15 +3,25 @@ import socket
 import elliptic_curves as ec
 import eccalgo as ecc
 import sys
-from Crypto.Cipher import AES
 from Crypto.Hash import SHA256
 import data
+import aes
+import cipherprovider as cp
+import fuzz
+import os
+import asyncio
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
 from tests import singletest
 
 function = sys.argv[1]
 
 
 class SimpleByteStr(data.DataElemVector):
+	__slots__ = ()
+
 	def __init__(self, v=None):
 		if v:
 			super().__init__(1, 2048, 0, v)
@@ -19,13 +29,22 @@ class SimpleByteStr(data.DataElemVector):
 			super().__init__(1, 2048, 0)
 
 
+class Signature(data.DataStruct):
+	__slots__ = ()
+
+	def __init__(self):
+		super().__init__((data.DataElemVector(1, 2048, 0), data.DataElemVector(1, 1024, 0)), ('r', 's'))
+
+
 class SignedStr(data.DataStruct):
+	__slots__ = ()
+
 	def __init__(self):
-		signature = data.DataStruct((data.DataElemVector(1, 2048, 0), data.DataElemVector(1, 1024, 0)), ('r', 's'))
-		super().__init__((SimpleByteStr(), signature), ('string', 'signature'))
+		super().__init__((SimpleByteStr(), Signature()), ('string', 'signature'))
 
 
 class MsgRecord(data.DataStruct):
+	__slots__ = ('ece',)
 	TYPE_QUIT = 0
 	TYPE_SIMPLE = 1
 	TYPE_ECDSA = 2
@@ -34,6 +53,14 @@ class MsgRecord(data.DataStruct):
 		super().__init__((data.Uint8(t), data.DataElemVector(1, 4096)), ('type', 'content'))
 		self.ece = None
 
+	@staticmethod
+	def frame(peek):
+		# Taille du message: type (1 octet) puis contenu préfixé par sa longueur (2 octets)
+		header = peek(3)
+		if len(header) < 3:
+			return 3
+		return 3 + int.from_bytes(header[1:3], byteorder='big')
+
 	def getstr(self):
 		if int(self.type) == MsgRecord.TYPE_SIMPLE:
 			string = SimpleByteStr()
@@ -63,6 +90,8 @@ class MsgRecord(data.DataStruct):
 
 # Structures de données nécessaires
 class MsgPublicKey(data.DataStruct):
+	__slots__ = ()
+
 	def __init__(self, pubkey=None):
 		if pubkey:
 			pkx = data.DataElemVector(1, 1024, 0, bytes(pubkey[0]))
@@ -75,6 +104,344 @@ class MsgPublicKey(data.DataStruct):
 	def pubkey(self):
 		return bytes(self.pkx.value), bytes(self.pky.value)
 
+	@staticmethod
+	def frame(peek):
+		# Deux coordonnées préfixées par leur longueur (2 octets)
+		header = peek(2)
+		if len(header) < 2:
+			return 2
+		first = 2 + int.from_bytes(header, byteorder='big')
+		header = peek(first + 2)
+		if len(header) < first + 2:
+			return first + 2
+		return first + 2 + int.from_bytes(header[first:], byteorder='big')
+
+
+class MsgCurves(data.DataStruct):
+	# Courbes proposées par le client (identifiants tls.NamedCurve, de la préférée à la moins bonne), puis la courbe
+	# choisie par le serveur
+	__slots__ = ()
+
+	def __init__(self, curves=None):
+		value = b''.join(named.to_bytes(2, 'big') for named in curves) if curves else None
+		super().__init__((data.DataElemVector(2, 255, 0, value),), ('curves',))
+
+	def getcurves(self):
+		value = bytes(self.curves.value)
+		return [int.from_bytes(value[i:i + 2], 'big') for i in range(0, len(value), 2)]
+
+	@staticmethod
+	def frame(peek):
+		# Nombre de courbes (1 octet) puis 2 octets par courbe
+		header = peek(1)
+		if len(header) < 1:
+			return 1
+		return 1 + 2 * header[0]
+
+
+class MsgParser(data.MessageParser):
+	# Décodage incrémental des messages de type msgtype (MsgRecord, MsgPublicKey ou MsgCurves) reçus sur la socket
+	def __init__(self, msgtype, buffer=None):
+		super().__init__(buffer)
+		self.msgtype = msgtype
+
+	def frame(self, peek):
+		return self.msgtype.frame(peek)
+
+	def build(self, message):
+		msg = self.msgtype()
+		msg.read(message)
+		return msg
+
+
+DEFAULT_PORT = 14140
+
+
+def democipher(curve, pubkey, otherpk, secret):
+	# Implémentation d'AES choisie par AES_PROVIDER (par défaut: la plus rapide mesurée sur des messages courts)
+	# CFB-128 des deux côtés, quel que soit le fournisseur
+	# Clé et IV dérivés du secret partagé par le PRF de TLS 1.2, avec pour graine les deux clés publiques
+	# (triées: même graine des deux côtés)
+	provider = cp.select_provider(mode=cp.MODE_CFB, size=256)
+	seed = b''.join(sorted((tls.encodepoint(curve, pubkey), tls.encodepoint(curve, otherpk))))
+	material = tls.prf(secret, b'key expansion', seed, 32 + cp.BLOCK_SIZE)
+	return provider.new(material[:32], cp.MODE_CFB, material[32:])
+
+
+def ecdhreply(named, otherpk):
+	# Clé publique éphémère du serveur et secret partagé avec le client (dans un processus du pool)
+	entity = ecc.ECEntity(tls.NAMED_CURVES[named])
+	return entity.pubkey, entity.sharedsecret(otherpk)
+
+
+def checkpubkey(curve, pubkey):
+	# Clé publique du pair refusée avant tout calcul si ce n'est pas un point de la courbe (cf tls.decodepoint):
+	# coordonnées d'au plus fieldlength + 1 octets (ecc.int2bytes), dans le corps et vérifiant l'équation
+	n = tls.fieldlength(curve)
+	if not all(1 <= len(c) <= n + 1 for c in pubkey):
+		raise Exception('Invalid EC point encoding')
+	if not tls.oncurve(curve, ecc.bytes2int(pubkey[0]), ecc.bytes2int(pubkey[1])):
+		raise Exception('EC point not on curve')
+	return pubkey
+
+
+def ecverify(named, pubkey, signature, text):
+	return ecc.verifysignature(tls.NAMED_CURVES[named], pubkey, signature, text, SHA256)
+
+
+class AsyncServer:
+	# Serveur asyncio: les clients sont servis en même temps, chacun par la négociation de la courbe, l'échange des
+	# clés publiques puis la boucle des MsgRecord. Les calculs sur les courbes elliptiques (clé éphémère et secret
+	# partagé, vérification des signatures) passent par un pool de processus: la boucle d'événements n'attend jamais
+	# une multiplication scalaire.
+	def __init__(self, host=socket.gethostname(), port=DEFAULT_PORT, workers=None, policy=None, executor=None,
+				verbose=True):
+		self.host = host
+		self.port = port
+		self.policy = policy if policy is not None else tls.curvepolicy()
+		if executor is None:
+			# Processus du pool créés tout de suite (tous à la fois avec fork), avant la première connexion: ils
+			# n'héritent d'aucune socket de client, dont la fermeture par le serveur ne serait pas vue du client.
+			# fork seulement là où il existe, sinon le contexte par défaut de la plateforme
+			context = multiprocessing.get_context('fork') if 'fork' in multiprocessing.get_all_start_methods() else None
+			executor = ProcessPoolExecutor(workers, mp_context=context)
+			executor.submit(int).result()
+		self.executor = executor
+		self.verbose = verbose
+		self.active = 0  # connexions en cours
+		self.served = 0
+		self.messages = 0
+		self.verified = 0
+		self.errors = 0  # connexions fermées sur une erreur
+		cp.select_provider(mode=cp.MODE_CFB, size=256)  # mesure des fournisseurs AES hors de la boucle
+
+	async def start(self):
+		return await asyncio.start_server(self.handle, self.host, self.port, reuse_address=True)
+
+	async def serve(self):
+		server = await self.start()
+		print('Hosting on ' + str(self.host) + ':' + str(self.port))
+		async with server:
+			await server.serve_forever()
+
+	def log(self, *args):
+		if self.verbose:
+			print(*args)
+
+	@staticmethod
+	async def receive(reader, parser):
+		msg = parser.next()
+		while msg is None:
+			chunk = await reader.read(max(parser.needed(), 8192))
+			if not chunk:
+				return None
+			parser.buffer.write(chunk)
+			msg = parser.next()
+		return msg
+
+	async def handle(self, reader, writer):
+		loop = asyncio.get_running_loop()
+		peer = writer.get_extra_info('peername')
+		buffer = data.RingBuffer()  # partagé par les types de messages, comme ComEntity.recvbuffer
+		self.active += 1
+		self.log('Connected to', peer)
+		try:
+			msg = await self.receive(reader, MsgParser(MsgCurves, buffer))
+			named = self.policy.choose(msg.getcurves()) if msg is not None else None
+			if named is None:
+				self.log(peer, 'No common curve')
+				return
+			writer.write(bytes(MsgCurves([named])))
+			msg = await self.receive(reader, MsgParser(MsgPublicKey, buffer))
+			if msg is None:
+				return
+			otherpk = checkpubkey(tls.NAMED_CURVES[named], msg.pubkey())
+			pubkey, secret = await loop.run_in_executor(self.executor, ecdhreply, named, otherpk)
+			writer.write(bytes(MsgPublicKey(pubkey)))
+			await writer.drain()
+			aescipher = democipher(tls.NAMED_CURVES[named], pubkey, otherpk, secret)
+			records = MsgParser(MsgRecord, buffer)
+			while True:
+				msg = await self.receive(reader, records)
+				if msg is None or int(msg.type) == MsgRecord.TYPE_QUIT:
+					break
+				textstr = aescipher.decrypt(msg.getstr()).decode('UTF-8')
+				self.messages += 1
+				self.log(peer, '→', textstr)
+				if int(msg.type) == MsgRecord.TYPE_ECDSA:
+					if await loop.run_in_executor(self.executor, ecverify, named, otherpk, msg.getsignature(), textstr):
+						validity = 'verified'
+						self.verified += 1
+					else:
+						validity = 'invalid signature'
+					self.log(peer, '    Message signed with ECDSA: ' + validity)
+			self.served += 1
+		except Exception as e:
+			# Message invalide (texte non UTF-8, point incorrect, erreur d'un calcul du pool): seule cette connexion
+			# est fermée
+			self.errors += 1
+			self.log(peer, 'Error:', repr(e))
+		finally:
+			self.active -= 1
+			writer.close()
+			try:
+				await writer.wait_closed()
+			except Exception:
+				pass
+
+	def close(self):
+		self.executor.shutdown()
+
+
+def democlient(host, port, texts, policy=None):
+	# Session complète d'un client, sans saisie: textes chiffrés (signés s'ils commencent par $), puis fin.
+	# Renvoie la courbe choisie par le serveur
+	policy = policy if policy is not None else tls.curvepolicy()
+	with socket.create_connection((host, port)) as s:
+		buffer = data.RingBuffer()
+
+		def receive(msgtype):
+			parser = MsgParser(msgtype, buffer)
+			msg = parser.next()
+			while msg is None:
+				chunk = s.recv(max(parser.needed(), 8192))
+				if not chunk:
+					raise Exception('Connection closed by the server')
+				buffer.write(chunk)
+				msg = parser.next()
+			return msg
+
+		s.sendall(bytes(MsgCurves(policy.curves())))
+		named = receive(MsgCurves).getcurves()[0]
+		curve = tls.NAMED_CURVES[named]
+		entity = ecc.ECEntity(curve)
+		s.sendall(bytes(MsgPublicKey(entity.pubkey)))
+		otherpk = receive(MsgPublicKey).pubkey()
+		aescipher = democipher(curve, entity.pubkey, otherpk, entity.sharedsecret(otherpk))
+		for text in texts:
+			signature = None
+			if text[0] == '$':
+				msg = MsgRecord(MsgRecord.TYPE_ECDSA)
+				text = text[1:].strip()
+				signature = ecc.sign(entity, text, SHA256)
+			else:
+				msg = MsgRecord(MsgRecord.TYPE_SIMPLE)
+			msg.setstr(aescipher.encrypt(text.encode('UTF-8')), signature)
+			s.sendall(bytes(msg))
+		s.sendall(bytes(MsgRecord(MsgRecord.TYPE_QUIT)))
+		# Fin de la session quand le serveur ferme la connexion
+		while s.recv(8192):
+			pass
+	return named
+
+
+def startasync(server):
+	# Serveur asyncio dans une boucle d'événements d'un autre fil; renvoie le port d'écoute et la fonction d'arrêt
+	loop = asyncio.new_event_loop()
+	listener = loop.run_until_complete(server.start())
+	thread = threading.Thread(target=loop.run_forever, daemon=True)
+	thread.start()
+
+	async def shutdown():
+		# Plus de nouvelles connexions, puis fin des sessions en cours
+		listener.close()
+		await listener.wait_closed()
+		current = asyncio.current_task()
+		await asyncio.gather(*(task for task in asyncio.all_tasks() if task is not current), return_exceptions=True)
+
+	def stop():
+		# Socket d'écoute, boucle et pool de processus fermés
+		asyncio.run_coroutine_threadsafe(shutdown(), loop).result()
+		loop.call_soon_threadsafe(loop.stop)
+		thread.join()
+		loop.close()
+		server.close()
+	return listener.sockets[0].getsockname()[1], stop
+
+
+def asyncbench(connections=8, concurrency=(1, 4), texts=('hello', '$signed')):
+	# Sessions complètes par seconde selon le nombre de clients simultanés (courbe choisie par CURVE_POLICY)
+	server = AsyncServer('127.0.0.1', 0, verbose=False)
+	port, stop = startasync(server)
+	results = []
+	print('%-12s %12s' % ('concurrency', 'sessions/s'))
+	for n in concurrency:
+		start = time.perf_counter()
+		for i in range(0, connections, n):
+			clients = [threading.Thread(target=democlient, args=('127.0.0.1', port, texts)) for j in range(min(n, connections - i))]
+			for client in clients:
+				client.start()
+			for client in clients:
+				client.join()
+		rate = connections / (time.perf_counter() - start)
+		results.append((n, rate))
+		print('%-12d %12.2f' % (n, rate))
+	stop()
+	return results
+
+
+def datasamples():
+	# Structures représentatives à des tailles croissantes: (nom, paramètre, fabrique, octets encodés)
+	e = ecc.ECEntity(ec.nistCurves[0])
+	cases = []
+	for length in (16, 256, 2000):
+		msg = MsgRecord(MsgRecord.TYPE_ECDSA)
+		msg.setstr(os.urandom(length), ecc.sign(e, 'x', SHA256))
+		cases.append(('MsgRecord', length, MsgRecord, bytes(msg)))
+	for length in (24, 66, 1024):
+		cases.append(('MsgPublicKey', length, MsgPublicKey, bytes(MsgPublicKey((os.urandom(length), os.urandom(length))))))
+	for count in (8, 64, 512, 4096):
+		hello = tls.ClientHello()
+		hello.cipher_suites.value = [tls.CipherSuite(i.to_bytes(2, 'big')) for i in range(count)]
+		hello.cipher_suites.vectsize = count
+		cases.append(('ClientHello', count, tls.ClientHello, bytes(hello)))
+	for count in (1, 10, 100, 1000):
+		chain = tls.CertificateStruct()
+		for i in range(count):
+			certificate = tls.ASN1Cert()
+			certificate.setvalue(os.urandom(1000))
+			chain.certificate_list.value.append(certificate)
+		chain.certificate_list.vectsize = count
+		cases.append(('CertificateStruct', count, tls.CertificateStruct, bytes(chain)))
+	return cases
+
+
+FUZZ_TARGETS = {'MsgRecord': MsgRecord, 'MsgPublicKey': MsgPublicKey, 'SignedStr': SignedStr, 'MsgCurves': MsgCurves,
+				'ClientHello': tls.ClientHello, 'CertificateStruct': tls.CertificateStruct,
+				'Handshake': lambda: tls.Handshake(None, tls.HandshakeType.client_hello, 0)}
+
+
+def seedcorpus():
+	# Entrées de départ du fuzzing: petites instances valides de chaque cible
+	seeds = {name: [] for name in FUZZ_TARGETS}
+	for name, param, factory, encoded in datasamples():
+		if len(encoded) < 4096:
+			seeds[name].append(encoded)
+	signed = MsgRecord(MsgRecord.TYPE_ECDSA)
+	signed.setstr(b'seed', ecc.sign(ecc.ECEntity(ec.nistCurves[0]), 'seed', SHA256))
+	seeds['SignedStr'].append(bytes(signed.content.value))
+	seeds['MsgCurves'] += [bytes(MsgCurves(tls.CurvePolicy(0).curves())), bytes(MsgCurves([tls.NamedCurve.secp256r1]))]
+	hello = tls.ClientHello()
+	hello.cipher_suites.value = list(tls.CIPHER_SUITES)
+	hello.cipher_suites.vectsize = len(tls.CIPHER_SUITES)
+	handshake = tls.Handshake(None, tls.HandshakeType.client_hello, hello.size())
+	handshake.body = hello
+	seeds['Handshake'].append(bytes(handshake))
+	chain = tls.CertificateStruct()
+	for length in (1, 40, 3):
+		certificate = tls.ASN1Cert()
+		certificate.setvalue(os.urandom(length))
+		chain.certificate_list.value.append(certificate)
+	chain.certificate_list.vectsize = 3
+	seeds['CertificateStruct'].append(bytes(chain))
+	return seeds
+
+
+def writecorpus(directory='corpus'):
+	for name, entries in seedcorpus().items():
+		for entry in entries:
+			fuzz.save(os.path.join(directory, name), 'seed', entry)
+
 
 def scripttests():
 	testcurve = ec.nistCurves[0]
@@ -94,6 +461,61 @@ def scripttests():
 		singletest('e1.sharedsecret(e2.pubkey) == e2.sharedsecret(e1.pubkey)', e1=e1, e2=e2)
 		singletest('e1.sharedsecret(pk2) == e2.sharedsecret(pk1)', e1=e1, e2=e2, pk1=pk1, pk2=pk2)
 		print('')
+	# Schémas compilés et chemin générique: mêmes résultats, y compris sur des messages tronqués
+	signed = MsgRecord(MsgRecord.TYPE_ECDSA)
+	signed.setstr(b'signed text', ecc.sign(e1, 'signed text', SHA256))
+	plain = MsgRecord()
+	plain.setstr(b'plain text')
+	for msg, factory in ((MsgPublicKey(e1.pubkey), MsgPublicKey), (signed, MsgRecord), (plain, MsgRecord)):
+		singletest('data.crosscheck(f, bytes(m))', data=data, f=factory, m=msg)
+	singletest('data.crosscheck(SignedStr, s.content.value) and data.CODECS[Signature] is not None', data=data, SignedStr=SignedStr, s=signed, Signature=Signature)
+	# Corpus de fuzzing: schémas compilés et chemin générique d'accord sur chaque entrée
+	for name in FUZZ_TARGETS:
+		for entry in fuzz.loadcorpus(os.path.join('corpus', name)):
+			singletest('data.crosscheck(f, e, range(0, len(e), max(1, len(e) // 8)))', data=data, f=FUZZ_TARGETS[name], e=entry)
+	# Clé publique puis messages reçus en morceaux quelconques dans un même tampon
+	records = []
+	for text in (b'hello', b'', b'x' * 2000):
+		msg = MsgRecord()
+		msg.setstr(text)
+		records.append(bytes(msg))
+	stream = bytes(MsgPublicKey(e1.pubkey)) + b''.join(records)
+	ring = data.RingBuffer(64)
+	keys = MsgParser(MsgPublicKey, ring)
+	singletest('list(k.feed(s[:50])) == [] and k.needed() == len(bytes(MsgPublicKey(e.pubkey))) - 50', k=keys, s=stream, e=e1, MsgPublicKey=MsgPublicKey)
+	singletest('list(k.feed(s[50:130]))[0].pubkey() == e.pubkey', k=keys, s=stream, e=e1)
+	messages = MsgParser(MsgRecord, ring)
+	received = list(messages.feed(stream[130:1000])) + list(messages.feed(stream[1000:]))
+	singletest('[m.getstr() for m in r] == [b"hello", b"", b"x" * 2000] and len(b) == 0', r=received, b=ring)
+	# Négociation de la courbe: liste du client, choix du serveur selon sa politique
+	offered = MsgCurves(tls.curvepolicy('cost:224').curves())
+	curves = MsgParser(MsgCurves)
+	chosen = tls.curvepolicy('security:256').choose(list(curves.feed(bytes(offered)))[0].getcurves())
+	singletest('o.getcurves() == [21, 23, 24, 25] and c == 25 and list(p.feed(bytes(MsgCurves([c]))))[0].getcurves() == [25]', o=offered, c=chosen, p=curves, MsgCurves=MsgCurves)
+	# Serveur asyncio: clients simultanés, calculs sur les courbes dans le pool de processus
+	policy = tls.curvepolicy('cost:192')
+	server = AsyncServer('127.0.0.1', 0, workers=2, policy=policy, verbose=False)
+	port, stop = startasync(server)
+	curves = []
+	clients = [threading.Thread(target=lambda: curves.append(democlient('127.0.0.1', port, ['hello', '$signed', 'x' * 500], policy)))
+				for i in range(3)]
+	for client in clients:
+		client.start()
+	for client in clients:
+		client.join()
+	# Clé publique vide ou hors de la courbe: refusée avant le pool, seule cette connexion est fermée
+	closed = []
+	for pubkey in (None, (b'\x01', b'\x02')):
+		with socket.create_connection(('127.0.0.1', port)) as s:
+			s.sendall(bytes(MsgCurves([19])))
+			s.recv(3)
+			s.sendall(bytes(MsgPublicKey(pubkey)))
+			closed.append(s.recv(8192) == b'')
+	stop()
+	singletest('c == [19] * 3 and (s.served, s.messages, s.verified, s.active) == (3, 9, 3, 0)', c=curves, s=server)
+	singletest('f == [True] * 2 and s.errors == 2', f=closed, s=server)
+	key = ecc.ECEntity(tls.NAMED_CURVES[19])
+	singletest('k(c, e.pubkey) == e.pubkey', k=checkpubkey, c=key.curve, e=key)
 
 if function == 'test' or function == 'tests':
 	print('Début des tests')
@@ -102,13 +524,39 @@ if function == 'test' or function == 'tests':
 	ecc.ecdhtests()
 	ecc.ecdsatests()
 	data.datatests()
+	tls.tlstests()
+	aes.aestests()
+	cp.cipherprovidertests()
+	fuzz.fuzztests()
 	scripttests()
 	print('Fin des tests')
 	exit()
 
+if function == 'bench':
+	cp.cipherbench()
+	tls.hellomemorybench()
+	tls.handshakedecodebench()
+	tls.prfbench()
+	tls.recordbench()
+	tls.handshakebench()
+	asyncbench()
+	data.databench(datasamples())
+	exit()
+
+if function == 'corpus':
+	writecorpus()
+	exit()
+
+if function == 'fuzz':
+	# python3 script.py fuzz [itérations]: trouvailles (crash, lent, nouvelle couverture) dans fuzz-findings/
+	iterations = int(sys.argv[2]) if len(sys.argv) > 2 else 10000
+	results = fuzz.fuzz(FUZZ_TARGETS, 'corpus', 'fuzz-findings', iterations)
+	print('%d crashes, %d slow inputs' % (len(results['crashes']), len(results['slow'])))
+	exit()
+
 
 class ComEntity:
-	defaultport = 14140
+	defaultport = DEFAULT_PORT
 
 	def __init__(self, host=socket.gethostname(), port=defaultport):
 		# Partie réseau
@@ -116,8 +564,11 @@ class ComEntity:
 		self.host = host
 		self.port = port
 		self.netobj = self.s
+		self.sendbuffer = data.SendBuffer()
+		self.recvbuffer = data.RingBuffer()  # octets reçus pas encore décodés (partagé par les types de messages)
 
-		# Partie courbes elliptiques
+		# Partie courbes elliptiques: courbes acceptées et choix du serveur selon CURVE_POLICY (cf tls.curvepolicy)
+		self.policy = tls.curvepolicy()
 		self.ece = None
 		self.curve = None
 
@@ -131,15 +582,29 @@ class ComEntity:
 
 	def sendpubkey(self):
 		pkobj = MsgPublicKey(self.ece.pubkey)
-		self.netobj.sendall(bytes(pkobj))
+		self.sendbuffer.send(self.netobj, pkobj)
+
+	def receive(self, msgtype):
+		# Prochain message complet de type msgtype, None si la connexion est fermée avant
+		# Les octets reçus au-delà restent dans le tampon: plusieurs messages peuvent arriver d'un seul recv
+		parser = MsgParser(msgtype, self.recvbuffer)
+		msg = parser.next()
+		while msg is None:
+			chunk = self.netobj.recv(max(parser.needed(), 8192))
+			if not chunk:
+				return None
+			self.recvbuffer.write(chunk)
+			msg = parser.next()
+		return msg
 
 	def recpubkey(self):
-		pkobj = MsgPublicKey()
-		rbytes = self.netobj.recv(8192)
-		pkobj.read(rbytes)
+		pkobj = self.receive(MsgPublicKey)
 		self.otherpk = (pkobj.pkx.value, pkobj.pky.value)
 		self.mastersecret = self.ece.sharedsecret(self.otherpk)
 
+	def newcipher(self):
+		return democipher(self.curve, self.ece.pubkey, self.otherpk, self.mastersecret)
+
 	def close(self):
 		print('Closing connection')
 		if self.s:
@@ -152,10 +617,19 @@ class Client(ComEntity):
 		print('Connected')
 		print('Envoyez un message commençant par le caractère $ pour qu\'il soit signé')
 
+	def negotiatecurve(self):
+		# Courbes acceptables proposées au serveur, qui répond avec celle qu'il a choisie
+		offered = self.policy.curves()
+		self.sendbuffer.send(self.s, MsgCurves(offered))
+		msg = self.receive(MsgCurves)
+		chosen = msg.getcurves() if msg is not None else []
+		if len(chosen) != 1 or chosen[0] not in offered:
+			raise Exception('Server chose an unoffered curve')
+		print('Curve:', tls.CURVE_NAMES[chosen[0]])
+		self.initec(tls.NAMED_CURVES[chosen[0]])
+
 	def loop(self):
-		# le cipher AES utilise une partie du secret partagé comme vecteur d'initialisation
-		# ce n'est pas terrible, TODO: meilleure méthode pour déterminer un IV
-		aescipher = AES.new(self.mastersecret[:32], AES.MODE_CFB, self.mastersecret[:AES.block_size])
+		aescipher = self.newcipher()
 		loop_continue = True
 		while loop_continue:
 			msg = MsgRecord()
@@ -163,7 +637,7 @@ class Client(ComEntity):
 				text = input('> ')
 				if text == '' or text == '\0':
 					msg.type.value = MsgRecord.TYPE_QUIT
-					self.s.sendall(bytes(msg))
+					self.sendbuffer.send(self.s, msg)
 					break
 				else:
 					# Si le texte commence par $, signer le message
@@ -177,10 +651,10 @@ class Client(ComEntity):
 					textb = text.encode('UTF-8')
 					cipherb = aescipher.encrypt(textb)
 					msg.setstr(cipherb, signature)
-					self.s.sendall(bytes(msg))
+					self.sendbuffer.send(self.s, msg)
 			except EOFError:
-				msg.quit = data.Uint8(1)
-				self.s.sendall(bytes(msg))
+				msg.type.value = MsgRecord.TYPE_QUIT
+				self.sendbuffer.send(self.s, msg)
 				break
 
 
@@ -200,13 +674,22 @@ class Server(ComEntity):
 		self.netobj = self.c
 		print('Connected to', self.raddr)
 
+	def negotiatecurve(self):
+		# Courbe choisie par la politique du serveur parmi celles proposées par le client
+		msg = self.receive(MsgCurves)
+		chosen = self.policy.choose(msg.getcurves() if msg is not None else [])
+		if chosen is None:
+			raise Exception('No common curve')
+		self.sendbuffer.send(self.netobj, MsgCurves([chosen]))
+		print('Curve:', tls.CURVE_NAMES[chosen])
+		self.initec(tls.NAMED_CURVES[chosen])
+
 	def loop(self):
-		aescipher = AES.new(self.mastersecret[:32], AES.MODE_CFB, self.mastersecret[:AES.block_size])
+		aescipher = self.newcipher()
 		loop_continue = True
 		while loop_continue:
-			msg = MsgRecord()
-			msg.read(self.c.recv(8192))
-			if int(msg.type) == MsgRecord.TYPE_QUIT:
+			msg = self.receive(MsgRecord)
+			if msg is None or int(msg.type) == MsgRecord.TYPE_QUIT:
 				loop_continue = False
 			else:
 				textstr = aescipher.decrypt(msg.getstr())
@@ -225,17 +708,14 @@ class Server(ComEntity):
 			self.c.close()
 		super().close()
 
-curve = ec.nistCurves[4]
-
 if function == 'client':
 	if len(sys.argv) > 2:
 			client = Client(sys.argv[2])
 	else:
 		client = Client()
 	try:
-
-		client.initec(curve)
 		client.connect()
+		client.negotiatecurve()
 		client.sendpubkey()
 		client.recpubkey()
 		client.loop()
@@ -249,11 +729,23 @@ if function == 'server':
 	else:
 		server = Server()
 	try:
-		server.initec(curve)
 		server.connect()
+		server.negotiatecurve()
 		server.recpubkey()
 		server.sendpubkey()
 		server.loop()
 	finally:
 		server.close()
 	exit()
+
+if function == 'asyncserver':
+	# python3 script.py asyncserver [hôte [processus]]: clients simultanés, calculs ECC dans un pool de processus
+	server = AsyncServer(sys.argv[2] if len(sys.argv) > 2 else socket.gethostname(),
+						workers=int(sys.argv[3]) if len(sys.argv) > 3 else None)
+	try:
+		asyncio.run(server.serve())
+	except KeyboardInterrupt:
+		pass
+	finally:
+		server.close()
+	exit()
@@ -5,26 +5,42 @@
 
 # TLS 1.2
 
+import hashlib
+import hmac
 import os
+import socket
+import struct
+import sys
 import time
+from collections import OrderedDict
+
+from Crypto.Hash import SHA256, SHA384
+
+import cipherprovider as cp
+import eccalgo as ecc
+import elliptic_curves as ec
 from tests import singletest
-from data import DataElem, DataStruct, DataArray, DataVector, DataElemVector, Uint8, Uint16, Uint24, Uint32, Opaque
+from data import CODECS, SendBuffer, Field, MessageParser, crosscheck, DataElem, DataStruct, DataArray, DataVector, DataElemVector, Uint8, Uint16, Uint24, Uint32, Opaque
 
 
 class ConnectionEnd(Uint8):
+	__slots__ = ()
 	server = 0
 	client = 1
 
 
 class PRFAlgorithm(Uint8):
+	__slots__ = ()
 	tls_prf_sha256 = 0
 
 
 class PRFAlgorithm(Uint8):
+	__slots__ = ()
 	tls_prf_sha256 = 0
 
 
 class BulkCipherAlgorithm(Uint8):
+	__slots__ = ()
 	null = 0
 	rc4 = 1
 	tripledes = 2
@@ -32,12 +48,14 @@ class BulkCipherAlgorithm(Uint8):
 
 
 class CipherType(Uint8):
+	__slots__ = ()
 	stream = 0
 	block = 1
 	aead = 2
 
 
 class MACAlgorithm(Uint8):
+	__slots__ = ()
 	null = 0
 	hmac_md5 = 1
 	hmac_sha1 = 2
@@ -47,10 +65,12 @@ class MACAlgorithm(Uint8):
 
 
 class CompressionMethod(Uint8):
+	__slots__ = ()
 	null = 0
 
 
 class HashAlgorithm(Uint8):
+	__slots__ = ()
 	null = 0
 	md5 = 1
 	sha1 = 2
@@ -61,6 +81,7 @@ class HashAlgorithm(Uint8):
 
 
 class SignatureAlgorithm(Uint8):
+	__slots__ = ()
 	anonymous = 0
 	rsa = 1
 	dsa = 2
@@ -68,6 +89,8 @@ class SignatureAlgorithm(Uint8):
 
 
 class SignatureAndHashAlgorithm(DataStruct):
+	__slots__ = ()
+
 	def __init__(self, hashval=HashAlgorithm.null, sigval=SignatureAlgorithm.anonymous):
 		super().__init__((HashAlgorithm(hashval), SignatureAlgorithm(sigval)), ('hash', 'signature'))
 
@@ -111,12 +134,16 @@ class Server(Entity):
 # Data structure for cryptographic attributes
 
 class DigitallySigned(DataStruct):
+	__slots__ = ()
+
 	def __init__(self):
-		super().__init__((SignatureAndHashAlgorithm(), DataVector(Uint8, (2**16-1))), ('algorithm', 'signature'))
+		super().__init__((SignatureAndHashAlgorithm(), DataElemVector(1, 2**16-1)), ('algorithm', 'signature'))
 
 
 # TLS data structures
 class ProtocolVersion(DataStruct):
+	__slots__ = ()
+
 	def __init__(self, major=3, minor=3):
 		super().__init__((Uint8(), Uint8()), ('major', 'minor'))
 		# default: TLS 1.2
@@ -127,17 +154,41 @@ class ProtocolVersion(DataStruct):
 
 # TLS extension description
 class ExtensionType(Uint16):
+	__slots__ = ()
+	elliptic_curves = 10  # cf RFC 4492, p. 11
+	ec_point_formats = 11
 	signature_algorithms = 13
+	session_ticket = 35  # cf RFC 5077
 
 
 class Extension(DataStruct):
-	# TODO: initialisation avec les données de l'extension
+	__slots__ = ()
+
+	def __init__(self, exttype=0, data=None):
+		extension_data = DataElemVector(1, 2**16-1, 0, data)
+		super().__init__((ExtensionType(exttype), extension_data), ('extension_type', 'extension_data'))
+
+
+class Extensions(DataVector):
+	__slots__ = ()
+
 	def __init__(self):
-		extension_data = DataVector(Uint8, 2**16-1)
-		super().__init__((ExtensionType(), extension_data), ('extension_type', 'extension_data'))
+		super().__init__(Extension, 2**16-1)
+
+	def find(self, exttype):
+		# Données de la première extension de ce type (None si elle est absente)
+		for extension in self:
+			if int(extension.extension_type) == exttype:
+				return bytes(extension.extension_data.value)
+		return None
+
+	def add(self, exttype, data=b''):
+		self.value.append(Extension(exttype, data))
+		self.vectsize += 1
 
 
 class RecordContentType(DataElem):
+	__slots__ = ()
 	change_cipher_spec = 20
 	alert = 21
 	handshake = 22
@@ -150,26 +201,32 @@ class RecordContentType(DataElem):
 
 
 class TLSPlainText(DataStruct):
+	__slots__ = ()
+	varfields = ('fragment',)
+
 	def __init__(self, arg):
 		if isinstance(arg, bytes):
 			length = len(arg)
 			fragment = Opaque(length)
 			fragment.read(arg)
 		elif isinstance(arg, DataElem):
-			length = DataElem.size()
+			length = arg.size()
 			fragment = arg
 		super().__init__((RecordContentType(), ProtocolVersion(), Uint16(length), fragment),
 						('type', 'version', 'length', 'fragment'))
 
 
 class TLSCompressed(DataStruct):
+	__slots__ = ()
+	varfields = ('fragment',)
+
 	def __init__(self, arg):
 		if isinstance(arg, bytes):
 			length = len(arg)
 			fragment = Opaque(length)
 			fragment.read(arg)
 		elif isinstance(arg, DataElem):
-			length = DataElem.size()
+			length = arg.size()
 			fragment = arg
 		super().__init__((RecordContentType(), ProtocolVersion(), Uint16(length), fragment),
 						('type', 'version', 'length', 'fragment'))
@@ -177,12 +234,16 @@ class TLSCompressed(DataStruct):
 
 # Classes de cipher: a corriger au niveau des structures de données cryptographiques...
 class GenericStreamCipher(DataStruct):
+	__slots__ = ()
+
 	def __init__(self, content: DataElem, entity: Entity):
 		super().__init__((content, Opaque(entity.state.mac_length)),
 						('content', 'MAC'))
 
 
 class GenericBlockCipher(DataStruct):
+	__slots__ = ()
+
 	def __init__(self, content: DataElem, entity: Entity):
 		super().__init__((Opaque(entity.state.record_iv_length), content, DataArray(entity.state.mac_length, 1),
 																				Uint8()),
@@ -190,12 +251,17 @@ class GenericBlockCipher(DataStruct):
 
 
 class GenericAEADCipher(DataStruct):
+	__slots__ = ()
+
 	def __init__(self, content: DataElem, entity: Entity):
 		super().__init__((Opaque(entity.state.record_iv_length), content),
 						('nonce_explicit', 'content'))
 
 
 class TLSCipherText(DataStruct):
+	__slots__ = ()
+	varfields = ('fragment',)
+
 	def __init__(self, arg, entity: Entity):
 		if isinstance(arg, bytes):
 			length = len(arg)
@@ -217,6 +283,7 @@ class TLSCipherText(DataStruct):
 
 
 class ChangeCipherSpec(DataStruct):
+	__slots__ = ()
 	change_cipher_spec = 1
 
 	def __init__(self):
@@ -224,6 +291,7 @@ class ChangeCipherSpec(DataStruct):
 
 
 class AlertLevel(Uint8):
+	__slots__ = ()
 	warning = 1
 	fatal = 2
 
@@ -232,10 +300,12 @@ class AlertLevel(Uint8):
 
 
 class AlertDescription(Uint8):
+	__slots__ = ()
 	close_notify = 0
 	unexpected_message = 10
 	bad_record_mac = 20
 	decryption_failed_RESERVED = 21
+	record_overflow = 22
 	handshake_failure = 40
 	no_certificated_RESERVED = 41
 	bad_certificate = 42
@@ -261,11 +331,15 @@ class AlertDescription(Uint8):
 
 
 class Alert(DataStruct):
+	__slots__ = ()
+
 	def __init__(self, level=AlertLevel.warning, description=AlertDescription.internal_error):
 		super().__init__((AlertLevel(level), AlertDescription(description)), ('level', 'description'))
 
 
 class RandomStruct(DataStruct):
+	__slots__ = ()
+
 	def __init__(self, gut=0, randb=(b'\x00' * 28)):
 		super().__init__((Uint32(gut), Opaque(28)), ('gmt_unix_time', 'random_bytes'))
 		self.random_bytes.read(randb)
@@ -278,14 +352,26 @@ class RandomStruct(DataStruct):
 
 
 class SessionID(DataVector):
+	__slots__ = ()
+
 	def __init__(self):
 		super().__init__(Uint8, 32)
 
+	def getvalue(self):
+		# Identifiant en octets (sans le préfixe de longueur)
+		return self.to_bytes()[1:]
+
+	def setvalue(self, sessionid):
+		self.value = [Uint8(b) for b in sessionid]
+		self.vectsize = len(sessionid)
+
 
 class HandshakeType(Uint8):
+	__slots__ = ()
 	hello_request = 0
 	client_hello = 1
 	server_hello = 2
+	new_session_ticket = 4  # cf RFC 5077
 	certificate = 11
 	server_key_exchange = 12
 	certificate_request = 13
@@ -299,6 +385,8 @@ class HandshakeType(Uint8):
 
 
 class CipherSuite(DataElem):
+	__slots__ = ()
+
 	def __init__(self, val=b'\x00\x00'):
 		super().__init__(2, val)
 
@@ -362,100 +450,319 @@ TLS_ECDH_ECDSA_WITH_256_CBC_SHA384 = CipherSuite(b'\xC0\x26')
 
 
 class HelloRequest(DataStruct):
+	__slots__ = ()
+
 	def __init__(self):
 		super().__init__(())  # structure vide (cf RFC5246, p. 39)
 
 
 class ClientHello(DataStruct):
+	__slots__ = ()
+
 	def __init__(self):
 		ciphersuites = DataVector(CipherSuite, (2**16-2), 2)
 		compressionmethods = DataVector(Uint8, (2**8-1), 1)
-		super().__init__((ProtocolVersion(), RandomStruct.generate(), SessionID(), ciphersuites, compressionmethods),
-						('client_version', 'random', 'session_id', 'cipher_suites', 'compression_methods'))
-		# TODO: cas avec les extensions
-		# extensions: cf RFC p. 44
+		super().__init__((ProtocolVersion(), RandomStruct.generate(), SessionID(), ciphersuites, compressionmethods,
+						Extensions()),
+						('client_version', 'random', 'session_id', 'cipher_suites', 'compression_methods', 'extensions'))
 
 
 class ServerHello(DataStruct):
+	__slots__ = ()
+
 	def __init__(self):
-		ciphersuites = DataVector(CipherSuite, (2**16-2), 2)
-		compressionmethods = DataVector(Uint8, (2**8-1), 1)
-		super().__init__((ProtocolVersion(), RandomStruct.generate(), SessionID(), ciphersuites, compressionmethods),
-						('server_version', 'random', 'session_id', 'cipher_suites', 'compression_methods'))
+		super().__init__((ProtocolVersion(), RandomStruct.generate(), SessionID(), CipherSuite(), CompressionMethod(),
+						Extensions()),
+						('server_version', 'random', 'session_id', 'cipher_suite', 'compression_method', 'extensions'))
 
 
 class ASN1Cert(DataElemVector):
+	__slots__ = ()
+
 	def __init__(self):
 		super().__init__(1, 2**24-1, 1)
 
 
 class CertificateStruct(DataStruct):
+	__slots__ = ()
+
 	def __init__(self):
 		certificate_list = DataVector(ASN1Cert, 2**24-1)
 		super().__init__((certificate_list,), ('certificate_list',))
 
 
+# Courbes elliptiques (cf RFC 4492, p. 11)
+class ECCurveType(Uint8):
+	__slots__ = ()
+	named_curve = 3
+
+	def __init__(self, value=named_curve):
+		super().__init__(value)
+
+
+class NamedCurve(Uint16):
+	__slots__ = ()
+	secp192r1 = 19
+	secp224r1 = 21
+	secp256r1 = 23
+	secp384r1 = 24
+	secp521r1 = 25
+
+
+NAMED_CURVES = {NamedCurve.secp192r1: ec.nistCurves[0], NamedCurve.secp224r1: ec.nistCurves[1],
+				NamedCurve.secp256r1: ec.nistCurves[2], NamedCurve.secp384r1: ec.nistCurves[3],
+				NamedCurve.secp521r1: ec.nistCurves[4]}
+# Noms des courbes dans ec.nistParams
+CURVE_NAMES = {NamedCurve.secp192r1: 'P-192', NamedCurve.secp224r1: 'P-224', NamedCurve.secp256r1: 'P-256',
+				NamedCurve.secp384r1: 'P-384', NamedCurve.secp521r1: 'P-521'}
+
+
+class ECPointFormat(Uint8):
+	__slots__ = ()
+	uncompressed = 0
+
+
+def encodecurves(curves):
+	# Données de l'extension elliptic_curves: NamedCurveList (cf RFC 4492, p. 12)
+	return struct.pack('!H%dH' % len(curves), 2 * len(curves), *curves)
+
+
+def decodecurves(data):
+	if len(data) < 4 or len(data) % 2 or int.from_bytes(data[:2], 'big') != len(data) - 2:
+		raise AlertException(AlertDescription.decode_error, 'Invalid elliptic_curves extension')
+	return list(struct.unpack('!%dH' % ((len(data) - 2) // 2), data[2:]))
+
+
+def encodepointformats(formats=(ECPointFormat.uncompressed,)):
+	# Données de l'extension ec_point_formats (cf RFC 4492, p. 13)
+	return bytes((len(formats),)) + bytes(formats)
+
+
+def decodepointformats(data):
+	if len(data) < 2 or data[0] != len(data) - 1:
+		raise AlertException(AlertDescription.decode_error, 'Invalid ec_point_formats extension')
+	return list(data[1:])
+
+
+class CurvePolicy:
+	# Choix de la courbe ECDHE parmi celles proposées par le pair: parmi les courbes connues dont le corps fait au
+	# moins minbits bits, la moins coûteuse (prefer='cost') ou la plus sûre (prefer='security').
+	# Le coût d'une multiplication scalaire croît avec la taille du corps: P-256 est plusieurs fois moins cher que P-521
+	def __init__(self, minbits=256, prefer='cost'):
+		if prefer not in ('cost', 'security'):
+			raise Exception('Unknown curve preference: ' + str(prefer))
+		self.minbits = minbits
+		self.prefer = prefer
+
+	def curves(self):
+		# Courbes acceptables, de la préférée à la moins bonne
+		acceptable = [named for named, curve in NAMED_CURVES.items() if curve.params.p.bit_length() >= self.minbits]
+		return sorted(acceptable, key=lambda named: NAMED_CURVES[named].params.p.bit_length(),
+					reverse=self.prefer == 'security')
+
+	def choose(self, offered=None):
+		# offered: courbes du pair (None: toutes celles connues); None si aucune n'est acceptable
+		return next((named for named in self.curves() if offered is None or named in offered), None)
+
+
+def curvepolicy(config=None):
+	# config: '<prefer>[:<minbits>]', par exemple 'cost:256' ou 'security'; la variable d'environnement CURVE_POLICY
+	# sert de configuration
+	if config is None:
+		config = os.environ.get('CURVE_POLICY', 'cost:256')
+	prefer, _, minbits = config.partition(':')
+	return CurvePolicy(int(minbits) if minbits else 0, prefer or 'cost')
+
+
+class ECPoint(DataElemVector):
+	__slots__ = ()
+
+	def __init__(self):
+		super().__init__(1, 2**8-1, 1)
+
+
 # Envoyé par le serveur quand le CertificateStruct du serveur (si il a été envoyé) ne contient pas assez de données pour
-# que le client puisse échanger un premaster secret
+# que le client puisse échanger un premaster secret: ici la clé ECDHE éphémère, signée (cf RFC 4492, p. 19)
 class ServerKeyExchange(DataStruct):
+	__slots__ = ()
+
 	def __init__(self):
-		super().__init__(())
+		super().__init__((ECCurveType(), NamedCurve(), ECPoint(), DigitallySigned()),
+						('curve_type', 'named_curve', 'public', 'signed_params'))
 
 
 class CertificateRequest(DataStruct):
+	__slots__ = ()
+
 	def __init__(self):
 		super().__init__(())
 
 
 class ServerHelloDone(DataStruct):
+	__slots__ = ()
+
 	def __init__(self):
 		super().__init__(())
 
 
+# Ticket de session chiffré par le serveur, que le client lui renvoie pour reprendre la session (cf RFC 5077, p. 8)
+class NewSessionTicket(DataStruct):
+	__slots__ = ()
+
+	def __init__(self):
+		super().__init__((Uint32(), DataElemVector(1, 2**16-1)), ('ticket_lifetime_hint', 'ticket'))
+
+
+# État de la session chiffré dans le ticket
+class StatePlaintext(DataStruct):
+	__slots__ = ()
+
+	def __init__(self):
+		super().__init__((ProtocolVersion(), CipherSuite(), Opaque(48), Uint32()),
+						('protocol_version', 'cipher_suite', 'master_secret', 'timestamp'))
+
+
 class CertificateVerify(DataStruct):
+	__slots__ = ()
+
 	def __init__(self):
 		super().__init__(())
 
 
-class ClientKeyExchange(Uint8):
+class ClientKeyExchange(DataStruct):
+	__slots__ = ()
+
 	def __init__(self):
-		super().__init__(())
+		super().__init__((ECPoint(),), ('public',))
+
 
+class Finished(DataStruct):
+	__slots__ = ()
 
-class Finished(Uint8):
 	def __init__(self):
-		super().__init__(0)
+		super().__init__((Opaque(12),), ('verify_data',))
+
+
+# Corps des messages Handshake selon leur type (cf RFC 5246, p. 37): registerhandshake() en ajoute d'autres
+HANDSHAKE_BODIES = {}
+
+
+def registerhandshake(hstype, factory):
+	HANDSHAKE_BODIES[int(hstype)] = factory
+	return factory
+
+
+for hstype, factory in ((HandshakeType.hello_request, HelloRequest), (HandshakeType.client_hello, ClientHello),
+						(HandshakeType.server_hello, ServerHello), (HandshakeType.new_session_ticket, NewSessionTicket),
+						(HandshakeType.certificate, CertificateStruct), (HandshakeType.server_key_exchange, ServerKeyExchange),
+						(HandshakeType.certificate_request, CertificateRequest),
+						(HandshakeType.server_hello_done, ServerHelloDone),
+						(HandshakeType.certificate_verify, CertificateVerify),
+						(HandshakeType.client_key_exchange, ClientKeyExchange), (HandshakeType.finished, Finished)):
+	registerhandshake(hstype, factory)
 
 
 class Handshake(DataStruct):
-	def __init__(self, entity, hstype, length):
-		# Placeholder: TODO
-		if hstype == HandshakeType.hello_request:
-			body = HelloRequest()
-		elif hstype == HandshakeType.client_hello:
-			body = ClientHello()
-		elif hstype == HandshakeType.server_hello:
-			body = ServerHello()
-		elif hstype == HandshakeType.certificate:
-			body = CertificateStruct()
-		elif hstype == HandshakeType.server_key_exchange:
-			body = ServerKeyExchange()
-		elif hstype == HandshakeType.certificate_request:
-			body = CertificateRequest()
-		elif hstype == HandshakeType.server_hello_done:
-			body = ServerHelloDone()
-		elif hstype == HandshakeType.certificate_verify:
-			body = CertificateVerify()
-		elif hstype == HandshakeType.client_key_exchange:
-			body = ClientKeyExchange()
-		elif hstype == HandshakeType.finished:
-			body = Finished()
-		else:
-			raise Exception("Invalid handshake type")
+	__slots__ = ()
+	varfields = ('body',)
+
+	def __init__(self, entity, hstype, length, body=None):
+		if body is None:
+			factory = HANDSHAKE_BODIES.get(hstype)
+			if factory is None:
+				raise AlertException(AlertDescription.unexpected_message, 'Invalid handshake type: ' + str(hstype))
+			body = factory()
 		super().__init__((HandshakeType(hstype), Uint24(length), body),
 						('msg_type', 'length', 'body'))
 
 
+class HandshakePool:
+	# Messages Handshake décodés d'une connexion, réutilisés d'un message à l'autre (un objet par type):
+	# le message suivant du même type est relu dans le même objet. Les gestionnaires copient ce qu'ils gardent.
+	def __init__(self):
+		self.messages = {}
+		self.created = self.reused = 0
+
+	def get(self, hstype, length):
+		message = self.messages.get(hstype)
+		if message is None:
+			message = Handshake(None, hstype, length)
+			self.messages[hstype] = message
+			self.created += 1
+		else:
+			self.reused += 1
+		return message
+
+
+# Taille maximale d'un fragment (TLSCipherText, cf RFC5246, p. 22)
+MAX_FRAGMENT_LENGTH = 2**14 + 2048
+
+
+class RecordParser(MessageParser):
+	# Enregistrements TLSPlainText/TLSCompressed/TLSCipherText: en-tête de 5 octets dont la longueur du fragment
+	def frame(self, peek):
+		header = peek(5)
+		if len(header) < 5:
+			return 5
+		length = int.from_bytes(header[3:5], byteorder=DataElem.order)
+		if length > MAX_FRAGMENT_LENGTH:
+			raise AlertException(AlertDescription.record_overflow, 'Record overflow: ' + str(length) + ' bytes')
+		return 5 + length
+
+	def build(self, message):
+		record = TLSPlainText(bytes(len(message) - 5))
+		record.read(message)
+		return record
+
+
+class Transcript:
+	# Hachage courant des messages de la poignée de main, sans garder leurs octets.
+	# Tant que la suite n'est pas négociée, les messages sont hachés avec tous les algorithmes possibles du PRF;
+	# select() ne garde ensuite que le bon. Les condensats intermédiaires sont pris sur une copie de l'état (fork).
+	def __init__(self, hashnames=('sha256', 'sha384')):
+		self.hashes = {name: hashlib.new(name) for name in hashnames}
+
+	def append(self, message):
+		for h in self.hashes.values():
+			h.update(message)
+
+	def select(self, hashname):
+		self.hashes = {hashname: self.hashes[hashname]}
+
+	def fork(self, hashname):
+		return self.hashes[hashname].copy()
+
+	def digest(self, hashname):
+		return self.fork(hashname).digest()
+
+
+class HandshakeParser(MessageParser):
+	# Messages Handshake (en-tête de 4 octets), éventuellement répartis sur plusieurs enregistrements:
+	# on y fournit les fragments des enregistrements de type handshake.
+	# Les octets de chaque message décodé sont ajoutés à transcript (si donné) pour les hachages de la poignée de main
+	# Avec pool, les messages décodés sont pris dans un HandshakePool au lieu d'être créés à chaque fois
+	def __init__(self, buffer=None, transcript=None, pool=None):
+		super().__init__(buffer)
+		self.transcript = transcript
+		self.pool = pool
+
+	def frame(self, peek):
+		header = peek(4)
+		if len(header) < 4:
+			return 4
+		return 4 + int.from_bytes(header[1:4], byteorder=DataElem.order)
+
+	def build(self, message):
+		if self.transcript is not None:
+			self.transcript.append(message)
+		if self.pool is not None:
+			handshake = self.pool.get(message[0], len(message) - 4)
+		else:
+			handshake = Handshake(None, message[0], len(message) - 4)
+		handshake.read(message)
+		return handshake
+
+
 class Client:
 	def __init__(self, hostname='localhost', portnumber=8034):
 		self.hostname = hostname
@@ -475,3 +782,1358 @@ CIPHER_SUITES = [
 	]
 
 
+# Suites négociées par le moteur de poignée de main: (longueur de la clé AES, hachage du MAC, hachage du PRF)
+# En TLS 1.2, le PRF utilise SHA-256 sauf si la suite en désigne un plus fort (cf RFC 5289)
+SUITE_PARAMS = {
+	bytes(TLS_ECDHE_ECDSA_WITH_128_CBC_SHA): (16, 'sha1', 'sha256'),
+	bytes(TLS_ECDHE_ECDSA_WITH_256_CBC_SHA): (32, 'sha1', 'sha256'),
+	bytes(TLS_ECDHE_ECDSA_WITH_128_CBC_SHA256): (16, 'sha256', 'sha256'),
+	bytes(TLS_ECDHE_ECDSA_WITH_256_CBC_SHA384): (32, 'sha384', 'sha384')
+	}
+MAC_ALGORITHMS = {'sha1': MACAlgorithm.hmac_sha1, 'sha256': MACAlgorithm.hmac_sha256, 'sha384': MACAlgorithm.hmac_sha384}
+# Hachage des signatures ECDSA (celui du PRF de la suite)
+SIGNATURE_HASHES = {HashAlgorithm.sha256: SHA256, HashAlgorithm.sha384: SHA384}
+PRF_SIGNATURE_HASH = {'sha256': HashAlgorithm.sha256, 'sha384': HashAlgorithm.sha384}
+
+
+IPAD = bytes(x ^ 0x36 for x in range(256))
+OPAD = bytes(x ^ 0x5c for x in range(256))
+
+
+class PRF:
+	# PRF de TLS 1.2 avec un secret donné (cf RFC 5246, p. 14). Les hachages de la clé HMAC combinée à ipad et à opad
+	# sont calculés une fois: chaque HMAC (deux par bloc de P_hash) repart d'une copie de ces deux états.
+	# Un même objet sert pour toutes les dérivations à partir du secret maître d'une connexion.
+	def __init__(self, secret, hashname='sha256'):
+		self.hashname = hashname
+		inner = hashlib.new(hashname)
+		if len(secret) > inner.block_size:
+			secret = hashlib.new(hashname, secret).digest()
+		key = secret.ljust(inner.block_size, b'\x00')
+		inner.update(key.translate(IPAD))
+		self.inner = inner
+		self.outer = hashlib.new(hashname, key.translate(OPAD))
+
+	def mac(self, *parts):
+		inner = self.inner.copy()
+		for data in parts:
+			inner.update(data)
+		outer = self.outer.copy()
+		outer.update(inner.digest())
+		return outer.digest()
+
+	def expand(self, seed, length):
+		# P_hash(secret, seed) tronqué à length octets
+		mac = self.mac
+		out = bytearray()
+		a = seed
+		while len(out) < length:
+			a = mac(a)
+			out += mac(a + seed)
+		return bytes(out[:length])
+
+	def __call__(self, label, seed, length):
+		return self.expand(label + seed, length)
+
+
+def P_SHA256(secret, seed, length):
+	return PRF(secret, 'sha256').expand(seed, length)
+
+
+def P_SHA384(secret, seed, length):
+	return PRF(secret, 'sha384').expand(seed, length)
+
+
+def prf(secret, label, seed, length, hashname='sha256'):
+	return PRF(secret, hashname)(label, seed, length)
+
+
+def mastersecret(premaster, clientrandom, serverrandom, hashname='sha256'):
+	# cf RFC 5246, p. 64
+	return prf(premaster, b'master secret', clientrandom + serverrandom, 48, hashname)
+
+
+def keymaterial(master, clientrandom, serverrandom, maclength, keylength, ivlength=0, hashname='sha256'):
+	# Bloc de clés complet en un seul appel (cf RFC 5246, p. 25): clés MAC, clés de chiffrement et IV implicites
+	# (client puis serveur). master: secret maître ou objet PRF déjà construit avec lui
+	derive = master if isinstance(master, PRF) else PRF(master, hashname)
+	block = derive(b'key expansion', serverrandom + clientrandom, 2 * (maclength + keylength + ivlength))
+	ends = [maclength, maclength, keylength, keylength, ivlength, ivlength]
+	material = []
+	start = 0
+	for length in ends:
+		material.append(block[start:start + length])
+		start += length
+	return material
+
+
+# Suites permises pour False Start (cf RFC 7918, p. 6): liste explicite, à revoir pour toute nouvelle suite.
+# Toutes les suites ECDHE-ECDSA actuelles conviennent: échange de clés éphémère et chiffrement d'au moins 128 bits
+FALSE_START_SUITES = frozenset(bytes(suite) for suite in (TLS_ECDHE_ECDSA_WITH_128_CBC_SHA, TLS_ECDHE_ECDSA_WITH_256_CBC_SHA,
+														TLS_ECDHE_ECDSA_WITH_128_CBC_SHA256, TLS_ECDHE_ECDSA_WITH_256_CBC_SHA384))
+
+
+class AlertException(Exception):
+	# Erreur fatale de la poignée de main ou de la couche d'enregistrement: l'alerte est envoyée au pair
+	def __init__(self, description, message=None):
+		super().__init__(message or 'TLS alert ' + str(description))
+		self.description = description
+
+
+class AlertReceived(Exception):
+	# Alerte fatale reçue du pair: la connexion est fermée, aucune alerte n'est renvoyée
+	def __init__(self, description):
+		super().__init__('TLS alert received: ' + str(description))
+		self.description = description
+
+
+def fieldlength(curve):
+	return (curve.params.p.bit_length() + 7) // 8
+
+
+# Les certificats sont des clés publiques ECDSA brutes (point non compressé): la courbe se déduit de leur taille
+CERTIFICATE_CURVES = {2 * fieldlength(curve) + 1: curve for curve in NAMED_CURVES.values()}
+
+
+def encodepoint(curve, pubkey):
+	# Point non compressé (cf RFC 4492, p. 15)
+	n = fieldlength(curve)
+	return b'\x04' + ecc.int2bytes(ecc.bytes2int(pubkey[0]), n) + ecc.int2bytes(ecc.bytes2int(pubkey[1]), n)
+
+
+def oncurve(curve, x, y):
+	# Coordonnées affines entières dans le corps et vérifiant l'équation de la courbe
+	p = curve.params.p
+	return x < p and y < p and (y * y - x * x * x - curve.params.a * x - curve.params.b) % p == 0
+
+
+def decodepoint(curve, point):
+	# Coordonnées d'un point non compressé, refusé s'il n'est pas sur la courbe
+	n = fieldlength(curve)
+	if len(point) != 2 * n + 1 or point[0] != 4:
+		raise AlertException(AlertDescription.illegal_parameter, 'Invalid EC point encoding')
+	x, y = point[1:n + 1], point[n + 1:]
+	if not oncurve(curve, ecc.bytes2int(x), ecc.bytes2int(y)):
+		raise AlertException(AlertDescription.illegal_parameter, 'EC point not on curve')
+	return bytes(x), bytes(y)
+
+
+def premaster(entity, pubkey):
+	# Secret ECDH: abscisse du point partagé, sur la taille du corps (cf RFC 4492, p. 25)
+	return ecc.int2bytes(ecc.bytes2int(entity.sharedsecret(pubkey)), fieldlength(entity.curve))
+
+
+def derlength(n):
+	return bytes((n,)) if n < 128 else bytes((0x81, n))
+
+
+def encodesignature(signature):
+	# Signature ECDSA: SEQUENCE { INTEGER r, INTEGER s } en DER (cf RFC 4492, p. 20)
+	body = b''
+	for v in signature:
+		v = v.to_bytes(v.bit_length() // 8 + 1, byteorder='big')  # octet nul en tête si le bit de poids fort vaut 1
+		body += b'\x02' + derlength(len(v)) + v
+	return b'\x30' + derlength(len(body)) + body
+
+
+def derread(data, i, tag):
+	# Contenu et position suivante de l'élément DER de type tag à la position i
+	if len(data) < i + 2 or data[i] != tag:
+		raise AlertException(AlertDescription.decode_error, 'Invalid DER signature')
+	length = data[i + 1]
+	i += 2
+	if length == 0x81 and len(data) > i:
+		length = data[i]
+		i += 1
+	elif length > 0x80:
+		raise AlertException(AlertDescription.decode_error, 'Invalid DER signature')
+	if len(data) < i + length:
+		raise AlertException(AlertDescription.decode_error, 'Invalid DER signature')
+	return data[i:i + length], i + length
+
+
+def decodesignature(data):
+	sequence, end = derread(data, 0, 0x30)
+	r, i = derread(sequence, 0, 0x02)
+	s, i = derread(sequence, i, 0x02)
+	if end != len(data) or i != len(sequence):
+		raise AlertException(AlertDescription.decode_error, 'Invalid DER signature')
+	return ecc.bytes2int(r), ecc.bytes2int(s)
+
+
+def recordheader(ctype, length):
+	return struct.pack('!BBBH', ctype, 3, 3, length)
+
+
+MAX_FRAGMENT = 2**14
+IOV_MAX = os.sysconf('SC_IOV_MAX') if hasattr(os, 'sysconf') else 16
+
+
+def fragments(view, size=MAX_FRAGMENT):
+	return [view[i:i + size] for i in range(0, len(view), size)]
+
+
+class BlockProtection:
+	# Protection des enregistrements d'un sens de la connexion: AES-CBC avec IV explicite, MAC puis chiffrement
+	# (GenericBlockCipher, cf RFC 5246, p. 22). Le numéro de séquence entre dans le MAC.
+	# Le HMAC repart des états ipad/opad précalculés de la clé MAC (cf PRF)
+	def __init__(self, key, mackey, machash):
+		self.key = key
+		self.mackey = mackey
+		self.machash = machash
+		self.hmac = PRF(mackey, machash)
+		self.maclength = hashlib.new(machash).digest_size
+		self.provider = cp.select_provider(mode=cp.MODE_CBC)
+		self.seq = 0
+
+	def mac(self, ctype, content):
+		m = self.hmac.mac(struct.pack('!Q', self.seq) + recordheader(ctype, len(content)), content)
+		self.seq += 1
+		return m
+
+	def seal(self, ctype, content):
+		# Enregistrement complet (en-tête compris)
+		return b''.join(self.sealmany(ctype, [content]))
+
+	def sealmany(self, ctype, fragments):
+		# Enregistrements de plusieurs fragments: IV tirés en une fois, chiffrement en un seul lot.
+		# Chaque enregistrement est rendu en deux morceaux (en-tête et IV, puis chiffré) pour sendmsg
+		plains = []
+		for content in fragments:
+			mac = self.mac(ctype, content)
+			padding = 15 - (len(content) + len(mac)) % 16
+			plains.append(b''.join((content, mac, bytes((padding,)) * (padding + 1))))
+		ivs = os.urandom(16 * len(plains))
+		encrypted = self.provider.encrypt_cbc_batch(self.key, ivs, plains)
+		records = []
+		for i, e in enumerate(encrypted):
+			records.append(recordheader(ctype, 16 + len(e)) + ivs[16 * i:16 * i + 16])
+			records.append(e)
+		return records
+
+	def open(self, ctype, fragment):
+		if len(fragment) % 16 or len(fragment) < 32 or len(fragment) < 16 + self.maclength + 1:
+			raise AlertException(AlertDescription.bad_record_mac)
+		plain = self.provider.new(self.key, cp.MODE_CBC, bytes(fragment[:16])).decrypt(fragment[16:])
+		padding = plain[-1]
+		end = len(plain) - padding - 1 - self.maclength
+		valid = end >= 0 and plain[end + self.maclength:-1] == bytes((padding,)) * padding
+		end = max(end, 0)
+		# MAC calculé même si le remplissage est invalide: pas de différence de temps visible entre les deux erreurs
+		expected = self.mac(ctype, plain[:end])
+		if not (hmac.compare_digest(expected, plain[end:end + self.maclength]) and valid):
+			raise AlertException(AlertDescription.bad_record_mac)
+		return plain[:end]
+
+
+class Session:
+	# Paramètres négociés gardés pour une poignée de main abrégée (ticket: ticket de session reçu par le client)
+	__slots__ = ('id', 'suite', 'masterSecret', 'ticket')
+
+	def __init__(self, sessionid, suite, mastersecret, ticket=b''):
+		self.id = sessionid
+		self.suite = suite
+		self.masterSecret = mastersecret
+		self.ticket = ticket
+
+
+class SessionCache:
+	# Sessions du serveur par identifiant, de la moins récemment utilisée à la plus récente.
+	# Une session expire ttl secondes après sa création; au-delà de capacity sessions ou de maxbytes octets
+	# (estimation de la mémoire occupée), les moins récemment utilisées sont retirées.
+	def __init__(self, capacity=10000, ttl=3600, maxbytes=None, clock=time.monotonic):
+		self.capacity = capacity
+		self.ttl = ttl
+		self.maxbytes = maxbytes
+		self.clock = clock
+		self.sessions = OrderedDict()  # identifiant -> (expiration, session)
+		self.bytes = 0
+		self.hits = self.misses = self.evictions = self.expirations = 0
+
+	def __len__(self):
+		return len(self.sessions)
+
+	@staticmethod
+	def entrysize(session):
+		return sys.getsizeof(session) + sys.getsizeof(session.id) + sys.getsizeof(session.masterSecret) + ENTRY_OVERHEAD
+
+	def put(self, session):
+		self.remove(session.id)
+		self.sessions[session.id] = (self.clock() + self.ttl, session)
+		self.bytes += self.entrysize(session)
+		while self.sessions and (len(self.sessions) > self.capacity or
+									(self.maxbytes is not None and self.bytes > self.maxbytes)):
+			self.bytes -= self.entrysize(self.sessions.popitem(last=False)[1][1])
+			self.evictions += 1
+
+	def get(self, sessionid):
+		entry = self.sessions.get(sessionid)
+		if entry is not None and entry[0] <= self.clock():
+			self.remove(sessionid)
+			self.expirations += 1
+			entry = None
+		if entry is None:
+			self.misses += 1
+			return None
+		self.sessions.move_to_end(sessionid)
+		self.hits += 1
+		return entry[1]
+
+	def remove(self, sessionid):
+		entry = self.sessions.pop(sessionid, None)
+		if entry is not None:
+			self.bytes -= self.entrysize(entry[1])
+
+	def stats(self):
+		lookups = self.hits + self.misses
+		return {'sessions': len(self.sessions), 'bytes': self.bytes, 'hits': self.hits, 'misses': self.misses,
+				'hit_rate': self.hits / lookups if lookups else 0.0, 'evictions': self.evictions,
+				'expirations': self.expirations}
+
+
+# Entrée du dictionnaire, tuple (expiration, session) et flottant d'expiration
+ENTRY_OVERHEAD = 100 + sys.getsizeof((0.0, None)) + sys.getsizeof(0.0)
+
+
+class TicketKey:
+	# Nom (16 octets, en clair en tête des tickets), clé AES-128 et clé HMAC-SHA256
+	__slots__ = ('name', 'aeskey', 'mackey')
+
+	def __init__(self, name=None, aeskey=None, mackey=None):
+		self.name = name or os.urandom(16)
+		self.aeskey = aeskey or os.urandom(16)
+		self.mackey = mackey or os.urandom(32)
+
+	@staticmethod
+	def derive(secret, epoch):
+		# Même clé sur tous les serveurs qui partagent secret, pour la période epoch: rotation sans coordination
+		block = prf(secret, b'ticket key', struct.pack('!Q', epoch), 64)
+		return TicketKey(block[:16], block[16:32], block[32:])
+
+
+class TicketKeys:
+	# Clés des tickets de session, à partager entre les serveurs qui reprennent les sessions les uns des autres.
+	# La première chiffre les nouveaux tickets, les keep - 1 suivantes (plus anciennes) déchiffrent encore ceux
+	# qu'elles ont chiffrés: ces tickets sont renouvelés à la reprise. Un ticket est valable lifetime secondes.
+	# Format (cf RFC 5077, p. 11): nom de la clé, IV, état chiffré en AES-CBC, HMAC-SHA256 de ce qui précède
+	def __init__(self, keys=None, keep=2, lifetime=86400, clock=time.time):
+		self.keys = list(keys) if keys else [TicketKey()]
+		self.keep = keep
+		self.lifetime = lifetime
+		self.clock = clock
+		self.issued = self.accepted = self.rejected = 0
+
+	def rotate(self, key=None):
+		self.keys.insert(0, key or TicketKey())
+		del self.keys[self.keep:]
+		return self.keys[0]
+
+	def current(self, ticket):
+		return ticket[:16] == self.keys[0].name
+
+	def seal(self, session):
+		key = self.keys[0]
+		state = StatePlaintext()
+		state.cipher_suite.value = session.suite
+		state.master_secret.read(session.masterSecret)
+		state.timestamp.value = int(self.clock())
+		plain = bytes(state)
+		padding = 16 - len(plain) % 16
+		iv = os.urandom(16)
+		body = key.name + iv + cp.select_provider(mode=cp.MODE_CBC).new(key.aeskey, cp.MODE_CBC, iv).encrypt(
+			plain + bytes((padding,)) * padding)
+		self.issued += 1
+		return body + hmac.new(key.mackey, body, 'sha256').digest()
+
+	def open(self, ticket):
+		# Session du ticket, None s'il est invalide, expiré ou chiffré avec une clé retirée
+		key = next((k for k in self.keys if k.name == ticket[:16]), None)
+		session = None
+		if key is not None and len(ticket) >= 80 and len(ticket) % 16 == 0 and \
+				hmac.compare_digest(hmac.new(key.mackey, ticket[:-32], 'sha256').digest(), ticket[-32:]):
+			plain = cp.select_provider(mode=cp.MODE_CBC).new(key.aeskey, cp.MODE_CBC, ticket[16:32]).decrypt(ticket[32:-32])
+			state = StatePlaintext()
+			state.read(plain[:-plain[-1]])
+			if 0 <= self.clock() - int(state.timestamp) <= self.lifetime and bytes(state.cipher_suite) in SUITE_PARAMS:
+				session = Session(b'', bytes(state.cipher_suite), bytes(state.master_secret.value), ticket)
+		if session is None:
+			self.rejected += 1
+		else:
+			self.accepted += 1
+		return session
+
+	def stats(self):
+		return {'keys': len(self.keys), 'issued': self.issued, 'accepted': self.accepted, 'rejected': self.rejected}
+
+
+class Connection(Entity):
+	# Moteur de poignée de main TLS 1.2 ECDHE-ECDSA sans entrées-sorties: receive() consomme des octets reçus
+	# (en morceaux quelconques) et renvoie les données applicatives, outgoing() renvoie les octets à envoyer au pair.
+	# Les messages d'un même vol sont écrits dans un seul enregistrement: la poignée de main complète prend deux
+	# allers-retours, le client envoie ses données applicatives avec son Finished s'il en a.
+	handlers = {}
+
+	def __init__(self, cend, suites=None):
+		super().__init__(cend)
+		self.suites = [bytes(suite) for suite in (suites if suites is not None else CIPHER_SUITES)]
+		self.records = RecordParser()
+		self.transcript = Transcript()
+		self.handshakes = HandshakeParser(transcript=self.transcript, pool=HandshakePool())
+		self.flight = SendBuffer()
+		self.output = []  # enregistrements à envoyer
+		self.reader = self.writer = None  # protections en lecture et en écriture (None: en clair)
+		self.pendingreader = self.pendingwriter = None  # actives après ChangeCipherSpec
+		self.expected = None  # type du prochain message de la poignée de main
+		self.peerverify = None  # verify_data attendu dans le Finished du pair
+		self.prfhash = 'sha256'
+		self.prf = None  # PRF du secret maître
+		self.suite = None
+		self.sessionid = b''
+		self.resumed = False  # poignée de main abrégée (session reprise, sans opération à clé publique)
+		self.established = False
+		self.falsestarted = False  # False Start: données applicatives permises avant le Finished du pair
+		self.closed = False
+
+	def negotiate(self, suite):
+		keylength, machash, self.prfhash = SUITE_PARAMS[suite]
+		self.suite = suite
+		self.transcript.select(self.prfhash)
+		state = self.state
+		state.cipherType = CipherType(CipherType.block)
+		state.blockCipher = BulkCipherAlgorithm(BulkCipherAlgorithm.aes)
+		state.enc_key_length = keylength
+		state.block_length = state.record_iv_length = 16
+		state.MACalgo = MACAlgorithm(MAC_ALGORITHMS[machash])
+		state.mac_length = state.mac_key_length = hashlib.new(machash).digest_size
+
+	def master(self, secret):
+		state = self.state
+		state.masterSecret = mastersecret(secret, state.clientRandom, state.serverRandom, self.prfhash)
+
+	def keys(self):
+		# Clés des deux sens à partir du secret maître; le même PRF sert ensuite aux messages Finished
+		state = self.state
+		self.prf = PRF(state.masterSecret, self.prfhash)
+		clientmac, servermac, clientkey, serverkey, clientiv, serveriv = keymaterial(
+			self.prf, state.clientRandom, state.serverRandom, state.mac_key_length, state.enc_key_length)
+		machash = SUITE_PARAMS[self.suite][1]
+		client = BlockProtection(clientkey, clientmac, machash)
+		server = BlockProtection(serverkey, servermac, machash)
+		if int(self.state.connectionEnd) == ConnectionEnd.client:
+			self.pendingwriter, self.pendingreader = client, server
+		else:
+			self.pendingwriter, self.pendingreader = server, client
+
+	def verifydata(self, label):
+		return self.prf(label, self.transcript.digest(self.prfhash), 12)
+
+	# Sortie
+	def record(self, ctype, content):
+		self.recordmany(ctype, [content])
+
+	def recordmany(self, ctype, fragments):
+		if self.writer is None:
+			self.output.extend(b''.join((recordheader(ctype, len(content)), content)) for content in fragments)
+		else:
+			self.output.extend(self.writer.sealmany(ctype, fragments))
+
+	def handshake(self, hstype, body):
+		# Message ajouté au vol en cours et à la transcription
+		message = Handshake(None, hstype, body.size(), body)
+		start = self.flight.length
+		self.flight.append(message)
+		with memoryview(self.flight.buf) as view:
+			self.transcript.append(view[start:self.flight.length])
+
+	def flush(self):
+		# Vol en cours dans des enregistrements de 2^14 octets au plus
+		with memoryview(self.flight.buf) as view:
+			self.recordmany(RecordContentType.handshake, fragments(view[:self.flight.length]))
+		self.flight.length = 0
+
+	def changecipher(self):
+		self.flush()
+		self.record(RecordContentType.change_cipher_spec, b'\x01')
+		self.writer, self.pendingwriter = self.pendingwriter, None
+
+	def finish(self, label):
+		body = Finished()
+		body.verify_data.read(self.verifydata(label))
+		self.handshake(HandshakeType.finished, body)
+		self.flush()
+
+	def alert(self, description, level=AlertLevel.fatal):
+		self.record(RecordContentType.alert, bytes((level, description)))
+
+	def outgoing(self):
+		data = b''.join(self.output)
+		self.output.clear()
+		return data
+
+	def writeto(self, sock):
+		# Enregistrements en attente écrits par sendmsg: jusqu'à IOV_MAX enregistrements par appel système.
+		# Renvoie le nombre d'appels
+		calls = 0
+		pending = self.output
+		while pending:
+			sent = sock.sendmsg(pending[:IOV_MAX])
+			calls += 1
+			done = 0
+			while done < len(pending) and sent >= len(pending[done]):
+				sent -= len(pending[done])
+				done += 1
+			del pending[:done]
+			if sent:
+				pending[0] = pending[0][sent:]
+		return calls
+
+	def send(self, data):
+		if not (self.established or self.falsestarted):
+			raise Exception('Handshake not finished')
+		with memoryview(data) as view:
+			self.recordmany(RecordContentType.application_data, fragments(view))
+
+	def close(self):
+		self.alert(AlertDescription.close_notify, AlertLevel.warning)
+		self.closed = True
+
+	# Entrée
+	def receive(self, data):
+		appdata = []
+		try:
+			for record in self.records.feed(data):
+				ctype = record.type.value[0]
+				fragment = record.fragment.value
+				if self.reader is not None:
+					fragment = self.reader.open(ctype, fragment)
+				if ctype == RecordContentType.handshake:
+					for message in self.handshakes.feed(fragment):
+						self.dispatch(message)
+				elif ctype == RecordContentType.change_cipher_spec:
+					self.changecipherspec(fragment)
+				elif ctype == RecordContentType.application_data and self.established:
+					appdata.append(fragment)
+				elif ctype == RecordContentType.alert and len(fragment) == 2:
+					self.closed = True
+					if fragment[1] != AlertDescription.close_notify:
+						raise AlertReceived(fragment[1])
+				else:
+					raise AlertException(AlertDescription.unexpected_message)
+		except AlertException as e:
+			self.alert(e.description)
+			raise
+		return b''.join(appdata)
+
+	def dispatch(self, message):
+		hstype = int(message.msg_type)
+		if hstype != self.expected:
+			raise AlertException(AlertDescription.unexpected_message, 'Unexpected handshake message: ' + str(hstype))
+		self.handlers[hstype](self, message.body)
+
+	def changecipherspec(self, fragment):
+		# Le ChangeCipherSpec du pair précède son Finished, sans message de la poignée de main en cours de réception
+		if self.expected != HandshakeType.finished or self.pendingreader is None or len(self.handshakes.buffer) \
+				or fragment != b'\x01':
+			raise AlertException(AlertDescription.unexpected_message)
+		self.reader, self.pendingreader = self.pendingreader, None
+
+	def checkfinished(self, body):
+		if self.pendingreader is not None:
+			raise AlertException(AlertDescription.unexpected_message, 'Finished before ChangeCipherSpec')
+		if not hmac.compare_digest(bytes(body.verify_data), self.peerverify):
+			raise AlertException(AlertDescription.decrypt_error, 'Invalid Finished message')
+
+
+class ClientConnection(Connection):
+	# trusted: certificat (clé publique) attendu du serveur; None: le certificat n'est pas vérifié.
+	# session: session d'une connexion précédente à reprendre; après la poignée de main, session est celle à
+	# garder pour la prochaine connexion (None si le serveur n'en propose pas)
+	# falsestart: send() permis dès l'envoi du Finished du client lors d'une poignée de main complète avec une suite
+	# de FALSE_START_SUITES (cf RFC 7918): les données partent avec le Finished, un aller-retour plus tôt
+	# curves: courbes ECDHE proposées au serveur (par défaut: toutes celles connues)
+	def __init__(self, suites=None, trusted=None, session=None, falsestart=False, curves=None):
+		super().__init__(ConnectionEnd(ConnectionEnd.client), suites)
+		self.trusted = trusted
+		self.session = session
+		self.falsestart = falsestart
+		self.curves = list(curves) if curves is not None else sorted(NAMED_CURVES)
+		self.offeredid = b''  # identifiant de session envoyé dans le ClientHello
+		self.ticket = b''  # nouveau ticket reçu du serveur
+		self.ticketexpected = False  # le serveur enverra un NewSessionTicket
+		self.serverkey = None  # (courbe, clé publique) du certificat
+		self.curve = None
+		self.peerpoint = None
+
+	def start(self):
+		hello = ClientHello()
+		hello.cipher_suites.value = [CipherSuite(suite) for suite in self.suites]
+		hello.cipher_suites.vectsize = len(self.suites)
+		session = self.session
+		if session is not None:
+			# Reprise par ticket: identifiant aléatoire, que le serveur renvoie s'il accepte le ticket
+			self.offeredid = session.id or (os.urandom(32) if session.ticket else b'')
+			hello.session_id.setvalue(self.offeredid)
+		hello.extensions.add(ExtensionType.session_ticket, session.ticket if session is not None else b'')
+		hello.extensions.add(ExtensionType.elliptic_curves, encodecurves(self.curves))
+		hello.extensions.add(ExtensionType.ec_point_formats, encodepointformats())
+		self.state.clientRandom = bytes(hello.random)
+		self.handshake(HandshakeType.client_hello, hello)
+		self.flush()
+		self.expected = HandshakeType.server_hello
+
+	def serverhello(self, body):
+		if (int(body.server_version.major), int(body.server_version.minor)) != (3, 3):
+			raise AlertException(AlertDescription.protocol_version)
+		suite = bytes(body.cipher_suite)
+		if suite not in self.suites or suite not in SUITE_PARAMS or int(body.compression_method) != CompressionMethod.null:
+			raise AlertException(AlertDescription.illegal_parameter, 'Server chose an unoffered parameter')
+		self.negotiate(suite)
+		self.state.serverRandom = bytes(body.random)
+		self.sessionid = body.session_id.getvalue()
+		self.ticketexpected = body.extensions.find(ExtensionType.session_ticket) is not None
+		session = self.session
+		if self.offeredid and self.sessionid == self.offeredid:
+			# Session reprise: le serveur envoie directement (NewSessionTicket,) ChangeCipherSpec et Finished
+			if suite != session.suite:
+				raise AlertException(AlertDescription.illegal_parameter, 'Resumed session with another cipher suite')
+			self.resumed = True
+			self.state.masterSecret = session.masterSecret
+			self.keys()
+			self.expectfinished()
+		else:
+			self.expected = HandshakeType.certificate
+
+	def certificate(self, body):
+		if len(body.certificate_list) < 1:
+			raise AlertException(AlertDescription.bad_certificate, 'No server certificate')
+		certificate = bytes(body.certificate_list[0].value)
+		curve = CERTIFICATE_CURVES.get(len(certificate))
+		if curve is None:
+			raise AlertException(AlertDescription.unsupported_certificate)
+		if self.trusted is not None and certificate != self.trusted:
+			raise AlertException(AlertDescription.bad_certificate, 'Untrusted server certificate')
+		self.serverkey = (curve, decodepoint(curve, certificate))
+		self.expected = HandshakeType.server_key_exchange
+
+	def serverkeyexchange(self, body):
+		curve = NAMED_CURVES.get(int(body.named_curve))
+		if int(body.curve_type) != ECCurveType.named_curve or curve is None or int(body.named_curve) not in self.curves:
+			raise AlertException(AlertDescription.illegal_parameter, 'Server chose an unoffered curve')
+		point = bytes(body.public.value)
+		signed = body.signed_params
+		hashalgo = SIGNATURE_HASHES.get(int(signed.algorithm.hash))
+		if hashalgo is None or int(signed.algorithm.signature) != SignatureAlgorithm.ecdsa:
+			raise AlertException(AlertDescription.illegal_parameter, 'Unsupported signature algorithm')
+		params = struct.pack('!BHB', ECCurveType.named_curve, int(body.named_curve), len(point)) + point
+		certcurve, certkey = self.serverkey
+		signature = decodesignature(bytes(signed.signature.value))
+		if not ecc.verifysignature(certcurve, certkey, signature, self.state.clientRandom + self.state.serverRandom
+																	+ params, hashalgo):
+			raise AlertException(AlertDescription.decrypt_error, 'Invalid ServerKeyExchange signature')
+		self.curve = curve
+		self.peerpoint = decodepoint(curve, point)
+		self.expected = HandshakeType.server_hello_done
+
+	def serverhellodone(self, body):
+		ephemeral = ecc.ECEntity(self.curve)
+		exchange = ClientKeyExchange()
+		exchange.public.setvalue(encodepoint(self.curve, ephemeral.pubkey))
+		self.handshake(HandshakeType.client_key_exchange, exchange)
+		self.master(premaster(ephemeral, self.peerpoint))
+		self.keys()
+		self.changecipher()
+		self.finish(b'client finished')
+		self.falsestarted = self.falsestart and self.suite in FALSE_START_SUITES
+		self.expectfinished()
+
+	def expectfinished(self):
+		if self.ticketexpected:
+			self.expected = HandshakeType.new_session_ticket
+		else:
+			self.peerverify = self.verifydata(b'server finished')
+			self.expected = HandshakeType.finished
+
+	def newsessionticket(self, body):
+		self.ticket = bytes(body.ticket.value)
+		self.ticketexpected = False
+		self.expectfinished()
+
+	def finished(self, body):
+		self.checkfinished(body)
+		if self.resumed:
+			self.changecipher()
+			self.finish(b'client finished')
+		ticket = self.ticket or (self.session.ticket if self.resumed else b'')
+		if self.sessionid or ticket:
+			self.session = Session(self.sessionid, self.suite, self.state.masterSecret, ticket)
+		else:
+			self.session = None
+		self.expected = None
+		self.established = True
+		self.falsestarted = False
+
+	handlers = {HandshakeType.server_hello: serverhello, HandshakeType.certificate: certificate,
+				HandshakeType.server_key_exchange: serverkeyexchange, HandshakeType.server_hello_done: serverhellodone,
+				HandshakeType.new_session_ticket: newsessionticket, HandshakeType.finished: finished}
+
+
+class ServerConnection(Connection):
+	# key: clé ECDSA du serveur (ecc.ECEntity), envoyée comme certificat; curve: courbe des clés ECDHE éphémères.
+	# cache: SessionCache partagé entre les connexions du serveur (None: pas de reprise par identifiant);
+	# tickets: TicketKeys partagées entre les serveurs (None: pas de ticket de session)
+	# curve None: courbe choisie par policy parmi celles proposées par le client (par défaut: curvepolicy())
+	def __init__(self, key, curve=None, suites=None, cache=None, tickets=None, policy=None):
+		super().__init__(ConnectionEnd(ConnectionEnd.server), suites)
+		self.key = key
+		self.cache = cache
+		self.tickets = tickets
+		self.sendticket = False  # NewSessionTicket à envoyer avant ChangeCipherSpec
+		self.certificate = encodepoint(key.curve, key.pubkey)
+		self.fixedcurve = curve
+		self.policy = policy if policy is not None else curvepolicy()
+		self.namedcurve = None
+		self.ephemeral = None
+		self.expected = HandshakeType.client_hello
+
+	def clienthello(self, body):
+		if (int(body.client_version.major), int(body.client_version.minor)) < (3, 3):
+			raise AlertException(AlertDescription.protocol_version)
+		offered = set(bytes(suite) for suite in body.cipher_suites)
+		if CompressionMethod.null not in [int(m) for m in body.compression_methods]:
+			raise AlertException(AlertDescription.handshake_failure, 'Null compression not offered')
+		state = self.state
+		state.clientRandom = bytes(body.random)
+		sessionid = body.session_id.getvalue()
+		ticket = body.extensions.find(ExtensionType.session_ticket) if self.tickets is not None else None
+		session = None
+		if ticket:
+			session = self.tickets.open(ticket)
+			self.sendticket = session is None or not self.tickets.current(ticket)
+		elif self.cache is not None and sessionid:
+			session = self.cache.get(sessionid)
+		if session is not None and session.suite in offered and session.suite in self.suites:
+			self.resume(session, sessionid)
+			return
+		self.sendticket = ticket is not None
+		# Ordre de préférence du serveur
+		suite = next((s for s in self.suites if s in offered and s in SUITE_PARAMS), None)
+		if suite is None:
+			raise AlertException(AlertDescription.handshake_failure, 'No common cipher suite')
+		# Courbes et formats de points du client (extensions absentes: toutes les courbes, points non compressés)
+		curves = body.extensions.find(ExtensionType.elliptic_curves)
+		curves = decodecurves(curves) if curves is not None else None
+		formats = body.extensions.find(ExtensionType.ec_point_formats)
+		if formats is not None and ECPointFormat.uncompressed not in decodepointformats(formats):
+			raise AlertException(AlertDescription.illegal_parameter, 'Uncompressed points not supported')
+		if self.fixedcurve is not None:
+			self.namedcurve = self.fixedcurve if curves is None or self.fixedcurve in curves else None
+		else:
+			self.namedcurve = self.policy.choose(curves)
+		if self.namedcurve is None:
+			raise AlertException(AlertDescription.handshake_failure, 'No common curve')
+		self.negotiate(suite)
+		hello = ServerHello()
+		hello.cipher_suite.value = suite
+		if self.cache is not None:
+			self.sessionid = os.urandom(32)
+			hello.session_id.setvalue(self.sessionid)
+		if self.sendticket:
+			hello.extensions.add(ExtensionType.session_ticket)
+		if formats is not None:
+			hello.extensions.add(ExtensionType.ec_point_formats, encodepointformats())
+		state.serverRandom = bytes(hello.random)
+		self.handshake(HandshakeType.server_hello, hello)
+		certificates = CertificateStruct()
+		certificate = ASN1Cert()
+		certificate.setvalue(self.certificate)
+		certificates.certificate_list.value = [certificate]
+		certificates.certificate_list.vectsize = 1
+		self.handshake(HandshakeType.certificate, certificates)
+		curve = NAMED_CURVES[self.namedcurve]
+		self.ephemeral = ecc.ECEntity(curve)
+		point = encodepoint(curve, self.ephemeral.pubkey)
+		exchange = ServerKeyExchange()
+		exchange.named_curve.value = self.namedcurve
+		exchange.public.setvalue(point)
+		params = struct.pack('!BHB', ECCurveType.named_curve, self.namedcurve, len(point)) + point
+		hashid = PRF_SIGNATURE_HASH[self.prfhash]
+		signature = ecc.sign(self.key, state.clientRandom + state.serverRandom + params, SIGNATURE_HASHES[hashid])
+		exchange.signed_params.algorithm.hash.value = hashid
+		exchange.signed_params.algorithm.signature.value = SignatureAlgorithm.ecdsa
+		exchange.signed_params.signature.setvalue(encodesignature(signature))
+		self.handshake(HandshakeType.server_key_exchange, exchange)
+		self.handshake(HandshakeType.server_hello_done, ServerHelloDone())
+		self.flush()
+		self.expected = HandshakeType.client_key_exchange
+
+	def clientkeyexchange(self, body):
+		peer = decodepoint(self.ephemeral.curve, bytes(body.public.value))
+		self.master(premaster(self.ephemeral, peer))
+		self.keys()
+		self.ephemeral = None
+		self.peerverify = self.verifydata(b'client finished')
+		self.expected = HandshakeType.finished
+
+	def resume(self, session, sessionid):
+		# Poignée de main abrégée: ServerHello avec l'identifiant du client, (NewSessionTicket,) ChangeCipherSpec et
+		# Finished
+		self.resumed = True
+		self.negotiate(session.suite)
+		self.sessionid = sessionid
+		hello = ServerHello()
+		hello.cipher_suite.value = session.suite
+		hello.session_id.setvalue(sessionid)
+		if self.sendticket:
+			hello.extensions.add(ExtensionType.session_ticket)
+		self.state.serverRandom = bytes(hello.random)
+		self.state.masterSecret = session.masterSecret
+		self.handshake(HandshakeType.server_hello, hello)
+		self.keys()
+		if self.sendticket:
+			self.newticket()
+		self.changecipher()
+		self.finish(b'server finished')
+		self.peerverify = self.verifydata(b'client finished')
+		self.expected = HandshakeType.finished
+
+	def finished(self, body):
+		self.checkfinished(body)
+		if not self.resumed:
+			if self.sendticket:
+				self.newticket()
+			self.changecipher()
+			self.finish(b'server finished')
+			if self.cache is not None:
+				self.cache.put(Session(self.sessionid, self.suite, self.state.masterSecret))
+		self.expected = None
+		self.established = True
+
+	def newticket(self):
+		body = NewSessionTicket()
+		body.ticket_lifetime_hint.value = self.tickets.lifetime
+		body.ticket.setvalue(self.tickets.seal(Session(b'', self.suite, self.state.masterSecret)))
+		self.handshake(HandshakeType.new_session_ticket, body)
+
+	handlers = {HandshakeType.client_hello: clienthello, HandshakeType.client_key_exchange: clientkeyexchange,
+				HandshakeType.finished: finished}
+
+
+def runhandshake(client, server, csock, ssock):
+	# Poignée de main complète entre deux moteurs reliés par une paire de sockets; renvoie le nombre de vols
+	client.start()
+	flights = 0
+	while not (client.established and server.established):
+		for conn, sock, peer, peersock in ((client, csock, server, ssock), (server, ssock, client, csock)):
+			data = conn.outgoing()
+			if data:
+				flights += 1
+				sock.sendall(data)
+				received = 0
+				while received < len(data):
+					chunk = peersock.recv(65536)
+					received += len(chunk)
+					peer.receive(chunk)
+	return flights
+
+
+def firstbyte(client, server, csock, ssock, request, delay=0.0):
+	# Poignée de main puis première requête du client, dès que send() est permis; chaque vol n'est délivré au pair
+	# que delay secondes après son envoi (latence simulée sur une paire de sockets locale).
+	# Renvoie le temps jusqu'à la réception de la requête par le serveur, les données reçues et le nombre de vols
+	start = time.perf_counter()
+	client.start()
+	sent = False
+	flights = 0
+	while True:
+		if not sent and (client.established or client.falsestarted):
+			client.send(request)
+			sent = True
+		for conn, sock, peer, peersock in ((client, csock, server, ssock), (server, ssock, client, csock)):
+			data = conn.outgoing()
+			if data:
+				flights += 1
+				time.sleep(delay)
+				sock.sendall(data)
+				received = 0
+				appdata = b''
+				while received < len(data):
+					chunk = peersock.recv(65536)
+					received += len(chunk)
+					appdata += peer.receive(chunk)
+				if peer is server and appdata:
+					return time.perf_counter() - start, appdata, flights
+
+
+def tlstests():
+	# Codecs compilés des structures de taille fixe: même octets que le chemin générique
+	record = TLSPlainText(b'fragment')
+	record.type.value = RecordContentType.handshake
+	singletest('bytes(r) == b"\\x16\\x03\\x03\\x00\\x08fragment"', r=record)
+	singletest('CODECS[TLSPlainText].format == "1s1s1s2s"', CODECS=CODECS, TLSPlainText=TLSPlainText)
+	received = TLSPlainText(bytes(8))
+	singletest('r.read(b) == 13 and int(r.length) == 8 and r.version.minor.value == b"\\x03"', r=received, b=bytes(record))
+	singletest('bytes(r.fragment) == b"fragment" and bytes(r) == bytes(e)', r=received, e=record)
+	for elem in (ProtocolVersion(3, 1), Alert(AlertLevel.fatal, AlertDescription.bad_record_mac),
+				SignatureAndHashAlgorithm(HashAlgorithm.sha256, SignatureAlgorithm.ecdsa), RandomStruct.generate()):
+		generic = b''.join(bytes(child) for child in elem.value)
+		copy = type(elem)()
+		singletest('bytes(e) == g and c.read(g) == len(g) and bytes(c) == g', e=elem, c=copy, g=generic)
+	singletest('CODECS[RandomStruct].format == "4s28s"', CODECS=CODECS, RandomStruct=RandomStruct)
+	# Schémas compilés et chemin générique: mêmes résultats sur des messages complets et tronqués
+	hello = ClientHello()
+	hello.cipher_suites.value = list(CIPHER_SUITES)
+	hello.cipher_suites.vectsize = len(CIPHER_SUITES)
+	certificates = CertificateStruct()
+	for size in (300, 1, 70):
+		certificate = ASN1Cert()
+		certificate.setvalue(os.urandom(size))
+		certificates.certificate_list.value.append(certificate)
+	certificates.certificate_list.vectsize = 3
+	handshake = Handshake(None, HandshakeType.client_hello, hello.size())
+	handshake.body = hello
+	samples = ((ProtocolVersion(3, 1), ProtocolVersion), (Alert(AlertLevel.fatal), Alert), (hello, ClientHello),
+			(RandomStruct.generate(), RandomStruct), (SignatureAndHashAlgorithm(4, 3), SignatureAndHashAlgorithm),
+			(ServerHello(), ServerHello), (certificates, CertificateStruct), (ChangeCipherSpec(), ChangeCipherSpec),
+			(DigitallySigned(), DigitallySigned), (Extension(), Extension),
+			(handshake, lambda: Handshake(None, HandshakeType.client_hello, 0)),
+			(TLSPlainText(b'fragment'), lambda: TLSPlainText(bytes(8))))
+	for elem, factory in samples:
+		singletest('crosscheck(f, bytes(e))', crosscheck=crosscheck, f=factory, e=elem)
+	singletest('CODECS[ClientHello].size == 34 and "for" not in CODECS[ClientHello].source', CODECS=CODECS, ClientHello=ClientHello)
+	# Tailles en cache: une modification n'invalide que les éléments qui la contiennent
+	chain = CertificateStruct()
+	chain.certificate_list.value = [ASN1Cert() for i in range(50)]
+	chain.certificate_list.vectsize = 50
+	for certificate in chain.certificate_list.value:
+		certificate.setvalue(bytes(1000))
+	message = Handshake(None, HandshakeType.certificate, 0)
+	message.body = chain
+	record = TLSPlainText(message)
+	singletest('int(r.length) == m.size() == 4 + 3 + 50 * 1003 and r.size() == 5 + int(r.length)', r=record, m=message)
+	singletest('c._size is not None and c.certificate_list[7]._parent is c.certificate_list', c=chain)
+	chain.certificate_list[7].extend(b'abc')
+	singletest('r._size is None and m._size is None and c._size is None', r=record, m=message, c=chain)
+	singletest('r.size() == 5 + 4 + 3 + 50 * 1003 + 3', r=record)
+	# Décodage incrémental: enregistrements coupés n'importe où ou coalescés dans un même morceau
+	records = b''.join(bytes(TLSPlainText(payload)) for payload in (b'first', b'', b'x' * 300))
+	parser = RecordParser()
+	singletest('p.needed() == 5 and list(p.feed(r[:3])) == [] and p.needed() == 2', p=parser, r=records)
+	singletest('list(p.feed(r[3:7])) == [] and p.needed() == 3', p=parser, r=records)
+	messages = list(parser.feed(records[7:12])) + list(parser.feed(records[12:20])) + list(parser.feed(records[20:]))
+	singletest('[bytes(m.fragment) for m in r] == [b"first", b"", b"x" * 300] and p.needed() == 5', r=messages, p=parser)
+	completed = [i for i in range(len(records)) if list(parser.feed(records[i:i + 1]))]
+	singletest('c == [9, 14, 319]', c=completed)
+	# Messages Handshake répartis sur plusieurs enregistrements, plusieurs messages dans un enregistrement
+	hello = Handshake(None, HandshakeType.client_hello, 0)
+	hello.length.value = hello.body.size()
+	done = Handshake(None, HandshakeType.server_hello_done, 0)
+	flight = bytes(hello) + bytes(done)
+	handshakes = HandshakeParser()
+	messages = []
+	for record in RecordParser().feed(bytes(TLSPlainText(flight[:10])) + bytes(TLSPlainText(flight[10:]))):
+		messages += list(handshakes.feed(record.fragment.value))
+	singletest('[int(m.msg_type) for m in r] == [1, 14] and bytes(r[0]) == bytes(h)', r=messages, h=hello)
+	try:
+		list(RecordParser().feed(b'\x16\x03\x03\xff\xff'))
+		overflow = None
+	except AlertException as e:
+		overflow = e.description
+	singletest('o == a', o=overflow, a=AlertDescription.record_overflow)
+	# Messages pris dans un pool: le même objet est relu, avec les mêmes octets qu'un message neuf
+	other = Handshake(None, HandshakeType.client_hello, 0)
+	other.body.cipher_suites.value = list(CIPHER_SUITES)
+	other.body.cipher_suites.vectsize = len(CIPHER_SUITES)
+	other.length.value = other.body.size()
+	pool = HandshakePool()
+	pooled = HandshakeParser(pool=pool)
+	first = list(pooled.feed(bytes(other)))[0]
+	second, last = list(pooled.feed(flight))
+	singletest('s is f and bytes(s) == bytes(h) and int(l.msg_type) == 14 and (p.created, p.reused) == (2, 1)', s=second, f=first, h=hello, l=last, p=pool)
+	# Nouveau type de message enregistré
+	registerhandshake(99, lambda: Opaque(3))
+	message = list(HandshakeParser().feed(b'\x63\x00\x00\x03abc'))[0]
+	del HANDSHAKE_BODIES[99]
+	singletest('int(m.msg_type) == 99 and bytes(m.body) == b"abc"', m=message)
+	# Champs des sous-classes: descripteurs installés sur la classe, pas de __dict__ par instance
+	singletest('isinstance(ProtocolVersion.__dict__["major"], Field) and not hasattr(r, "__dict__")', ProtocolVersion=ProtocolVersion, Field=Field, r=received)
+	# Lecture tronquée: chemin générique
+	singletest('p.read(b"\\x05") and bytes(p) == b"\\x05\\x00"', p=ProtocolVersion())
+	# Changement de disposition (y compris dans une structure imbriquée): retour au chemin générique
+	received.version.major = Uint16(0x0303)
+	singletest('bytes(r)[:5] == b"\\x16\\x03\\x03\\x03\\x00" and r.fixedleaves() is None', r=received)
+	# Poignée de main ECDHE-ECDSA complète sur une paire de sockets: deux allers-retours, suite choisie par le serveur
+	key = ecc.ECEntity(ec.nistCurves[0])
+	certificate = encodepoint(key.curve, key.pubkey)
+	csock, ssock = socket.socketpair()
+	client = ClientConnection([TLS_ECDHE_ECDSA_WITH_256_CBC_SHA384, TLS_ECDHE_ECDSA_WITH_128_CBC_SHA], certificate)
+	server = ServerConnection(key, NamedCurve.secp192r1)
+	singletest('run(c, s, a, b) == 4 and c.suite == s.suite == bytes(TLS_ECDHE_ECDSA_WITH_128_CBC_SHA)', run=runhandshake, c=client, s=server, a=csock, b=ssock, TLS_ECDHE_ECDSA_WITH_128_CBC_SHA=TLS_ECDHE_ECDSA_WITH_128_CBC_SHA)
+	singletest('c.state.masterSecret == s.state.masterSecret and len(c.state.masterSecret) == 48', c=client, s=server)
+	client.send(b'x' * 40000)
+	server.send(b'pong')
+	records = client.outgoing()
+	singletest('s.receive(r) == b"x" * 40000 and c.receive(s.outgoing()) == b"pong" and len(r) > 40000 + 3 * 5', s=server, c=client, r=records)
+	# Enregistrements chiffrés en un lot et écrits par un seul appel à sendmsg, y compris après des écritures partielles
+	message = bytes(range(256)) * 160
+	client.send(message)
+	length = sum(len(r) for r in client.output)
+	singletest('len(c.output) == 2 * 3 and c.writeto(a) == 1 and not c.output', c=client, a=csock)
+	received = b''
+	while len(received) < length:
+		received += ssock.recv(65536)
+	singletest('s.receive(r) == m', s=server, r=received, m=message)
+
+	class Trickle:
+		# Socket qui n'accepte que 1000 octets par appel
+		def __init__(self):
+			self.data = b''
+
+		def sendmsg(self, buffers):
+			self.data += b''.join(bytes(b) for b in buffers)[:1000]
+			return min(1000, sum(len(b) for b in buffers))
+
+	trickle = Trickle()
+	client.send(message)
+	calls = client.writeto(trickle)
+	singletest('c == -(-len(t.data) // 1000) and s.receive(t.data) == m', c=calls, t=trickle, s=server, m=message)
+	csock.close()
+	ssock.close()
+	# Octets reçus un par un (sans entrées-sorties: le moteur n'attend rien), puis enregistrement modifié
+	client = ClientConnection([TLS_ECDHE_ECDSA_WITH_256_CBC_SHA384])
+	server = ServerConnection(key, NamedCurve.secp192r1)
+	client.start()
+	for byte in client.outgoing():
+		server.receive(bytes((byte,)))
+	client.receive(server.outgoing())
+	server.receive(client.outgoing())
+	client.receive(server.outgoing())
+	singletest('c.established and s.established and c.prfhash == "sha384"', c=client, s=server)
+	singletest('list(c.transcript.hashes) == list(s.transcript.hashes) == ["sha384"]', c=client, s=server)
+	# False Start: la requête part avec le Finished du client (3e vol) au lieu d'attendre celui du serveur (5e vol)
+	csock, ssock = socket.socketpair()
+	normal = firstbyte(ClientConnection(), ServerConnection(key, NamedCurve.secp192r1), csock, ssock, b'GET')
+	client = ClientConnection(falsestart=True)
+	server = ServerConnection(key, NamedCurve.secp192r1)
+	early = firstbyte(client, server, csock, ssock, b'GET')
+	singletest('n[1:] == (b"GET", 5) and e[1:] == (b"GET", 3)', n=normal, e=early)
+	singletest('c.falsestarted and not c.established and s.established', c=client, s=server)
+	server.send(b'OK')
+	singletest('c.receive(s.outgoing()) == b"OK" and c.established and not c.falsestarted', c=client, s=server)
+	csock.close()
+	ssock.close()
+	# Transcription: même condensat que le hachage des messages mis bout à bout, copies indépendantes
+	messages = [b'first', bytearray(b'second'), memoryview(b'third')]
+	transcript = Transcript()
+	for message in messages[:2]:
+		transcript.append(message)
+	fork = transcript.fork('sha384')
+	transcript.append(messages[2])
+	singletest('t.digest("sha256") == hashlib.sha256(b"firstsecondthird").digest() and t.digest("sha256") == t.digest("sha256")', t=transcript, hashlib=hashlib)
+	singletest('f.digest() == hashlib.sha384(b"firstsecond").digest() and t.digest("sha384") == hashlib.sha384(b"firstsecondthird").digest()', f=fork, t=transcript, hashlib=hashlib)
+	client.send(b'secret')
+	tampered = bytearray(client.outgoing())
+	tampered[-1] ^= 1
+	try:
+		server.receive(tampered)
+		description = None
+	except AlertException as e:
+		description = e.description
+	alert = server.outgoing()
+	singletest('d == AlertDescription.bad_record_mac and a[:1] == b"\\x15"', d=description, a=alert, AlertDescription=AlertDescription)
+	try:
+		client.receive(alert)
+		description = None
+	except AlertReceived as e:
+		description = e.description
+	singletest('d == AlertDescription.bad_record_mac and c.closed and c.outgoing() == b""', d=description, c=client, AlertDescription=AlertDescription)
+	# Type de message inconnu: alerte unexpected_message envoyée au pair
+	server = ServerConnection(key, NamedCurve.secp192r1)
+	try:
+		server.receive(bytes(TLSPlainText(b'\x63\x00\x00\x03abc')))
+		description = None
+	except AlertException as e:
+		description = e.description
+	singletest('d == AlertDescription.unexpected_message and s.outgoing()[:1] == b"\\x15"', d=description, s=server, AlertDescription=AlertDescription)
+	# Certificat non reconnu, aucune suite commune, point hors de la courbe
+	other = ecc.ECEntity(ec.nistCurves[0])
+	failures = []
+	for client in (ClientConnection(None, encodepoint(other.curve, other.pubkey)), ClientConnection([TLS_ECDH_ECDSA_WITH_128_CBC_SHA])):
+		server = ServerConnection(key, NamedCurve.secp192r1)
+		try:
+			client.start()
+			client.receive(server.receive(client.outgoing()) or server.outgoing())
+			failures.append(None)
+		except AlertException as e:
+			failures.append(e.description)
+	singletest('f == [AlertDescription.bad_certificate, AlertDescription.handshake_failure]', f=failures, AlertDescription=AlertDescription)
+	# Courbes: choix du serveur selon sa politique parmi celles du client, refus sans courbe acceptable commune
+	singletest('curvepolicy("cost:256").choose() == 23 and curvepolicy("security").choose([19, 23]) == 23 and CurvePolicy(384).choose([19, 23]) is None', curvepolicy=curvepolicy, CurvePolicy=CurvePolicy)
+	singletest('decodecurves(encodecurves([21, 24])) == [21, 24] and decodepointformats(encodepointformats()) == [0]', decodecurves=decodecurves, encodecurves=encodecurves, decodepointformats=decodepointformats, encodepointformats=encodepointformats)
+	csock, ssock = socket.socketpair()
+	client = ClientConnection(curves=[NamedCurve.secp384r1, NamedCurve.secp224r1])
+	server = ServerConnection(key, policy=curvepolicy('cost:224'))
+	singletest('run(c, s, a, b) == 4 and s.namedcurve == 21 and c.curve is NAMED_CURVES[21]', run=runhandshake, c=client, s=server, a=csock, b=ssock, NAMED_CURVES=NAMED_CURVES)
+	csock.close()
+	ssock.close()
+	failures = []
+	for server in (ServerConnection(key), ServerConnection(key, NamedCurve.secp256r1)):
+		client = ClientConnection(curves=[NamedCurve.secp192r1])
+		try:
+			client.start()
+			server.receive(client.outgoing())
+			failures.append(None)
+		except AlertException as e:
+			failures.append(e.description)
+	singletest('f == [AlertDescription.handshake_failure] * 2', f=failures, AlertDescription=AlertDescription)
+	point = bytearray(certificate)
+	point[-1] ^= 1
+	try:
+		decodepoint(key.curve, bytes(point))
+		rejected = False
+	except AlertException:
+		rejected = True
+	singletest('r', r=rejected)
+	# Reprise de session: poignée de main abrégée en un aller-retour et demi, sans opération à clé publique
+	now = [0.0]
+	cache = SessionCache(capacity=2, ttl=60, clock=lambda: now[0])
+	csock, ssock = socket.socketpair()
+	client = ClientConnection()
+	runhandshake(client, ServerConnection(key, NamedCurve.secp192r1, cache=cache), csock, ssock)
+	resumed = ClientConnection(session=client.session)
+	server = ServerConnection(key, NamedCurve.secp192r1, cache=cache)
+	singletest('run(c, s, a, b) == 3 and c.resumed and s.resumed and s.ephemeral is None and c.state.masterSecret == m', run=runhandshake, c=resumed, s=server, a=csock, b=ssock, m=client.state.masterSecret)
+	resumed.send(b'again')
+	singletest('s.receive(c.outgoing()) == b"again" and c.session.id == i', s=server, c=resumed, i=client.session.id)
+	# Session expirée: poignée de main complète et nouvelle session
+	now[0] = 61
+	fresh = ClientConnection(session=client.session)
+	singletest('run(c, ServerConnection(k, 19, cache=h), a, b) == 4 and not c.resumed and c.session.id != i', run=runhandshake, c=fresh, ServerConnection=ServerConnection, k=key, h=cache, a=csock, b=ssock, i=client.session.id)
+	singletest('h.stats()["hits"] == 1 and h.stats()["misses"] == 1 and h.stats()["expirations"] == 1 and len(h) == 1', h=cache)
+	csock.close()
+	ssock.close()
+	# Éviction: moins récemment utilisée d'abord, nombre de sessions et mémoire bornés
+	sessions = [Session(bytes((i,)) * 32, bytes(TLS_ECDHE_ECDSA_WITH_128_CBC_SHA), bytes(48)) for i in range(3)]
+	cache = SessionCache(capacity=2, clock=lambda: 0)
+	cache.put(sessions[0])
+	cache.put(sessions[1])
+	cache.get(sessions[0].id)
+	cache.put(sessions[2])
+	singletest('h.get(s[1].id) is None and h.get(s[0].id) is s[0] and h.stats()["evictions"] == 1', h=cache, s=sessions)
+	cache = SessionCache(maxbytes=2 * SessionCache.entrysize(sessions[0]), clock=lambda: 0)
+	for session in sessions:
+		cache.put(session)
+	singletest('len(h) == 2 and h.bytes <= h.maxbytes and h.get(s[0].id) is None', h=cache, s=sessions)
+	# Tickets de session: reprise sur un autre serveur qui a les mêmes clés, sans état partagé
+	now = [1000.0]
+	secret = os.urandom(32)
+	nodes = [TicketKeys([TicketKey.derive(secret, 0)], clock=lambda: now[0]) for i in range(2)]
+	csock, ssock = socket.socketpair()
+	client = ClientConnection()
+	singletest('run(c, ServerConnection(k, 19, tickets=t), a, b) == 4 and len(c.session.ticket) == 16 + 16 + 64 + 32', run=runhandshake, c=client, ServerConnection=ServerConnection, k=key, t=nodes[0], a=csock, b=ssock)
+	ticket = client.session.ticket
+	resumed = ClientConnection(session=client.session)
+	singletest('run(c, ServerConnection(k, 19, tickets=t), a, b) == 3 and c.resumed and c.session.ticket == i', run=runhandshake, c=resumed, ServerConnection=ServerConnection, k=key, t=nodes[1], a=csock, b=ssock, i=ticket)
+	singletest('c.state.masterSecret == m and t.stats() == {"keys": 1, "issued": 0, "accepted": 1, "rejected": 0}', c=resumed, m=client.state.masterSecret, t=nodes[1])
+	# Rotation: un ticket de la clé précédente est accepté et renouvelé, plus après le retrait de sa clé
+	nodes[1].rotate(TicketKey.derive(secret, 1))
+	resumed = ClientConnection(session=client.session)
+	singletest('run(c, ServerConnection(k, 19, tickets=t), a, b) == 3 and c.resumed and c.session.ticket[:16] == t.keys[0].name', run=runhandshake, c=resumed, ServerConnection=ServerConnection, k=key, t=nodes[1], a=csock, b=ssock)
+	nodes[1].rotate(TicketKey.derive(secret, 2))
+	singletest('t.open(i) is None and t.open(r.session.ticket) is not None and len(t.keys) == 2', t=nodes[1], i=ticket, r=resumed)
+	fresh = ClientConnection(session=client.session)
+	singletest('run(c, ServerConnection(k, 19, tickets=t), a, b) == 4 and not c.resumed and c.session.ticket != i', run=runhandshake, c=fresh, ServerConnection=ServerConnection, k=key, t=nodes[1], a=csock, b=ssock, i=ticket)
+	# Ticket modifié ou expiré: refusé
+	tampered = bytearray(fresh.session.ticket)
+	tampered[40] ^= 1
+	singletest('t.open(bytes(x)) is None and t.open(f.session.ticket) is not None', t=nodes[1], x=tampered, f=fresh)
+	now[0] += 86401
+	singletest('t.open(f.session.ticket) is None', t=nodes[1], f=fresh)
+	csock.close()
+	ssock.close()
+	# Signatures DER: entiers avec le bit de poids fort à 1 (octet nul en tête)
+	singletest('decodesignature(encodesignature((2**255, 5))) == (2**255, 5) and encodesignature((128, 1))[:5] == b"\\x30\\x07\\x02\\x02\\x00"', decodesignature=decodesignature, encodesignature=encodesignature)
+	# PRF: vecteur de test connu (SHA-256), et mêmes sorties que hmac.new pour les deux hachages et une clé longue
+	vector = prf(bytes.fromhex('9bbe436ba940f017b17652849a71db35'), b'test label',
+				bytes.fromhex('a0ba9f936cda311827a6f796ffd5198c'), 100)
+	singletest('len(v) == 100 and v[:16].hex() == "e3f229ba727be17b8d122620557cd453" and v[-4:].hex() == "87347b66"', v=vector)
+	for hashname, secret in (('sha256', b'k' * 48), ('sha384', b'k' * 48), ('sha256', b'k' * 200), ('sha384', b'k' * 200)):
+		singletest('PRF(k, h).mac(b"data") == hmac.new(k, b"data", h).digest()', PRF=PRF, hmac=hmac, k=secret, h=hashname)
+	singletest('P_SHA384(k, b"seed", 100)[48:96] == hmac.new(k, hmac.new(k, hmac.new(k, b"seed", "sha384").digest(), "sha384").digest() + b"seed", "sha384").digest()',
+				P_SHA384=P_SHA384, hmac=hmac, k=b'k' * 48)
+	singletest('P_SHA256(k, b"ab", 40) == prf(k, b"a", b"b", 40)', P_SHA256=P_SHA256, prf=prf, k=b'k' * 48)
+	material = keymaterial(b'm' * 48, b'c' * 32, b's' * 32, 20, 16, 4)
+	block = prf(b'm' * 48, b'key expansion', b's' * 32 + b'c' * 32, 80)
+	singletest('[len(x) for x in m] == [20, 20, 16, 16, 4, 4] and b"".join(m) == b', m=material, b=block)
+	return True
+
+
+def hellomemorybench(count=2000, suites=CIPHER_SUITES):
+	# Mémoire occupée par un ClientHello lu (objets de la couche de données, hors tampon reçu)
+	import tracemalloc
+	hello = ClientHello()
+	hello.cipher_suites.value = list(suites)
+	hello.cipher_suites.vectsize = len(suites)
+	received = bytes(hello)
+	tracemalloc.start()
+	before = tracemalloc.get_traced_memory()[0]
+	parsed = []
+	for i in range(count):
+		msg = ClientHello()
+		msg.read(received)
+		parsed.append(msg)
+	used = tracemalloc.get_traced_memory()[0] - before
+	tracemalloc.stop()
+	perhello = used / count
+	print('ClientHello (%d suites): %d bytes per parsed message' % (len(suites), perhello))
+	return perhello
+
+
+def prfbench(count=2000, hashname='sha256'):
+	# Dérivations d'une poignée de main (secret maître, bloc de clés AES-128/HMAC-SHA256, deux messages Finished):
+	# états ipad/opad précalculés contre hmac.new à chaque bloc
+	def plain(secret, label, seed, length):
+		seed = label + seed
+		out = b''
+		a = seed
+		while len(out) < length:
+			a = hmac.new(secret, a, hashname).digest()
+			out += hmac.new(secret, a + seed, hashname).digest()
+		return out[:length]
+
+	def derivations(derive, premaster, cr, sr, digest):
+		master = derive(premaster, b'master secret', cr + sr, 48)
+		derive(master, b'key expansion', sr + cr, 96)
+		derive(master, b'client finished', digest, 12)
+		derive(master, b'server finished', digest, 12)
+
+	def precomputed(premaster, cr, sr, digest):
+		master = mastersecret(premaster, cr, sr, hashname)
+		derive = PRF(master, hashname)
+		keymaterial(derive, cr, sr, 32, 16)
+		derive(b'client finished', digest, 12)
+		derive(b'server finished', digest, 12)
+
+	premaster, cr, sr, digest = os.urandom(32), os.urandom(32), os.urandom(32), os.urandom(32)
+	results = {}
+	for name, run in (('hmac.new', lambda: derivations(plain, premaster, cr, sr, digest)),
+					('precomputed', lambda: precomputed(premaster, cr, sr, digest))):
+		start = time.perf_counter()
+		for i in range(count):
+			run()
+		results[name] = (time.perf_counter() - start) / count * 1e6
+		print('PRF %-12s %8.2f us/handshake' % (name, results[name]))
+	return results
+
+
+def recordbench(cases=((None, 1 << 20), ('vectorised', 1 << 16)), repeat=3):
+	# Débit de l'envoi de données applicatives sur une paire de sockets locale (AES-128-CBC, HMAC-SHA1), pour chaque
+	# fournisseur AES (None: choix automatique) et taille: un enregistrement chiffré et un appel système à la fois,
+	# contre chiffrement en lot et sendmsg. Les moteurs natifs profitent du lot (blocs de plusieurs enregistrements
+	# par appel), mais restent lents: tailles plus petites
+	import threading
+	cp.select_provider(mode=cp.MODE_CBC)
+
+	def drain(sock):
+		while sock.recv(1 << 20):
+			pass
+
+	results = []
+	print('%-14s %-11s %10s %10s %10s' % ('provider', 'mode', 'size', 'MB/s', 'syscalls'))
+	for name, size in cases:
+		message = os.urandom(size)
+		for mode in ('per record', 'batched'):
+			best = None
+			for i in range(repeat):
+				protection = BlockProtection(bytes(16), bytes(20), 'sha1')
+				if name is not None:
+					protection.provider = cp.PROVIDERS[name]
+				csock, ssock = socket.socketpair()
+				reader = threading.Thread(target=drain, args=(ssock,))
+				reader.start()
+				start = time.perf_counter()
+				if mode == 'per record':
+					calls = 0
+					for fragment in fragments(memoryview(message)):
+						csock.sendall(protection.seal(RecordContentType.application_data, fragment))
+						calls += 1
+				else:
+					connection = ClientConnection()
+					connection.writer = protection
+					connection.established = True
+					connection.send(message)
+					calls = connection.writeto(csock)
+				csock.shutdown(socket.SHUT_WR)
+				reader.join()
+				elapsed = time.perf_counter() - start
+				csock.close()
+				ssock.close()
+				if best is None or elapsed < best:
+					best = elapsed
+			provider = protection.provider.name
+			results.append((provider, mode, size / best / 1e6, calls))
+			print('%-14s %-11s %10d %10.2f %10d' % (provider, mode, size, size / best / 1e6, calls))
+	return results
+
+
+def handshakedecodebench(count=2000):
+	# Décodage des messages Handshake reçus par un client (ServerHello, Certificate, ServerKeyExchange,
+	# ServerHelloDone): objets neufs à chaque message contre pool de la connexion
+	import tracemalloc
+	key = ecc.ECEntity(NAMED_CURVES[NamedCurve.secp256r1])
+	client = ClientConnection()
+	server = ServerConnection(key, NamedCurve.secp256r1)
+	client.start()
+	server.receive(client.outgoing())
+	records = server.outgoing()
+	flight = b''.join(bytes(record.fragment.value) for record in RecordParser().feed(records))
+	results = {}
+	for name, pool in (('fresh', None), ('pooled', HandshakePool())):
+		parser = HandshakeParser(pool=pool)
+		start = time.perf_counter()
+		for i in range(count):
+			for message in parser.feed(flight):
+				pass
+		elapsed = time.perf_counter() - start
+		tracemalloc.start()
+		for message in parser.feed(flight):
+			pass
+		allocated = tracemalloc.get_traced_memory()[1]
+		tracemalloc.stop()
+		results[name] = (elapsed / count * 1e6, allocated)
+		print('Handshake decode %-7s %8.2f us/flight %8d bytes peak' % (name, elapsed / count * 1e6, allocated))
+	return results
+
+
+def handshakebench(count=5, curves=(NamedCurve.secp192r1, NamedCurve.secp256r1, NamedCurve.secp384r1), resumed=20):
+	# Poignées de main complètes par seconde sur une paire de sockets locale (clé du serveur et clés ECDHE sur la
+	# même courbe)
+	# Poignées de main abrégées (reprise de session depuis un SessionCache ou par ticket): même mesure sur resumed
+	# fois plus de connexions
+	cp.select_provider(mode=cp.MODE_CBC)  # choix du moteur AES hors mesure
+	results = []
+	print('%-10s %-8s %12s %12s' % ('curve', 'mode', 'handshakes/s', 'ms/handshake'))
+	for named in curves:
+		key = ecc.ECEntity(NAMED_CURVES[named])
+		cache = SessionCache()
+		tickets = TicketKeys()
+		csock, ssock = socket.socketpair()
+		session = None
+		for mode, n in (('full', count), ('resumed', count * resumed), ('ticket', count * resumed)):
+			if mode == 'ticket':
+				client = ClientConnection()
+				runhandshake(client, ServerConnection(key, named, tickets=tickets), csock, ssock)
+				session = client.session
+			start = time.perf_counter()
+			for i in range(n):
+				client = ClientConnection(session=session if mode != 'full' else None)
+				runhandshake(client, ServerConnection(key, named, cache=cache if mode != 'ticket' else None,
+														tickets=tickets if mode == 'ticket' else None), csock, ssock)
+				session = client.session
+			elapsed = time.perf_counter() - start
+			results.append((named, mode, n / elapsed))
+			print('%-10d %-8s %12.2f %12.2f' % (named, mode, n / elapsed, elapsed / n * 1000))
+		csock.close()
+		ssock.close()
+	print('session cache:', cache.stats())
+	print('session tickets:', tickets.stats())
+	return results